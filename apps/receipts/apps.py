@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ReceiptsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.receipts'
+
+    def ready(self):
+        from django.db.models.signals import post_delete
+        from apps.receipts import signals  # noqa: F401
+        from apps.receipts.models import Receipt
+        from apps.receipts.services.sync_service import record_receipt_tombstone
+
+        post_delete.connect(record_receipt_tombstone, sender=Receipt, dispatch_uid='receipts.record_tombstone')
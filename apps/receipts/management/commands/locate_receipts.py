@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.receipts.models import Receipt
+from apps.receipts.tasks import fetch_and_store_restaurant, locate_receipt
+
+
+class Command(BaseCommand):
+    help = 'Backfill receipt locations: geocode processed receipts and enqueue unprocessed ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Receipts saved per batch')
+        parser.add_argument(
+            '--skip-unprocessed',
+            action='store_true',
+            help='Only geocode processed receipts, do not enqueue processing'
+        )
+
+    def handle(self, *args, **options):
+        located = self.locate_processed(options['batch_size'])
+
+        enqueued = 0
+        if not options['skip_unprocessed']:
+            for receipt_id in Receipt.objects.filter(is_processed=False).values_list('id', flat=True).iterator():
+                fetch_and_store_restaurant.delay(receipt_id)
+                enqueued += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Located {located} receipts, enqueued {enqueued} unprocessed receipts')
+        )
+
+    def locate_processed(self, batch_size):
+        """Geocode processed receipts without a location, returning how many got one"""
+        located = 0
+        last_id = 0
+        while True:
+            batch = list(
+                Receipt.objects.filter(is_processed=True, location__isnull=True, id__gt=last_id)
+                .order_by('id')[:batch_size]
+            )
+            if not batch:
+                return located
+            last_id = batch[-1].id
+
+            changed = []
+            for receipt in batch:
+                receipt.location = locate_receipt(receipt)
+                if receipt.location is not None:
+                    # bulk_update skips auto_now, delta sync needs the change
+                    receipt.updated_at = timezone.now()
+                    changed.append(receipt)
+            Receipt.objects.bulk_update(changed, ['location', 'updated_at'])
+            located += len(changed)
+            self.stdout.write(f'Located {located} receipts...')
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0003_receipt_location_geocodedaddress'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='receipts_re_user_id_435c86_idx'),
+        ),
+        migrations.CreateModel(
+            name='ReceiptTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('receipt_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_id', 'deleted_at', 'id'], name='receipts_re_user_id_1925f2_idx')],
+            },
+        ),
+    ]
@@ -1,6 +1,7 @@
 from datetime import date
 from django.db import models
 from django.conf import settings
+from django.contrib.gis.db import models as gis_models
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.db.models import Q
@@ -46,6 +47,10 @@ class Receipt(models.Model):
     
     # Keep URL field for cases where image is hosted elsewhere
     image_url = models.URLField(max_length=1024, blank=True, null=True)
+
+    # Geocoded address (or the restaurant's location), GiST indexed for
+    # radius queries
+    location = gis_models.PointField(geography=True, null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -56,8 +61,42 @@ class Receipt(models.Model):
             models.Index(fields=['user', 'date']),
             models.Index(fields=['date']),
             models.Index(fields=['user', '-date']),
+            # Delta sync walks a user's receipts by (updated_at, id)
+            models.Index(fields=['user', 'updated_at', 'id']),
         ]
     
     def __str__(self):
         return f"Receipt #{self.id} - {self.restaurant} - {self.date}"
-    
\ No newline at end of file
+
+
+class GeocodedAddress(models.Model):
+    """Persistent cache of geocoded receipt addresses; a null location is a known miss"""
+
+    normalized_address = models.TextField(unique=True)
+    location = gis_models.PointField(geography=True, null=True, blank=True, spatial_index=False)
+    provider = models.CharField(max_length=50, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.normalized_address
+
+
+class ReceiptTombstone(models.Model):
+    """
+    A deleted receipt, kept for delta sync until retention runs out.
+
+    ``user_id`` is a plain column so tombstones survive, and can be written
+    while, the user's own deletion cascades to their receipts.
+    """
+
+    user_id = models.BigIntegerField()
+    receipt_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'deleted_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"Receipt #{self.receipt_id} deleted at {self.deleted_at}"
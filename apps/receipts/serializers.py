@@ -5,13 +5,14 @@ from .models import Receipt
 
 class ReceiptSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True)
+    location = serializers.SerializerMethodField()
     
     class Meta:
         model = Receipt
         fields = [
             'id', 'user', 'date', 'price', 'address',
             'image', 'image_url', 'created_at', 'updated_at',
-            'is_processed', 'restaurant'
+            'is_processed', 'restaurant', 'location'
         ]
         read_only_fields = ['user', 'is_processed', 'created_at', 'updated_at']
         extra_kwargs = {
@@ -19,6 +20,12 @@ class ReceiptSerializer(serializers.ModelSerializer):
             'image_url': {'required': False},
         }
     
+    def get_location(self, obj):
+        """Geocoded point as {lat, lng}, None until the receipt is processed"""
+        if obj.location is None:
+            return None
+        return {'lat': obj.location.y, 'lng': obj.location.x}
+
     def validate(self, data):
         """
         Validate that either image or image_url is provided.
@@ -57,4 +64,23 @@ class ReceiptUpdateSerializer(serializers.ModelSerializer):
             'id', 'date', 'price', 'restaurant', 'address',
             'image', 'image_url'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class SpendingHeatmapQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    shape = serializers.ChoiceField(choices=['hex', 'square'], default='hex')
+    size = serializers.IntegerField(min_value=50, max_value=50_000, default=500, help_text="Cell size in meters")
+    user_ids = serializers.CharField(required=False, help_text="Comma separated, admins and managers only")
+
+    def validate_user_ids(self, value):
+        try:
+            return sorted({int(user_id) for user_id in value.split(',') if user_id.strip()})
+        except ValueError:
+            raise serializers.ValidationError("user_ids must be comma separated integers.")
+
+    def validate(self, data):
+        if data.get('start') and data.get('end') and data['start'] > data['end']:
+            raise serializers.ValidationError("start must not be after end.")
+        return data
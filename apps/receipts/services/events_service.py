@@ -0,0 +1,81 @@
+import json
+import logging
+
+import redis
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from apps.receipts.models import Receipt
+from apps.receipts.serializers import ReceiptSerializer
+from apps.restaurants.models import Restaurant
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_EVENT = 'receipt.processed'
+
+_publisher = None
+
+
+def receipt_channel(user_id):
+    return f"receipts:user:{user_id}"
+
+
+def get_events_url():
+    """Redis URL for receipt events, None when they are disabled"""
+    return getattr(settings, 'RECEIPT_EVENTS_REDIS_URL', None) or None
+
+
+def receipt_event(receipt):
+    """
+    Payload of a processed receipt: the receipt as the detail endpoint
+    returns it, plus the restaurant it was enriched with.
+    """
+    restaurant = Restaurant.objects.filter(id=receipt.restaurant_id).first()
+    return {
+        'receipt': ReceiptSerializer(receipt).data,
+        'restaurant': None if restaurant is None else {
+            'id': restaurant.id,
+            'name': restaurant.name,
+            'address': restaurant.address,
+            'rating': restaurant.rating,
+            'price_level': restaurant.price_level,
+            'location': None if restaurant.location is None else {
+                'lat': restaurant.location.y,
+                'lng': restaurant.location.x,
+            },
+        },
+    }
+
+
+def format_event(receipt_id, payload):
+    """One Server-Sent Events message"""
+    data = json.dumps(payload, cls=DjangoJSONEncoder)
+    return f"id: {receipt_id}\nevent: {PROCESSED_EVENT}\ndata: {data}\n\n"
+
+
+def publish_receipt_processed(receipt):
+    """
+    Publish a processed receipt to its owner's channel.
+
+    Events only spare clients a poll, so failures are logged and never
+    fail the caller; clients reconnecting still get the current state.
+    """
+    global _publisher
+    url = get_events_url()
+    if not url:
+        return
+    try:
+        if _publisher is None:
+            _publisher = redis.Redis.from_url(url)
+        message = json.dumps(
+            {'id': receipt.id, 'payload': receipt_event(receipt)}, cls=DjangoJSONEncoder
+        )
+        _publisher.publish(receipt_channel(receipt.user_id), message)
+    except Exception as e:
+        logger.warning(f"Could not publish processing event for receipt {receipt.id}: {e}")
+
+
+def processed_receipt_events(user, receipt_ids):
+    """Events of the given receipts that are already processed, for clients (re)connecting"""
+    receipts = Receipt.objects.filter(user=user, id__in=receipt_ids, is_processed=True).order_by('id')
+    return [format_event(receipt.id, receipt_event(receipt)) for receipt in receipts]
@@ -0,0 +1,103 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.utils.module_loading import import_string
+from geopy.geocoders import get_geocoder_for_service
+
+from apps.receipts.models import GeocodedAddress
+from common.cache import single_flight
+
+# How long a finished geocoding is reused by other workers before they
+# read it from GeocodedAddress instead
+GEOCODE_LOOKUP_TTL = 300
+
+_SEPARATORS = re.compile(r"\s*,\s*")
+
+
+def normalize_address(address):
+    """Lowercase, single spaces and ', ' between parts, so equivalent addresses share an entry"""
+    address = " ".join(str(address or "").lower().split())
+    return ", ".join(part for part in _SEPARATORS.split(address.strip(" ,.")) if part)
+
+
+class GeopyGeocoder:
+    """Any geopy geocoding service, Nominatim by default"""
+
+    def __init__(self, service='nominatim', timeout=5, **options):
+        self.name = service
+        self.geocoder = get_geocoder_for_service(service)(timeout=timeout, **options)
+
+    def geocode(self, address):
+        """Return (lat, lng) or None"""
+        location = self.geocoder.geocode(address)
+        if location is None:
+            return None
+        return location.latitude, location.longitude
+
+
+class LocalGeocoder:
+    """Offline stand-in resolving addresses from a fixed table, for tests and development"""
+
+    name = 'local'
+
+    def __init__(self, addresses=None):
+        self.addresses = {
+            normalize_address(address): tuple(coordinates)
+            for address, coordinates in (addresses or {}).items()
+        }
+
+    def geocode(self, address):
+        return self.addresses.get(normalize_address(address))
+
+
+def get_geocoder():
+    """Geocoder configured by settings.RECEIPT_GEOCODER ({'BACKEND': ..., 'OPTIONS': {...}})"""
+    config = getattr(settings, 'RECEIPT_GEOCODER', {})
+    backend = import_string(config.get('BACKEND', 'apps.receipts.services.geocoding_service.GeopyGeocoder'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+class GeocodingService:
+    """
+    Geocodes receipt addresses through a persistent address cache.
+
+    Every address is normalized and looked up in GeocodedAddress first, so
+    an address is sent to the geocoder once, ever. Misses are stored too
+    (with no location) and are not retried. Workers geocoding the same new
+    address at once share one call through ``single_flight``.
+    """
+
+    def __init__(self, geocoder=None):
+        self.geocoder = geocoder or get_geocoder()
+
+    def geocode(self, address):
+        """Point of ``address``, or None when it is empty or cannot be found"""
+        normalized = normalize_address(address)
+        if not normalized:
+            return None
+
+        cached = GeocodedAddress.objects.filter(normalized_address=normalized).first()
+        if cached is not None:
+            return cached.location
+
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        return single_flight(
+            f"geocode_{digest}",
+            lambda: self.geocode_and_store(normalized),
+            ttl=GEOCODE_LOOKUP_TTL,
+        )
+
+    def geocode_and_store(self, normalized):
+        coordinates = self.geocoder.geocode(normalized)
+        location = None
+        if coordinates is not None:
+            lat, lng = coordinates
+            location = Point(float(lng), float(lat), srid=4326)
+        # Another worker may have stored it in the meantime
+        GeocodedAddress.objects.get_or_create(
+            normalized_address=normalized,
+            defaults={'location': location, 'provider': self.geocoder.name},
+        )
+        return location
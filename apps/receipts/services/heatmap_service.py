@@ -0,0 +1,113 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from apps.receipts.models import Receipt
+from apps.restaurants.models import Restaurant
+from common.cache import versioned_key
+
+SHAPES = {'hex': 'ST_HexagonGrid', 'square': 'ST_SquareGrid'}
+
+
+def spending_namespace(user_id):
+    """Cache version namespace of a user's spending, bumped on every receipt change"""
+    return f"spending:{user_id}"
+
+
+class SpendingHeatmapService:
+    """
+    Lunch spending of one or more users binned over restaurant locations.
+
+    Binning runs in PostGIS: each receipt's restaurant location is binned
+    in Web Mercator into the ST_HexagonGrid or ST_SquareGrid cell around
+    it, so the work follows the number of receipts, not the area they
+    span, and only one row per non-empty cell leaves the database. Grids
+    are anchored at the Mercator origin and cell sizes are scaled by the
+    latitude of the points' center rounded to a whole degree. Cells line
+    up across time ranges as long as that latitude rounds the same.
+
+    Results are cached per users, range, shape and size. Keys carry the
+    ``spending:{id}`` versions that every receipt save and delete bumps
+    (see apps/receipts/signals.py), so changes show up immediately.
+    """
+
+    def __init__(self, user_ids, start=None, end=None, shape='hex', size_m=500, ttl=None):
+        if shape not in SHAPES:
+            raise ValueError(f"shape must be one of {', '.join(SHAPES)}")
+        self.user_ids = sorted(set(user_ids))
+        self.start = start
+        self.end = end
+        self.shape = shape
+        self.size_m = size_m
+        self.ttl = ttl or getattr(settings, 'SPENDING_HEATMAP_CACHE_TTL', 3600)
+
+    def cache_key(self):
+        params = f"{','.join(map(str, self.user_ids))}|{self.start}|{self.end}|{self.shape}|{self.size_m}"
+        digest = hashlib.sha1(params.encode()).hexdigest()
+        return versioned_key(f"spending_heatmap_{digest}", *(spending_namespace(user_id) for user_id in self.user_ids))
+
+    def get_bins(self):
+        key = self.cache_key()
+        bins = cache.get(key)
+        if bins is None:
+            bins = self.compute()
+            cache.set(key, bins, self.ttl)
+        return bins
+
+    def compute(self):
+        """Bins as dicts with the cell center, receipt count and total and average spend"""
+        sql = f"""
+            WITH points AS (
+                SELECT rc.id, rc.price, ST_Transform(r.location::geometry, 3857) AS geom
+                FROM {Receipt._meta.db_table} rc
+                JOIN {Restaurant._meta.db_table} r ON r.id = rc.restaurant_id
+                WHERE rc.user_id = ANY(%(user_ids)s)
+                  AND (%(start)s::date IS NULL OR rc.date >= %(start)s::date)
+                  AND (%(end)s::date IS NULL OR rc.date <= %(end)s::date)
+                  AND r.location IS NOT NULL
+            ),
+            scale AS (
+                -- Web Mercator stretches distances by 1 / cos(latitude)
+                SELECT %(size_m)s / cos(radians(round(ST_Y(ST_Transform(
+                    ST_Centroid(ST_SetSRID(ST_Extent(geom), 3857)), 4326
+                ))))) AS size
+                FROM points
+            ),
+            binned AS (
+                -- Only the cells around each point are generated, a point on
+                -- a shared edge counts in one cell only
+                SELECT DISTINCT ON (points.id) cell.i, cell.j, cell.geom AS cell, points.price
+                FROM points
+                CROSS JOIN scale
+                CROSS JOIN LATERAL {SHAPES[self.shape]}(scale.size, points.geom) AS cell
+                WHERE ST_Intersects(cell.geom, points.geom)
+                ORDER BY points.id, cell.i, cell.j
+            )
+            SELECT ST_Y(center), ST_X(center), count, total
+            FROM (
+                SELECT ST_Transform(ST_Centroid(cell), 4326) AS center, count(*) AS count, sum(price) AS total
+                FROM binned
+                GROUP BY i, j, cell
+            ) AS bins
+            ORDER BY total DESC
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'user_ids': self.user_ids,
+                'start': self.start,
+                'end': self.end,
+                'size_m': self.size_m,
+            })
+            rows = cursor.fetchall()
+
+        return [
+            {
+                'lat': round(lat, 6),
+                'lng': round(lng, 6),
+                'count': count,
+                'total': total,
+                'average': round(total / count, 2),
+            }
+            for lat, lng, count, total in rows
+        ]
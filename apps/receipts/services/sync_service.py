@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from apps.receipts.models import Receipt, ReceiptTombstone
+
+TOKEN_SALT = 'receipts.sync'
+
+
+class SyncTokenExpired(Exception):
+    """The token predates retained tombstones, the client has to sync from scratch"""
+
+
+def get_tombstone_retention():
+    return timedelta(days=getattr(settings, 'RECEIPT_TOMBSTONE_RETENTION_DAYS', 30))
+
+
+def record_receipt_tombstone(sender, instance, **kwargs):
+    """post_delete receiver: remember the deletion for delta sync"""
+    ReceiptTombstone.objects.create(user_id=instance.user_id, receipt_id=instance.id)
+
+
+def purge_tombstones():
+    """Delete tombstones past retention, returning how many were removed"""
+    deleted, _ = ReceiptTombstone.objects.filter(deleted_at__lt=timezone.now() - get_tombstone_retention()).delete()
+    return deleted
+
+
+class ReceiptSyncService:
+    """
+    Changes to a user's receipts since an opaque sync token.
+
+    The token is a signed pair of (timestamp, id) cursors, one over
+    receipts by ``updated_at`` and one over tombstones by ``deleted_at``.
+    Each call returns what changed after the cursors, in order and at most
+    ``limit`` of each, so traffic follows the number of changes, not the
+    size of the history.
+
+    Rows committed by a slow transaction can carry a timestamp older than
+    rows already returned. Changes are therefore only served once they
+    are ``settle_seconds`` old, so a cursor never moves past a timestamp
+    that can still appear.
+    """
+
+    def __init__(self, user, token=None, limit=100, settle_seconds=None):
+        self.user = user
+        self.limit = limit
+        self.settle_seconds = settle_seconds if settle_seconds is not None else getattr(
+            settings, 'RECEIPT_SYNC_SETTLE_SECONDS', 5
+        )
+        self.token = token
+
+    @staticmethod
+    def encode(receipts_cursor, tombstones_cursor):
+        return signing.dumps(
+            {
+                'r': None if receipts_cursor is None else [receipts_cursor[0].isoformat(), receipts_cursor[1]],
+                't': [tombstones_cursor[0].isoformat(), tombstones_cursor[1]],
+            },
+            salt=TOKEN_SALT,
+        )
+
+    @staticmethod
+    def decode(token):
+        """Return (receipts cursor or None, tombstones cursor); ValueError if invalid"""
+        try:
+            data = signing.loads(token, salt=TOKEN_SALT)
+            receipts = None if data['r'] is None else (parse_datetime(data['r'][0]), int(data['r'][1]))
+            tombstones = (parse_datetime(data['t'][0]), int(data['t'][1]))
+        except (signing.BadSignature, KeyError, TypeError, IndexError, ValueError):
+            raise ValueError("Invalid sync token")
+        if tombstones[0] is None or (receipts is not None and receipts[0] is None):
+            raise ValueError("Invalid sync token")
+        return receipts, tombstones
+
+    @staticmethod
+    def after(queryset, field, cursor):
+        if cursor is None:
+            return queryset
+        timestamp, last_id = cursor
+        return queryset.filter(Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': last_id}))
+
+    def get_changes(self):
+        """Return (changed receipts, deleted receipt ids, next token, has_more)"""
+        upper = timezone.now() - timedelta(seconds=self.settle_seconds)
+        if self.token:
+            receipts_cursor, tombstones_cursor = self.decode(self.token)
+            if tombstones_cursor[0] < timezone.now() - get_tombstone_retention():
+                raise SyncTokenExpired()
+        else:
+            # Deletions before the first sync don't concern the client
+            receipts_cursor, tombstones_cursor = None, (upper, 0)
+
+        receipts = list(
+            self.after(Receipt.objects.filter(user=self.user, updated_at__lt=upper), 'updated_at', receipts_cursor)
+            .order_by('updated_at', 'id')[:self.limit + 1]
+        )
+        tombstones = list(
+            self.after(
+                ReceiptTombstone.objects.filter(user_id=self.user.id, deleted_at__lt=upper),
+                'deleted_at', tombstones_cursor,
+            )
+            .order_by('deleted_at', 'id')
+            .values_list('id', 'receipt_id', 'deleted_at')[:self.limit + 1]
+        )
+        tombstones_drained = len(tombstones) <= self.limit
+        has_more = len(receipts) > self.limit or not tombstones_drained
+        receipts, tombstones = receipts[:self.limit], tombstones[:self.limit]
+
+        if receipts:
+            receipts_cursor = (receipts[-1].updated_at, receipts[-1].id)
+        if tombstones_drained:
+            # Every tombstone before ``upper`` has been seen, so the cursor
+            # moves up to it and stays within retention for active clients
+            tombstones_cursor = (upper, 0)
+        else:
+            tombstones_cursor = (tombstones[-1][2], tombstones[-1][0])
+        token = self.encode(receipts_cursor, tombstones_cursor)
+        return receipts, [receipt_id for _, receipt_id, _ in tombstones], token, has_more
@@ -1,10 +1,21 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from apps.receipts.models import Receipt
+from apps.receipts.services.heatmap_service import spending_namespace
 from apps.receipts.tasks import fetch_and_store_restaurant
+from common.cache import bump_version
 
 @receiver(post_save, sender=Receipt)
 def trigger_restaurant_fetch(sender, instance, created, **kwargs):
     if created:
-        fetch_and_store_restaurant.delay(instance.id)
+        # The worker has to see the committed receipt
+        transaction.on_commit(lambda: fetch_and_store_restaurant.delay(instance.id))
+
+
+@receiver(post_save, sender=Receipt)
+@receiver(post_delete, sender=Receipt)
+def invalidate_spending_heatmaps(sender, instance, **kwargs):
+    # Any field can change the bins, price and date edits included
+    bump_version(spending_namespace(instance.user_id))
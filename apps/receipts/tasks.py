@@ -1,70 +1,122 @@
 import logging
-from apps.restaurants.services.google_place_services import GooglePlacesService
+from apps.restaurants.services.google_place_services import GooglePlacesService, place_lookup_key
 from celery import shared_task
+from geopy.exc import GeocoderServiceError
 from apps.receipts.models import Receipt
+from apps.receipts.services.events_service import publish_receipt_processed
+from apps.receipts.services.geocoding_service import GeocodingService
+from apps.receipts.services.sync_service import purge_tombstones
 from apps.restaurants.models import Restaurant
 from django.db import transaction
 from requests.exceptions import RequestException
 from django.contrib.gis.geos import Point
 
+from common.cache import single_flight
+
 logger = logging.getLogger(__name__)
 
+# How long a finished lookup is reused by other workers for the same query
+PLACE_LOOKUP_TTL = 300
+
+
+def lookup_and_store_place(query):
+    """
+    Look up ``query`` with Google Places and upsert the matching restaurant.
+
+    Returns the restaurant id, or None when Places has no match.
+    """
+    service = GooglePlacesService()
+    result = service.search_text(query)
+
+    if not result or 'results' not in result or not result['results']:
+        return None
+
+    data = result['results'][0]
+
+    place_id = data.get('place_id')
+    name = data.get('name')
+    address = data.get('formatted_address')
+    location_data = data.get('geometry', {}).get('location', {})
+    latitude = location_data.get('lat')
+    longitude = location_data.get('lng')
+    rating = data.get('rating')
+    price_level = data.get('price_level')
+    types = data.get('types', [])
+    website = data.get('website', None)
+    phone_number = data.get('formatted_phone_number', None)
+    hours = data.get('opening_hours', None)
+
+    # Create Point from longitude and latitude if present
+    location_point = None
+    if latitude is not None and longitude is not None:
+        location_point = Point(float(longitude), float(latitude))  # Point(x=lng, y=lat)
+
+    restaurant, _ = Restaurant.objects.update_or_create(
+        place_id=place_id,
+        defaults={
+            'name': name,
+            'address': address,
+            'cuisine_types': types,
+            'rating': rating,
+            'price_level': price_level,
+            'location': location_point,
+            'website': website,
+            'phone_number': phone_number,
+            'hours': hours,
+        }
+    )
+    return restaurant.id
+
+
+def locate_receipt(receipt):
+    """Point of a receipt: its geocoded address, else its restaurant's location"""
+    try:
+        location = GeocodingService().geocode(receipt.address)
+    except GeocoderServiceError as e:
+        # Geocoding only enriches the receipt, it never blocks processing
+        logger.warning(f"Geocoding failed for receipt {receipt.id}: {e}")
+        location = None
+    if location is None:
+        location = Restaurant.objects.filter(id=receipt.restaurant_id).values_list('location', flat=True).first()
+    return location
+
+
 @shared_task(bind=True, autoretry_for=(RequestException,), retry_backoff=True, retry_kwargs={'max_retries': 3})
 def fetch_and_store_restaurant(self, receipt_id):
     try:
         receipt = Receipt.objects.select_related('restaurant').get(id=receipt_id)
-        if receipt.restaurant:
+        if receipt.is_processed:
             return
 
-        service = GooglePlacesService()
-        result = service.search_text(receipt.restaurant,receipt.address)
+        query = f"{receipt.restaurant.name} {receipt.address}"
 
-        if not result or 'results' not in result or not result['results']:
-            receipt.is_processed = True
-            receipt.save()
-            return
+        # Coworkers logging the same place at once share one lookup and upsert
+        restaurant_id = single_flight(
+            place_lookup_key(query),
+            lambda: lookup_and_store_place(query),
+            ttl=PLACE_LOOKUP_TTL,
+        )
 
-        data = result['results'][0]
-
-        place_id = data.get('place_id')
-        name = data.get('name')
-        address = data.get('formatted_address')
-        location_data = data.get('geometry', {}).get('location', {})
-        latitude = location_data.get('lat')
-        longitude = location_data.get('lng')
-        rating = data.get('rating')
-        price_level = data.get('price_level')
-        types = data.get('types', [])
-        website = data.get('website', None)
-        phone_number = data.get('formatted_phone_number', None)
-        hours = data.get('opening_hours', None)
-
-        # Create Point from longitude and latitude if present
-        location_point = None
-        if latitude is not None and longitude is not None:
-            location_point = Point(float(longitude), float(latitude))  # Point(x=lng, y=lat)
+        if restaurant_id:
+            receipt.restaurant_id = restaurant_id
+        location = locate_receipt(receipt)
 
         with transaction.atomic():
-            restaurant, _ = Restaurant.objects.update_or_create(
-                place_id=place_id,
-                defaults={
-                    'name': name,
-                    'address': address,
-                    'cuisine_types': types,
-                    'rating': rating,
-                    'price_level': price_level,
-                    'location': location_point,
-                    'website': website,
-                    'phone_number': phone_number,
-                    'hours': hours,
-                }
-            )
-            receipt.restaurant = restaurant
+            receipt.location = location
             receipt.is_processed = True
             receipt.save()
+            # Push to clients waiting on the receipt once it is visible to them
+            transaction.on_commit(lambda: publish_receipt_processed(receipt))
 
     except Receipt.DoesNotExist:
         logger.warning(f"Receipt {receipt_id} does not exist")
     except Exception as e:
         logger.error(f"Task failed for receipt {receipt_id}: {e}")
-        raise self.retry(exc=e)
\ No newline at end of file
+        raise self.retry(exc=e)
+
+
+@shared_task
+def purge_receipt_tombstones():
+    deleted = purge_tombstones()
+    logger.info(f"Purged {deleted} receipt tombstones")
+    return deleted
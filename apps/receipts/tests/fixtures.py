@@ -83,6 +83,14 @@ def use_local_storage(settings, monkeypatch):
     # Clean up after test
     shutil.rmtree(test_media_root, ignore_errors=True)
 
+@pytest.fixture(autouse=True)
+def use_local_geocoder(settings):
+    """Never call a real geocoding service from tests."""
+    settings.RECEIPT_GEOCODER = {
+        'BACKEND': 'apps.receipts.services.geocoding_service.LocalGeocoder',
+        'OPTIONS': {'addresses': {}},
+    }
+
 @pytest.fixture
 def sample_image():
     """Create a sample image file for testing."""
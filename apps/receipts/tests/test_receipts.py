@@ -257,3 +257,382 @@ class TestReceiptListCreateView:
         assert response.status_code == status.HTTP_200_OK
         assert response.data['count'] == 1  # No filtering applied
     
+
+
+@pytest.mark.django_db
+class TestPlaceLookupSingleFlight:
+    """Test that concurrent lookups for the same place share one API call."""
+
+    def test_concurrent_lookups_call_places_once(self, mocker):
+        """Test only one worker calls Google Places for the same query."""
+        import threading
+        import time
+        from django.core.cache import cache
+        from common.cache import single_flight
+
+        cache.clear()
+        calls = []
+
+        def slow_lookup():
+            calls.append(1)
+            time.sleep(0.2)
+            return 42
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    single_flight('place_lookup_test', slow_lookup, poll_interval=0.01)
+                )
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert results == [42] * 5
+
+    def test_task_reuses_handed_off_result(self, mocker):
+        """Test the task links the receipt to a restaurant found by another worker."""
+        from django.core.cache import cache
+        from apps.receipts.tasks import fetch_and_store_restaurant
+        from apps.restaurants.services.google_place_services import place_lookup_key
+
+        cache.clear()
+        receipt = ReceiptFactory()
+        found = RestaurantFactory(name="Found Restaurant")
+        search = mocker.patch(
+            'apps.receipts.tasks.GooglePlacesService.search_text'
+        )
+        query = f"{receipt.restaurant.name}   {receipt.address.upper()}"
+        cache.set(place_lookup_key(query), found.id, 300)
+
+        fetch_and_store_restaurant(receipt.id)
+
+        receipt.refresh_from_db()
+        search.assert_not_called()
+        assert receipt.restaurant_id == found.id
+        assert receipt.is_processed is True
+
+
+@pytest.mark.django_db
+class TestReceiptGeocoding:
+    """Test receipt addresses are geocoded once and searchable by distance."""
+
+    ADDRESSES = {'Unter den Linden 1, Berlin': (52.5170, 13.3889)}
+
+    @pytest.fixture(autouse=True)
+    def local_addresses(self, settings, use_local_geocoder):
+        from django.core.cache import cache
+
+        cache.clear()
+        settings.RECEIPT_GEOCODER['OPTIONS'] = {'addresses': self.ADDRESSES}
+
+    def test_geocoding_reuses_address_cache(self, mocker):
+        """Test equivalent addresses are sent to the geocoder once."""
+        from apps.receipts.models import GeocodedAddress
+        from apps.receipts.services.geocoding_service import GeocodingService, LocalGeocoder
+
+        geocode = mocker.spy(LocalGeocoder, 'geocode')
+        location = GeocodingService().geocode('Unter den Linden 1, Berlin')
+        again = GeocodingService().geocode('  unter den linden 1 ,berlin.')
+        missing = GeocodingService().geocode('Nowhere 1')
+
+        assert (location.y, location.x) == (52.5170, 13.3889)
+        assert again == location
+        assert missing is None
+        assert GeocodingService().geocode('nowhere 1') is None
+        assert geocode.call_count == 2
+        assert GeocodedAddress.objects.count() == 2
+
+    def test_task_stores_receipt_location(self, mocker):
+        """Test processing geocodes the receipt, falling back to the restaurant."""
+        from apps.receipts.tasks import fetch_and_store_restaurant
+
+        mocker.patch('apps.receipts.tasks.GooglePlacesService.search_text', return_value=None)
+        geocoded = ReceiptFactory(address='Unter den Linden 1, Berlin')
+        unknown = ReceiptFactory(address='Nowhere 1')
+
+        fetch_and_store_restaurant(geocoded.id)
+        fetch_and_store_restaurant(unknown.id)
+
+        geocoded.refresh_from_db()
+        unknown.refresh_from_db()
+        assert (geocoded.location.y, geocoded.location.x) == (52.5170, 13.3889)
+        assert unknown.location.coords == unknown.restaurant.location.coords
+
+    def test_list_receipts_near_location(self, authenticated_guest_client):
+        """Test the list can be filtered to receipts within a radius."""
+        from django.contrib.gis.geos import Point
+
+        client, user = authenticated_guest_client
+        near = ReceiptFactory(user=user, location=Point(13.3889, 52.5170))
+        ReceiptFactory(user=user, location=Point(13.4500, 52.5200))
+        ReceiptFactory(user=user)
+
+        url = reverse('receipt-list-create')
+        response = client.get(url, {'lat': 52.5175, 'lng': 13.3890, 'radius': 1})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [receipt['id'] for receipt in response.data['results']] == [near.id]
+        assert response.data['results'][0]['location'] == {'lat': 52.5170, 'lng': 13.3889}
+        assert client.get(url, {'lat': 'north', 'lng': 13.3890}).status_code == status.HTTP_400_BAD_REQUEST
+        for radius in (0, -1):
+            response = client.get(url, {'lat': 52.5175, 'lng': 13.3890, 'radius': radius})
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_locate_receipts_backfills_processed_receipts(self, mocker):
+        """Test the backfill geocodes processed receipts and enqueues unprocessed ones."""
+        from django.core.management import call_command
+        from apps.receipts.tasks import fetch_and_store_restaurant
+
+        processed = ReceiptFactory(address='Unter den Linden 1, Berlin', is_processed=True)
+        pending = ReceiptFactory(is_processed=False)
+        updated_at = processed.updated_at
+        delay = mocker.patch.object(fetch_and_store_restaurant, 'delay')
+
+        call_command('locate_receipts', batch_size=1)
+
+        processed.refresh_from_db()
+        assert (processed.location.y, processed.location.x) == (52.5170, 13.3889)
+        assert processed.updated_at > updated_at
+        delay.assert_called_once_with(pending.id)
+
+
+@pytest.mark.django_db
+class TestSpendingHeatmap:
+    """Test spending is binned over restaurant locations."""
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def test_bins_own_spending(self, authenticated_guest_client):
+        """Test receipts are summed per cell and new receipts show up."""
+        from django.contrib.gis.geos import Point
+
+        client, user = authenticated_guest_client
+        mitte = RestaurantFactory(location=Point(13.4050, 52.5200))
+        kreuzberg = RestaurantFactory(location=Point(13.4100, 52.4900))
+        ReceiptFactory(user=user, restaurant=mitte, price=Decimal('10.00'), date=date(2025, 3, 3))
+        ReceiptFactory(user=user, restaurant=mitte, price=Decimal('14.00'), date=date(2025, 3, 4))
+        ReceiptFactory(user=user, restaurant=kreuzberg, price=Decimal('9.00'), date=date(2025, 3, 5))
+        ReceiptFactory(restaurant=kreuzberg, price=Decimal('99.00'), date=date(2025, 3, 5))
+
+        url = reverse('receipt-spending-heatmap')
+        response = client.get(url, {'start': '2025-03-01', 'end': '2025-03-31', 'size': 1000})
+
+        assert response.status_code == status.HTTP_200_OK
+        bins = response.data['bins']
+        assert [(cell['count'], cell['total']) for cell in bins] == [(2, Decimal('24.00')), (1, Decimal('9.00'))]
+        assert bins[0]['lat'] == pytest.approx(52.52, abs=0.01)
+
+        # The cached heatmap is invalidated by the new receipt
+        ReceiptFactory(user=user, restaurant=kreuzberg, price=Decimal('30.00'), date=date(2025, 3, 6))
+        response = client.get(url, {'start': '2025-03-01', 'end': '2025-03-31', 'size': 1000})
+        assert [(cell['count'], cell['total']) for cell in response.data['bins']] == [
+            (2, Decimal('39.00')), (2, Decimal('24.00'))
+        ]
+
+        response = client.get(url, {'shape': 'square', 'size': 50_000})
+        assert [cell['count'] for cell in response.data['bins']] == [4]
+
+    def test_edited_receipt_updates_heatmap(self, authenticated_guest_client):
+        """Test price and date edits invalidate the cached heatmap."""
+        from django.contrib.gis.geos import Point
+
+        client, user = authenticated_guest_client
+        restaurant = RestaurantFactory(location=Point(13.4050, 52.5200))
+        receipt = ReceiptFactory(user=user, restaurant=restaurant, price=Decimal('10.00'), date=date(2025, 3, 3))
+        url = reverse('receipt-spending-heatmap')
+        params = {'start': '2025-03-01', 'end': '2025-03-31'}
+        assert [cell['total'] for cell in client.get(url, params).data['bins']] == [Decimal('10.00')]
+
+        receipt.price = Decimal('25.00')
+        receipt.save()
+        assert [cell['total'] for cell in client.get(url, params).data['bins']] == [Decimal('25.00')]
+
+        receipt.date = date(2025, 4, 1)
+        receipt.save()
+        assert client.get(url, params).data['bins'] == []
+
+    def test_team_heatmap_forbidden_for_guests(self, authenticated_guest_client):
+        """Test guests cannot bin other users' spending."""
+        client, user = authenticated_guest_client
+        other = UserFactory()
+
+        url = reverse('receipt-spending-heatmap')
+        response = client.get(url, {'user_ids': f'{user.id},{other.id}'})
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_team_heatmap_for_admins(self, authenticated_admin_client):
+        """Test admins can bin a team's spending."""
+        client, _ = authenticated_admin_client
+        first, second = UserFactory.create_batch(2)
+        ReceiptFactory(user=first, price=Decimal('10.00'))
+        ReceiptFactory(user=second, price=Decimal('12.00'))
+
+        url = reverse('receipt-spending-heatmap')
+        response = client.get(url, {'user_ids': f'{first.id},{second.id}'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [(cell['count'], cell['total']) for cell in response.data['bins']] == [(2, Decimal('22.00'))]
+
+
+@pytest.mark.django_db
+class TestReceiptSync:
+    """Test delta sync returns only changes since the token."""
+
+    @pytest.fixture(autouse=True)
+    def no_settle_delay(self, settings):
+        settings.RECEIPT_SYNC_SETTLE_SECONDS = 0
+
+    def test_sync_pages_then_returns_changes_and_deletions(self, authenticated_guest_client):
+        """Test a first sync pages through history, later syncs only see changes."""
+        client, user = authenticated_guest_client
+        updated, deleted, unchanged = ReceiptFactory.create_batch(3, user=user)
+        ReceiptFactory()
+        url = reverse('receipt-sync')
+
+        first = client.get(url, {'limit': 2}).data
+        second = client.get(url, {'limit': 2, 'token': first['token']}).data
+        assert first['has_more'] is True and second['has_more'] is False
+        assert sorted(r['id'] for r in first['changes'] + second['changes']) == sorted(
+            [updated.id, deleted.id, unchanged.id]
+        )
+
+        deleted_id = deleted.id
+        updated.price = Decimal('99.00')
+        updated.save()
+        deleted.delete()
+        changes = client.get(url, {'token': second['token']}).data
+        assert [r['id'] for r in changes['changes']] == [updated.id]
+        assert changes['deleted'] == [deleted_id]
+
+        idle = client.get(url, {'token': changes['token']}).data
+        assert (idle['changes'], idle['deleted']) == ([], [])
+
+    def test_invalid_and_expired_tokens(self, authenticated_guest_client):
+        """Test tampered tokens are rejected and old ones require a full sync."""
+        from django.utils import timezone
+        from apps.receipts.services.sync_service import ReceiptSyncService
+
+        client, _ = authenticated_guest_client
+        url = reverse('receipt-sync')
+        expired = ReceiptSyncService.encode(None, (timezone.now() - timedelta(days=31), 0))
+
+        assert client.get(url, {'token': 'tampered'}).status_code == status.HTTP_400_BAD_REQUEST
+        assert client.get(url, {'token': expired}).status_code == status.HTTP_410_GONE
+
+    def test_purge_removes_old_tombstones(self):
+        """Test tombstones past retention are purged."""
+        from django.utils import timezone
+        from apps.receipts.models import ReceiptTombstone
+        from apps.receipts.tasks import purge_receipt_tombstones
+
+        old, recent = ReceiptFactory.create_batch(2)
+        old_id, recent_id = old.id, recent.id
+        old.delete()
+        recent.delete()
+        ReceiptTombstone.objects.filter(receipt_id=old_id).update(deleted_at=timezone.now() - timedelta(days=31))
+
+        assert purge_receipt_tombstones() == 1
+        assert list(ReceiptTombstone.objects.values_list('receipt_id', flat=True)) == [recent_id]
+
+
+@pytest.mark.django_db
+class TestReceiptEvents:
+    """Test processed receipts are pushed to their owner's event stream."""
+
+    def test_task_publishes_after_commit(self, mocker, django_capture_on_commit_callbacks):
+        """Test the task publishes the processed receipt once its transaction commits."""
+        from apps.receipts.tasks import fetch_and_store_restaurant
+
+        mocker.patch('apps.receipts.tasks.GooglePlacesService.search_text', return_value=None)
+        publish = mocker.patch('apps.receipts.tasks.publish_receipt_processed')
+        receipt = ReceiptFactory()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            fetch_and_store_restaurant(receipt.id)
+            publish.assert_not_called()
+
+        published = publish.call_args.args[0]
+        assert published.id == receipt.id
+        assert published.is_processed is True
+
+    def test_created_receipt_is_processed_and_published(self, mocker, django_capture_on_commit_callbacks):
+        """Test creating a receipt enqueues processing, which publishes the processed receipt."""
+        from apps.receipts.tasks import fetch_and_store_restaurant
+
+        mocker.patch('apps.receipts.tasks.GooglePlacesService.search_text', return_value=None)
+        delay = mocker.patch.object(fetch_and_store_restaurant, 'delay', side_effect=fetch_and_store_restaurant)
+        publish = mocker.patch('apps.receipts.tasks.publish_receipt_processed')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            receipt = ReceiptFactory()
+
+        delay.assert_called_once_with(receipt.id)
+        receipt.refresh_from_db()
+        assert receipt.is_processed is True
+        assert publish.call_args.args[0].id == receipt.id
+
+    def test_publish_sends_event_to_user_channel(self, mocker, settings):
+        """Test the event goes to the owner's channel with the enriched restaurant."""
+        import json
+        from apps.receipts.services import events_service
+
+        settings.RECEIPT_EVENTS_REDIS_URL = 'redis://localhost:6379/0'
+        mocker.patch.object(events_service, '_publisher', None)
+        client = mocker.patch('apps.receipts.services.events_service.redis.Redis.from_url').return_value
+        receipt = ReceiptFactory(is_processed=True)
+
+        events_service.publish_receipt_processed(receipt)
+
+        channel, message = client.publish.call_args.args
+        event = json.loads(message)
+        assert channel == f"receipts:user:{receipt.user_id}"
+        assert event['id'] == receipt.id
+        assert event['payload']['restaurant']['name'] == receipt.restaurant.name
+
+    def test_publish_failure_does_not_raise(self, mocker, settings):
+        """Test an unreachable Redis only logs."""
+        from apps.receipts.services import events_service
+
+        settings.RECEIPT_EVENTS_REDIS_URL = 'redis://localhost:6379/0'
+        mocker.patch.object(events_service, '_publisher', None)
+        client = mocker.patch('apps.receipts.services.events_service.redis.Redis.from_url').return_value
+        client.publish.side_effect = ConnectionError("unreachable")
+
+        events_service.publish_receipt_processed(ReceiptFactory())
+
+    def test_connect_replays_already_processed_receipts(self, guest_user):
+        """Test receipts finished before the stream opened are sent on connect."""
+        from apps.receipts.services.events_service import processed_receipt_events
+
+        processed = ReceiptFactory(user=guest_user, is_processed=True)
+        pending = ReceiptFactory(user=guest_user, is_processed=False)
+        other = ReceiptFactory(is_processed=True)
+
+        events = processed_receipt_events(guest_user, [processed.id, pending.id, other.id])
+
+        assert len(events) == 1
+        assert events[0].startswith(f"id: {processed.id}\nevent: receipt.processed\n")
+
+    def test_stream_requires_authentication(self, async_client):
+        """Test the stream rejects requests without a valid token."""
+        from asgiref.sync import async_to_sync
+
+        response = async_to_sync(async_client.get)(reverse('receipt-events'), {'token': 'invalid'})
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_stream_is_not_served_over_wsgi(self, authenticated_guest_client):
+        """Test WSGI requests are refused instead of buffering the stream."""
+        client, _ = authenticated_guest_client
+        response = client.get(reverse('receipt-events'))
+        assert response.status_code == status.HTTP_501_NOT_IMPLEMENTED
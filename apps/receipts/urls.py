@@ -1,9 +1,12 @@
 from django.urls import path
 
-from apps.receipts.views import ReceiptListCreateView, ReceiptRetrieveUpdateDestroyView
+from apps.receipts.views import ReceiptListCreateView, ReceiptRetrieveUpdateDestroyView, ReceiptEventsView, ReceiptSyncView, SpendingHeatmapView
 
 
 urlpatterns = [
     path('receipts/', ReceiptListCreateView.as_view(), name='receipt-list-create'),
+    path('receipts/sync/', ReceiptSyncView.as_view(), name='receipt-sync'),
+    path('receipts/events/', ReceiptEventsView.as_view(), name='receipt-events'),
+    path('receipts/heatmap/', SpendingHeatmapView.as_view(), name='receipt-spending-heatmap'),
     path('receipts/<int:id>/', ReceiptRetrieveUpdateDestroyView.as_view(), name='receipt-detail'),
 ]
\ No newline at end of file
@@ -1,14 +1,33 @@
 from apps.receipts.models import Receipt
-from apps.receipts.serializers import ReceiptSerializer
-from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
+from apps.receipts.serializers import ReceiptSerializer, SpendingHeatmapQuerySerializer
+from apps.receipts.services.events_service import (
+    format_event, get_events_url, processed_receipt_events, receipt_channel,
+)
+from apps.receipts.services.heatmap_service import SpendingHeatmapService
+from apps.receipts.services.sync_service import ReceiptSyncService, SyncTokenExpired
+from rest_framework.generics import GenericAPIView, ListCreateAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.permissions import IsAuthenticated
-from rest_framework import parsers, filters
+from rest_framework import parsers, filters, status
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied, ValidationError
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from datetime import datetime
 from django.db.models import Q
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.authentication import JWTAuthentication
+import json
+import time
+import redis.asyncio
 
 from common.pagination import DefaultPagination
 from common.permissions import IsReceiptOwner
+from apps.users.roles import UserRoles
 
 
 class ReceiptListCreateView(ListCreateAPIView):
@@ -17,6 +36,7 @@ class ReceiptListCreateView(ListCreateAPIView):
     
     Supports:
     - Filtering by month (YYYY-MM format)
+    - Filtering by distance (lat, lng and radius in km, default 1)
     - Search by restaurant or address
     - Ordering by date, price, or created_at
     - Pagination
@@ -45,6 +65,19 @@ class ReceiptListCreateView(ListCreateAPIView):
                 )
             except ValueError:
                pass
+
+        # Receipts near a location, served by the GiST index on location
+        lat = self.request.query_params.get('lat')
+        lng = self.request.query_params.get('lng')
+        if lat or lng:
+            try:
+                point = Point(float(lng), float(lat), srid=4326)
+                radius = float(self.request.query_params.get('radius', 1))
+            except (TypeError, ValueError):
+                raise ValidationError({"error": "lat, lng and radius must be numbers"})
+            if not 0 < radius < float('inf'):
+                raise ValidationError({"error": "radius must be greater than 0"})
+            queryset = queryset.filter(location__dwithin=(point, D(km=radius)))
                 
         return queryset
 
@@ -63,4 +96,148 @@ class ReceiptRetrieveUpdateDestroyView(RetrieveUpdateDestroyAPIView):
     def perform_destroy(self, instance):
         if instance.image:
             instance.image.delete()  # Delete from S3
-        instance.delete()
\ No newline at end of file
+        instance.delete()
+
+
+class SpendingHeatmapView(GenericAPIView):
+    """
+    Lunch spending binned into hexagonal or square cells over restaurant locations.
+
+    Users see their own spending; admins and managers can pass user_ids
+    to see a team's.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = SpendingHeatmapQuerySerializer
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        user_ids = params.get('user_ids') or [request.user.id]
+        if user_ids != [request.user.id] and request.user.role not in (UserRoles.ADMIN, UserRoles.MANAGER):
+            raise PermissionDenied("Only admins and managers can see other users' spending.")
+
+        bins = SpendingHeatmapService(
+            user_ids,
+            start=params.get('start'),
+            end=params.get('end'),
+            shape=params['shape'],
+            size_m=params['size'],
+        ).get_bins()
+        return Response({
+            "shape": params['shape'],
+            "size_m": params['size'],
+            "user_ids": user_ids,
+            "bins": bins,
+        })
+
+
+class ReceiptSyncView(GenericAPIView):
+    """
+    Receipts changed and deleted since a sync token, for offline-first clients.
+
+    Call without ``token`` for a first sync, then with the returned token;
+    keep calling while ``has_more`` is true. A 410 means the token is older
+    than tombstone retention and the client has to sync from scratch.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = ReceiptSerializer
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 500)
+            changes, deleted, token, has_more = ReceiptSyncService(
+                request.user, token=request.query_params.get('token'), limit=limit
+            ).get_changes()
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except SyncTokenExpired:
+            return Response({"error": "Sync token expired, sync from scratch"}, status=status.HTTP_410_GONE)
+
+        return Response({
+            "changes": self.get_serializer(changes, many=True).data,
+            "deleted": deleted,
+            "token": token,
+            "has_more": has_more,
+        })
+
+
+def authenticate_jwt(request):
+    """User of the request's JWT, from the Authorization header or ``token``, else None"""
+    authentication = JWTAuthentication()
+    try:
+        raw_token = request.GET.get('token')
+        if raw_token:
+            # EventSource cannot set headers, browsers pass the token in the URL
+            return authentication.get_user(authentication.get_validated_token(raw_token))
+        result = authentication.authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return None if result is None else result[0]
+
+
+class ReceiptEventsView(View):
+    """
+    Server-Sent Events stream of the user's receipts finishing processing.
+
+    Replaces polling the receipt detail until ``is_processed`` is true: a
+    ``receipt.processed`` event carrying the receipt and its restaurant is
+    pushed the moment ``fetch_and_store_restaurant`` commits. Pass the ids
+    being waited on in ``receipts`` (comma separated) to also get events
+    for those that finished before the stream opened.
+
+    Only served through ``config.asgi`` (uvicorn, see the Dockerfile): an
+    open stream waiting on Redis then holds no worker thread. Under WSGI
+    the response would be buffered until the stream ends, so WSGI requests
+    get a 501. Streams close after RECEIPT_EVENTS_MAX_SECONDS and
+    EventSource reconnects.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        if not isinstance(request, ASGIRequest):
+            # WSGI collects the whole stream before sending any of it
+            return JsonResponse({"error": "Receipt events are only served through config.asgi"}, status=501)
+
+        user = await sync_to_async(authenticate_jwt)(request)
+        if user is None or not user.is_active:
+            return JsonResponse({"error": "Authentication credentials were not provided or are invalid"}, status=401)
+
+        url = get_events_url()
+        if not url:
+            return JsonResponse({"error": "Receipt events are not enabled"}, status=503)
+
+        try:
+            receipt_ids = [int(value) for value in request.GET.get('receipts', '').split(',') if value]
+        except ValueError:
+            return JsonResponse({"error": "receipts must be comma separated ids"}, status=400)
+
+        response = StreamingHttpResponse(self.stream(url, user, receipt_ids), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Keep reverse proxies from buffering events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    async def stream(self, url, user, receipt_ids):
+        keepalive = getattr(settings, 'RECEIPT_EVENTS_KEEPALIVE_SECONDS', 15)
+        closes_at = time.monotonic() + getattr(settings, 'RECEIPT_EVENTS_MAX_SECONDS', 300)
+        client = redis.asyncio.Redis.from_url(url)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(receipt_channel(user.id))
+            yield f"retry: {keepalive * 1000}\n\n"
+            # Subscribed first, so a receipt finishing now is in one of the two
+            for event in await sync_to_async(processed_receipt_events)(user, receipt_ids):
+                yield event
+
+            while time.monotonic() < closes_at:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=keepalive)
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event = json.loads(message['data'])
+                yield format_event(event['id'], event['payload'])
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class RestaurantsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.restaurants'
+
+    def ready(self):
+        from django.conf import settings
+        from apps.restaurants import signals  # noqa: F401
+
+        if getattr(settings, 'RESTAURANT_SPATIAL_INDEX_ENABLED', False):
+            from apps.restaurants.services.spatial_index import spatial_index
+            spatial_index.load_in_background()
+
+        if getattr(settings, 'RESTAURANT_TYPEAHEAD_INDEX_ENABLED', False):
+            from apps.restaurants.services.typeahead_index import typeahead_index
+            typeahead_index.load_in_background()
+
+        if getattr(settings, 'RESTAURANT_CLUSTER_INDEX_ENABLED', False):
+            from apps.restaurants.services.cluster_index import cluster_index
+            cluster_index.load_in_background()
@@ -0,0 +1,401 @@
+import math
+import random
+import statistics
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.gis.geos import Point
+from django.core.cache import cache, caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.receipts.models import Receipt
+from apps.restaurants.models import CuisineType, Restaurant, RestaurantStats, UserCuisineProfile
+from apps.restaurants.management.commands.benchmark_recommendations import (
+    BENCH_PREFIX,
+    CUISINES,
+    legacy_recommendations,
+    percentile,
+)
+from apps.restaurants.services.covisitation_service import CovisitationModelBuilder
+from apps.restaurants.services.hours_service import hours_bitmap
+from apps.restaurants.services.recommendation_service import RecommendationService
+
+User = get_user_model()
+
+HARNESS_PREFIX = f'{BENCH_PREFIX}harness_'
+
+# (restaurants, users, receipts) of each synthetic city preset
+CITY_PRESETS = {
+    'small': (10_000, 2_000, 100_000),
+    'medium': (100_000, 20_000, 1_000_000),
+    'large': (1_000_000, 50_000, 3_000_000),
+}
+
+# Berlin, Munich, Hamburg; restaurants are spread around them
+CITY_CENTERS = [(52.5200, 13.4050), (48.1351, 11.5820), (53.5511, 9.9937)]
+CITY_SPREAD_KM = 8
+
+# Request mix: radius weights and the share of requests with each filter
+RADIUS_MIX = {2: 0.3, 5: 0.5, 10: 0.2}
+AT_USUAL_PLACE = 0.7
+WITH_PRICE_FILTER = 0.15
+WITH_OPEN_AT = 0.25
+
+LUNCH_HOURS = {day: {'open': '11:00', 'close': '15:00'} for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday')}
+
+# Grid used to find restaurants near a user while generating visits
+_CELL_DEG = 0.01
+
+
+def offset_point(rng, lat, lng, sigma_km):
+    """Gaussian point around (lat, lng)"""
+    dlat = rng.gauss(0, sigma_km) / 111.32
+    dlng = rng.gauss(0, sigma_km) / (111.32 * math.cos(math.radians(lat)))
+    return lat + dlat, lng + dlng
+
+
+def cache_family(key):
+    for prefix, family in (('rec_tile', 'tile'), ('user_', 'user'), ('cache_version', 'version')):
+        if key.startswith(prefix):
+            return family
+    return 'other'
+
+
+@contextmanager
+def count_cache_hits(stats):
+    """Count hits and misses of the default cache per key family into ``stats``"""
+    backend = caches['default']
+    get, get_many = backend.get, backend.get_many
+    missing = object()
+
+    def counting_get(key, default=None, version=None):
+        value = get(key, missing, version=version)
+        stats[cache_family(key)][value is not missing] += 1
+        return default if value is missing else value
+
+    def counting_get_many(keys, version=None):
+        found = get_many(keys, version=version)
+        for key in keys:
+            stats[cache_family(key)][key in found] += 1
+        return found
+
+    backend.get, backend.get_many = counting_get, counting_get_many
+    try:
+        yield
+    finally:
+        del backend.get, backend.get_many
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic cities, replay a realistic request mix and report latency, '
+        'query counts, cache hit rates and offline recommendation quality'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--city', choices=CITY_PRESETS, default='small',
+                            help='Preset for the number of restaurants, users and receipts')
+        parser.add_argument('--restaurants', type=int, help='Override the preset')
+        parser.add_argument('--users', type=int, help='Override the preset')
+        parser.add_argument('--receipts', type=int, help='Override the preset')
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Requests replayed per code path')
+        parser.add_argument('--quality-users', type=int, default=500,
+                            help='Users whose held-out last visit is used for quality metrics')
+        parser.add_argument('--k', type=int, default=10, help='Cutoff for quality metrics')
+        parser.add_argument('--covisitation', action='store_true',
+                            help='Build the co-visitation model after seeding (replaces the global model)')
+        parser.add_argument('--skip-seed', action='store_true',
+                            help='Reuse data seeded by a previous run with the same seed and sizes')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete the seeded data afterwards')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        sizes = CITY_PRESETS[options['city']]
+        options['restaurants'] = options['restaurants'] or sizes[0]
+        options['users'] = options['users'] or sizes[1]
+        options['receipts'] = options['receipts'] or sizes[2]
+
+        # The plan is regenerated from the seed on every run, so held-out
+        # visits are known even when the data was seeded earlier
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        plan = self.build_plan(rng, options)
+        self.stdout.write(f"Generated plan in {time.perf_counter() - start:.1f}s")
+
+        if not options['skip_seed']:
+            self.seed(plan, options)
+        restaurant_ids, user_ids = self.load_ids(plan)
+
+        self.stdout.write(
+            "Cache note: the default cache is cleared before each path so every path starts cold"
+        )
+        requests = self.build_requests(rng, plan, options['requests'])
+        users = User.objects.in_bulk({user_ids[request['user']] for request in requests})
+        for label, run in (
+            ('sql', lambda service: service.get_recommendations(20)),
+            ('cached', lambda service: service.get_cached_recommendations(20, values=True)),
+        ):
+            self.replay(label, run, requests, users, user_ids)
+
+        self.evaluate_quality(rng, plan, restaurant_ids, user_ids, options)
+
+        if options['cleanup']:
+            self.cleanup()
+
+    def build_plan(self, rng, options):
+        """Deterministic restaurants, users and visits, held-out last visit per user"""
+        restaurants = []
+        cells = defaultdict(list)
+        for index in range(options['restaurants']):
+            city = index % len(CITY_CENTERS)
+            lat, lng = offset_point(rng, *CITY_CENTERS[city], CITY_SPREAD_KM)
+            restaurants.append({
+                'place_id': f'{HARNESS_PREFIX}{options["seed"]}_{index}',
+                'lat': lat,
+                'lng': lng,
+                'cuisines': rng.sample(CUISINES, rng.randint(1, 3)),
+                'rating': round(rng.uniform(2.0, 5.0), 1) if rng.random() > 0.05 else None,
+                'price_level': rng.randint(1, 4),
+                'hours': LUNCH_HOURS if rng.random() < 0.5 else None,
+            })
+            cells[(math.floor(lat / _CELL_DEG), math.floor(lng / _CELL_DEG))].append(index)
+
+        users = []
+        today = timezone.now().date()
+        visits_per_user = options['receipts'] / max(options['users'], 1)
+        for index in range(options['users']):
+            city = index % len(CITY_CENTERS)
+            favorites = set(rng.sample(CUISINES, 2))
+            # Office first: most lunches are near work
+            anchors = [offset_point(rng, *CITY_CENTERS[city], CITY_SPREAD_KM / 2) for _ in range(2)]
+            choices = [self.nearby_choices(rng, restaurants, cells, anchor, favorites) for anchor in anchors]
+
+            count = max(2, round(rng.expovariate(1 / visits_per_user)))
+            visits = []
+            for _ in range(count):
+                anchor = 0 if rng.random() < 0.7 else 1
+                candidates, weights = choices[anchor]
+                restaurant = rng.choices(candidates, cum_weights=weights)[0]
+                price_level = restaurants[restaurant]['price_level']
+                visits.append((
+                    today - timedelta(days=rng.randrange(365)),
+                    restaurant,
+                    anchor,
+                    Decimal(f"{rng.uniform(6, 12) + 4 * price_level:.2f}"),
+                ))
+            visits.sort()
+            users.append({
+                'email': f'{HARNESS_PREFIX}{options["seed"]}_{index}@example.com',
+                'favorites': favorites,
+                'anchors': anchors,
+                'visits': visits[:-1],
+                'holdout': visits[-1],
+            })
+        return {'restaurants': restaurants, 'users': users}
+
+    @staticmethod
+    def nearby_choices(rng, restaurants, cells, anchor, favorites):
+        """(restaurant indices, cumulative weights) around ``anchor``; favorites and good ratings weigh more"""
+        row, column = math.floor(anchor[0] / _CELL_DEG), math.floor(anchor[1] / _CELL_DEG)
+        candidates = [
+            index
+            for d_row in (-1, 0, 1)
+            for d_column in (-1, 0, 1)
+            for index in cells.get((row + d_row, column + d_column), [])
+        ]
+        if not candidates:
+            candidates = [rng.randrange(len(restaurants))]
+        cumulative, total = [], 0.0
+        for index in candidates:
+            restaurant = restaurants[index]
+            weight = (4.0 if favorites.intersection(restaurant['cuisines']) else 1.0) * (restaurant['rating'] or 2.5)
+            total += weight
+            cumulative.append(total)
+        return candidates, cumulative
+
+    def seed(self, plan, options, batch_size=10_000):
+        start = time.perf_counter()
+        # ids_for returns ids in id order, map them back by name
+        CuisineType.ids_for(CUISINES)
+        cuisine_ids = dict(CuisineType.objects.filter(name__in=CUISINES).values_list('name', 'id'))
+
+        restaurants = plan['restaurants']
+        for offset in range(0, len(restaurants), batch_size):
+            Restaurant.objects.bulk_create([
+                Restaurant(
+                    place_id=restaurant['place_id'],
+                    name=f"Harness Restaurant {offset + i}",
+                    address='',
+                    cuisine_types=restaurant['cuisines'],
+                    cuisine_ids=sorted(cuisine_ids[cuisine] for cuisine in restaurant['cuisines']),
+                    rating=restaurant['rating'],
+                    price_level=restaurant['price_level'],
+                    location=Point(restaurant['lng'], restaurant['lat'], srid=4326),
+                    hours=restaurant['hours'],
+                    hours_bitmap=hours_bitmap(restaurant['hours']),
+                )
+                for i, restaurant in enumerate(restaurants[offset:offset + batch_size])
+            ], ignore_conflicts=True)
+        self.stdout.write(f"Seeded {len(restaurants)} restaurants")
+
+        users = plan['users']
+        for offset in range(0, len(users), batch_size):
+            User.objects.bulk_create([
+                User(email=user['email'], username=user['email'])
+                for user in users[offset:offset + batch_size]
+            ], ignore_conflicts=True)
+        restaurant_ids, user_ids = self.load_ids(plan)
+
+        # bulk_create skips the signals that maintain cuisine profiles
+        now = timezone.now()
+        batch, profiles, total = [], [], 0
+        for index, user in enumerate(users):
+            weights = Counter()
+            for visit_date, restaurant, _, price in user['visits']:
+                batch.append(Receipt(
+                    user_id=user_ids[index],
+                    restaurant_id=restaurant_ids[restaurant],
+                    date=visit_date,
+                    price=price,
+                    address='',
+                    is_processed=True,
+                ))
+                visited_at = timezone.make_aware(datetime.combine(visit_date, datetime.min.time()))
+                for cuisine in restaurants[restaurant]['cuisines']:
+                    weights[cuisine] += UserCuisineProfile.decay_factor(visited_at, now)
+            profiles.append(UserCuisineProfile(user_id=user_ids[index], weights=dict(weights), decayed_at=now))
+            if len(batch) >= batch_size:
+                Receipt.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        Receipt.objects.bulk_create(batch)
+        total += len(batch)
+        UserCuisineProfile.objects.bulk_create(profiles, batch_size=batch_size, ignore_conflicts=True)
+        self.stdout.write(f"Seeded {len(users)} users with {total} receipts")
+
+        RestaurantStats.refresh(concurrently=False)
+        if options['covisitation']:
+            CovisitationModelBuilder().build()
+        with connection.cursor() as cursor:
+            for model in (Restaurant, Receipt, UserCuisineProfile):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+        self.stdout.write(f"Seeding took {time.perf_counter() - start:.1f}s")
+
+    @staticmethod
+    def load_ids(plan):
+        """Database ids of the planned restaurants and users, by plan index"""
+        restaurant_ids = dict(
+            Restaurant.objects.filter(place_id__startswith=HARNESS_PREFIX).values_list('place_id', 'id')
+        )
+        user_ids = dict(User.objects.filter(email__startswith=HARNESS_PREFIX).values_list('email', 'id'))
+        return (
+            [restaurant_ids[restaurant['place_id']] for restaurant in plan['restaurants']],
+            [user_ids[user['email']] for user in plan['users']],
+        )
+
+    @staticmethod
+    def build_requests(rng, plan, count):
+        radii, radius_weights = zip(*RADIUS_MIX.items())
+        lunch = timezone.make_aware(datetime(2026, 10, 19, 12, 30))
+        requests = []
+        for _ in range(count):
+            user = rng.randrange(len(plan['users']))
+            anchors = plan['users'][user]['anchors']
+            if rng.random() < AT_USUAL_PLACE:
+                lat, lng = offset_point(rng, *anchors[rng.random() >= 0.7], 0.2)
+            else:
+                lat, lng = offset_point(rng, *CITY_CENTERS[user % len(CITY_CENTERS)], CITY_SPREAD_KM)
+            requests.append({
+                'user': user,
+                'lat': lat,
+                'lng': lng,
+                'max_distance_km': rng.choices(radii, weights=radius_weights)[0],
+                'price_level': rng.randint(1, 4) if rng.random() < WITH_PRICE_FILTER else None,
+                'open_at': lunch if rng.random() < WITH_OPEN_AT else None,
+            })
+        return requests
+
+    def replay(self, label, run, requests, users, user_ids):
+        cache.clear()
+        timings, queries = [], []
+        hits = defaultdict(Counter)
+        with count_cache_hits(hits):
+            for request in requests:
+                service = RecommendationService(
+                    user=users[user_ids[request['user']]],
+                    lat=request['lat'],
+                    lng=request['lng'],
+                    max_distance_km=request['max_distance_km'],
+                    price_level=request['price_level'],
+                    open_at=request['open_at'],
+                )
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    run(service)
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(captured))
+
+        hit_rates = ' '.join(
+            f"{family}={counts[True] / (counts[True] + counts[False]):.0%}"
+            for family, counts in sorted(hits.items())
+        )
+        self.stdout.write(
+            f"{label:>7}: p50={percentile(timings, 50):.1f}ms p95={percentile(timings, 95):.1f}ms "
+            f"p99={percentile(timings, 99):.1f}ms queries/request={statistics.mean(queries):.2f} "
+            f"cache hits: {hit_rates or 'none'}"
+        )
+
+    def evaluate_quality(self, rng, plan, restaurant_ids, user_ids, options):
+        """
+        Leave-last-out evaluation: rank at the place of each sampled user's
+        held-out visit and look for that restaurant in the top ``k``.
+        """
+        k = options['k']
+        sample = rng.sample(range(len(plan['users'])), min(options['quality_users'], len(plan['users'])))
+        users = User.objects.in_bulk([user_ids[index] for index in sample])
+        cuisines_by_id = dict(zip(restaurant_ids, (r['cuisines'] for r in plan['restaurants'])))
+
+        for label, rank in (
+            ('ranked', lambda service: service.get_ranked_ids(k)),
+            ('legacy', lambda service: [r.id for r in legacy_recommendations(service, k)]),
+        ):
+            hits, reciprocal_ranks, favorite_share, recommended = 0, [], [], set()
+            for index in sample:
+                user = plan['users'][index]
+                _, restaurant, anchor, _ = user['holdout']
+                lat, lng = user['anchors'][anchor]
+                service = RecommendationService(users[user_ids[index]], lat, lng, max_distance_km=5)
+                ranked = rank(service)[:k]
+
+                target = restaurant_ids[restaurant]
+                if target in ranked:
+                    hits += 1
+                    reciprocal_ranks.append(1 / (ranked.index(target) + 1))
+                else:
+                    reciprocal_ranks.append(0.0)
+                if ranked:
+                    matching = sum(1 for i in ranked if user['favorites'].intersection(cuisines_by_id.get(i, [])))
+                    favorite_share.append(matching / len(ranked))
+                recommended.update(ranked)
+
+            self.stdout.write(
+                f"{label:>7}: hit@{k}={hits / len(sample):.3f} MRR@{k}={statistics.mean(reciprocal_ranks):.3f} "
+                f"favorite cuisines={statistics.mean(favorite_share or [0]):.2f} "
+                f"coverage={len(recommended) / len(restaurant_ids):.3%}"
+            )
+
+    def cleanup(self):
+        # Receipts protect restaurants, users cascade to their receipts and profiles
+        User.objects.filter(email__startswith=HARNESS_PREFIX).delete()
+        Restaurant.objects.filter(place_id__startswith=HARNESS_PREFIX).delete()
+        RestaurantStats.refresh(concurrently=False)
+        self.stdout.write("Removed seeded data")
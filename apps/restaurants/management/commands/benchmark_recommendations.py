@@ -0,0 +1,177 @@
+import math
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.restaurants.models import CuisineType, Restaurant
+from apps.restaurants.services.recommendation_service import RecommendationService
+from apps.restaurants.services.spatial_index import RestaurantSpatialIndex
+
+User = get_user_model()
+
+BENCH_PREFIX = 'bench_'
+CUISINES = [
+    'Italian', 'Chinese', 'Mexican', 'American', 'Indian', 'Thai',
+    'Japanese', 'French', 'Greek', 'Mediterranean', 'Pizza', 'Sushi',
+]
+
+
+def legacy_recommendations(service, limit):
+    """The pre-ranking implementation: three to four queries, rating before distance"""
+    user_cuisines = service.get_user_top_cuisines()
+
+    base_queryset = Restaurant.objects.filter(
+        location__isnull=False,
+        location__distance_lte=(service.user_location, D(km=service.max_distance_km))
+    )
+    if service.price_level is not None:
+        base_queryset = base_queryset.filter(price_level=service.price_level)
+    base_queryset = base_queryset.annotate(distance=Distance('location', service.user_location))
+
+    if user_cuisines:
+        preferred = (
+            base_queryset.filter(cuisine_types__overlap=user_cuisines)
+            .order_by('-rating', 'distance')
+        )
+        preferred_ids = list(preferred.values_list('id', flat=True)[:limit // 2])
+        preferred_restaurants = list(preferred.filter(id__in=preferred_ids))
+        other = (
+            base_queryset.exclude(id__in=preferred_ids)
+            .filter(rating__gte=3.5)
+            .order_by('-rating', 'distance')[:limit - len(preferred_restaurants)]
+        )
+        return (preferred_restaurants + list(other))[:limit]
+
+    return list(
+        base_queryset.filter(rating__gte=3.5)
+        .order_by('-rating', 'distance')[:limit]
+    )
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark single-query ranked recommendations against the legacy implementation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=1_000_000,
+                            help='Number of synthetic restaurants to seed')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Number of recommendation requests per implementation')
+        parser.add_argument('--max-distance', type=float, default=5,
+                            help='Search radius in km')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--lat', type=float, default=52.5200)
+        parser.add_argument('--lng', type=float, default=13.4050)
+        parser.add_argument('--spread-km', type=float, default=20,
+                            help='Radius around the center the restaurants are spread over')
+        parser.add_argument('--skip-seed', action='store_true',
+                            help='Reuse restaurants seeded by a previous run')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete the seeded restaurants afterwards')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--spatial-index', action='store_true',
+                            help='Also time radius queries against the in-process spatial index')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        if not options['skip_seed']:
+            self.seed_restaurants(rng, options)
+
+        user, _ = User.objects.get_or_create(
+            email='bench@example.com', defaults={'username': 'bench'}
+        )
+        points = [
+            self.random_point(rng, options['lat'], options['lng'], options['spread_km'] / 2)
+            for _ in range(options['requests'])
+        ]
+
+        for label, run in (
+            ('legacy', legacy_recommendations),
+            ('ranked', lambda service, limit: service.get_recommendations(limit)),
+        ):
+            timings, queries = [], []
+            for lng, lat in points:
+                service = RecommendationService(
+                    user=user, lat=lat, lng=lng,
+                    max_distance_km=options['max_distance'],
+                )
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    run(service, options['limit'])
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(len(captured))
+
+            self.stdout.write(
+                f"{label:>7}: p50={percentile(timings, 50):.1f}ms "
+                f"p95={percentile(timings, 95):.1f}ms p99={percentile(timings, 99):.1f}ms "
+                f"queries/request={statistics.mean(queries):.1f}"
+            )
+
+        if options['spatial_index']:
+            self.benchmark_spatial_index(points, options)
+
+        if options['cleanup']:
+            Restaurant.objects.filter(place_id__startswith=BENCH_PREFIX).delete()
+
+    def benchmark_spatial_index(self, points, options):
+        index = RestaurantSpatialIndex()
+        start = time.perf_counter()
+        index.load()
+        self.stdout.write(f"spatial index loaded in {time.perf_counter() - start:.1f}s")
+
+        timings = []
+        for lng, lat in points:
+            start = time.perf_counter()
+            index.get_candidates(lat, lng, options['max_distance'])
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(
+            f"  radius: p50={percentile(timings, 50):.2f}ms "
+            f"p95={percentile(timings, 95):.2f}ms p99={percentile(timings, 99):.2f}ms"
+        )
+
+    def random_point(self, rng, lat, lng, spread_km):
+        """Uniform point in a disc of ``spread_km`` around (lat, lng)"""
+        radius = spread_km * math.sqrt(rng.random())
+        angle = rng.uniform(0, 2 * math.pi)
+        dlat = radius * math.cos(angle) / 111.32
+        dlng = radius * math.sin(angle) / (111.32 * math.cos(math.radians(lat)))
+        return lng + dlng, lat + dlat
+
+    def seed_restaurants(self, rng, options, batch_size=10_000):
+        total = options['restaurants']
+        self.stdout.write(f'Seeding {total} restaurants...')
+        # ids_for returns ids in id order, map them back by name
+        CuisineType.ids_for(CUISINES)
+        cuisine_ids = dict(CuisineType.objects.filter(name__in=CUISINES).values_list('name', 'id'))
+        for offset in range(0, total, batch_size):
+            batch = []
+            for i in range(offset, min(offset + batch_size, total)):
+                lng, lat = self.random_point(rng, options['lat'], options['lng'], options['spread_km'])
+                cuisines = rng.sample(CUISINES, rng.randint(1, 3))
+                batch.append(Restaurant(
+                    place_id=f'{BENCH_PREFIX}{options["seed"]}_{i}',
+                    name=f'Bench Restaurant {i}',
+                    address='',
+                    cuisine_types=cuisines,
+                    cuisine_ids=sorted(cuisine_ids[cuisine] for cuisine in cuisines),
+                    rating=round(rng.uniform(2.0, 5.0), 1),
+                    price_level=rng.randint(1, 4),
+                    location=Point(lng, lat),
+                ))
+            Restaurant.objects.bulk_create(batch, ignore_conflicts=True)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Restaurant._meta.db_table}')
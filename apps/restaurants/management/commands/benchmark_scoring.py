@@ -0,0 +1,83 @@
+import math
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.restaurants.services.candidate_service import build_candidates
+from apps.restaurants.services.ranking_service import MIN_RATING, POPULARITY_SCALE, RankingService
+from apps.restaurants.management.commands.benchmark_recommendations import CUISINES, percentile
+from common.geo import haversine_km
+
+
+def python_scores(ranking, rows, lat, lng, max_distance_km):
+    """Per-candidate Python loop computing the same scores, for comparison"""
+    cuisines = set(ranking.cuisines)
+    scored = []
+    for i, restaurant_id in enumerate(rows['ids']):
+        distance_km = haversine_km(lat, lng, rows['lats'][i], rows['lngs'][i])
+        rating = rows['ratings'][i]
+        overlap = len(cuisines.intersection(rows['cuisine_lists'][i]))
+        if distance_km > max_distance_km or ((rating is None or rating < MIN_RATING) and not overlap):
+            continue
+        price_level = rows['price_levels'][i]
+        price = 0.5 if price_level is None else 1.0 - abs(price_level - ranking.target_price) / 4.0
+        score = (
+            ranking.weights['distance'] * math.exp(-distance_km * 1000 / ranking.decay_m)
+            + ranking.weights['rating'] * (rating or 0.0) / 5.0
+            + ranking.weights['cuisine'] * (overlap / len(cuisines) if cuisines else 0.0)
+            + ranking.weights['price'] * price
+            + ranking.weights['popularity'] * (1.0 - math.exp(-rows['visitors'][i] / POPULARITY_SCALE))
+        )
+        scored.append((score, -distance_km, restaurant_id))
+    scored.sort(reverse=True)
+    return scored
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark vectorized candidate scoring against a per-candidate Python loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 5000, 20000],
+                            help='Candidate set sizes to benchmark')
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        lat, lng, max_distance_km = 52.5200, 13.4050, 5.0
+        ranking = RankingService(max_distance_km, cuisines=rng.sample(CUISINES, 3))
+
+        for size in options['sizes']:
+            rows = {
+                'ids': list(range(size)),
+                'lngs': [lng + rng.uniform(-0.08, 0.08) for _ in range(size)],
+                'lats': [lat + rng.uniform(-0.05, 0.05) for _ in range(size)],
+                'ratings': [rng.choice([None, round(rng.uniform(2.0, 5.0), 1)]) for _ in range(size)],
+                'price_levels': [rng.choice([None, 1, 2, 3, 4]) for _ in range(size)],
+                'cuisine_lists': [rng.sample(CUISINES, rng.randint(1, 3)) for _ in range(size)],
+                'visitors': [rng.randint(0, 60) for _ in range(size)],
+            }
+            candidates = build_candidates(**rows)
+
+            vectorized, looped = [], []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                scores, distance_km = ranking.score_candidates(candidates, lat, lng, max_distance_km)
+                top = ranking.top_k(scores, distance_km, options['limit'])
+                vectorized.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                expected = python_scores(ranking, rows, lat, lng, max_distance_km)[:options['limit']]
+                looped.append((time.perf_counter() - start) * 1000)
+
+            if candidates['id'][top].tolist() != [restaurant_id for _, _, restaurant_id in expected]:
+                self.stderr.write(f"{size}: vectorized ranking differs from the Python loop")
+
+            self.stdout.write(
+                f"{size:>6} candidates: numpy mean={statistics.mean(vectorized):.3f}ms "
+                f"p99={percentile(vectorized, 99):.3f}ms | python mean={statistics.mean(looped):.3f}ms "
+                f"p99={percentile(looped, 99):.3f}ms"
+            )
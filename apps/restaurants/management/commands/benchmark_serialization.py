@@ -0,0 +1,71 @@
+import json
+import statistics
+import time
+
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import Distance
+from django.core.management.base import BaseCommand
+
+from apps.restaurants.models import Restaurant
+from apps.restaurants.serializers import RestaurantSerializer, represent_restaurant
+from apps.restaurants.management.commands.benchmark_recommendations import CUISINES, percentile
+
+
+class Command(BaseCommand):
+    help = 'Benchmark RestaurantSerializer against the values() fast path on recommendation-sized responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        restaurants, rows = [], []
+        for i in range(options['rows']):
+            cuisines = [CUISINES[i % len(CUISINES)]] if i % 5 else []
+            restaurant = Restaurant(
+                id=i,
+                place_id=f"bench_place_{i}",
+                name=f"Restaurant {i}",
+                address=f"Street {i}, Berlin",
+                cuisine_types=cuisines,
+                rating=None if i % 7 == 0 else 3.0 + (i % 20) / 10,
+                price_level=None if i % 9 == 0 else i % 4 + 1,
+                location=Point(13.4050 + i / 1000, 52.5200 + i / 2000),
+                website=f"https://example.com/{i}" if i % 2 else None,
+                phone_number=f"+49 30 {i:06d}" if i % 3 else None,
+            )
+            restaurant.distance = Distance(m=i * 137.5)
+            restaurants.append(restaurant)
+            rows.append({
+                'id': i,
+                'place_id': restaurant.place_id,
+                'name': restaurant.name,
+                'address': restaurant.address,
+                'cuisine_types': restaurant.cuisine_types,
+                'rating': restaurant.rating,
+                'price_level': restaurant.price_level,
+                'website': restaurant.website,
+                'phone_number': restaurant.phone_number,
+                'latitude': restaurant.location.y,
+                'longitude': restaurant.location.x,
+                'distance_km': restaurant.distance.km,
+            })
+
+        drf, fast = [], []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            expected = RestaurantSerializer(restaurants, many=True).data
+            drf.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            result = [represent_restaurant(row) for row in rows]
+            fast.append((time.perf_counter() - start) * 1000)
+
+        if json.dumps(result) != json.dumps(expected):
+            self.stderr.write("Fast path output differs from RestaurantSerializer")
+
+        self.stdout.write(
+            f"{options['rows']} rows: RestaurantSerializer mean={statistics.mean(drf):.3f}ms "
+            f"p99={percentile(drf, 99):.3f}ms | values fast path mean={statistics.mean(fast):.3f}ms "
+            f"p99={percentile(fast, 99):.3f}ms"
+        )
@@ -5,7 +5,8 @@ from django.utils import timezone
 from decimal import Decimal
 import random
 from apps.receipts.models import Receipt
-from apps.restaurants.models import Restaurant
+from apps.restaurants.models import CuisineType, Restaurant
+from apps.restaurants.services.hours_service import hours_bitmap
 from faker import Faker
 
 
@@ -117,12 +118,19 @@ class Command(BaseCommand):
                 'sunday': {'open': '10:00', 'close': '21:00'},
             }
         
+        # Resolve every cuisine id once instead of once per restaurant
+        all_cuisines = sorted({cuisine for cuisines in cuisine_types_options for cuisine in cuisines})
+        CuisineType.ids_for(all_cuisines)
+        cuisine_ids = dict(CuisineType.objects.filter(name__in=all_cuisines).values_list('name', 'id'))
+
         restaurants = []
         for i in range(count):
             # Generate coordinates around a central point (adjust as needed)
             # These coordinates are roughly around New York City
             lat = fake.latitude()
             lon = fake.longitude()
+            hours = generate_hours() if random.choice([True, False]) else None
+            cuisines = random.choice(cuisine_types_options)
             
             restaurant = Restaurant(
                 place_id=f"place_{fake.uuid4()}",
@@ -131,13 +139,16 @@ class Command(BaseCommand):
                     'Eatery', 'Diner', 'Bar & Grill'
                 ]),
                 address=fake.address(),
-                cuisine_types=random.choice(cuisine_types_options),
+                cuisine_types=cuisines,
+                # bulk_create skips save(), which derives cuisine_ids and hours_bitmap
+                cuisine_ids=sorted(cuisine_ids[cuisine] for cuisine in cuisines),
                 rating=round(random.uniform(2.0, 5.0), 1),
                 price_level=random.randint(1, 4),
                 location=Point(float(lon), float(lat)),
                 website=fake.url() if random.choice([True, False]) else None,
                 phone_number=fake.phone_number()[:20] if random.choice([True, False]) else None,
-                hours=generate_hours() if random.choice([True, False]) else None,
+                hours=hours,
+                hours_bitmap=hours_bitmap(hours),
                 created_at=fake.date_time_between(
                     start_date='-1y', 
                     end_date='now',
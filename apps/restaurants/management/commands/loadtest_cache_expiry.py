@@ -0,0 +1,84 @@
+import statistics
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.restaurants.services.candidate_service import CandidateService
+from common.cache import stale_while_revalidate
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer one tile candidate key across its expiry and report how many '
+        'PostGIS candidate queries hit the database per second'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Seconds to run each strategy')
+        parser.add_argument('--ttl', type=float, default=2,
+                            help='Cache TTL in seconds, short so the key expires during the run')
+        parser.add_argument('--max-distance', type=float, default=5)
+        parser.add_argument('--lat', type=float, default=52.5200)
+        parser.add_argument('--lng', type=float, default=13.4050)
+
+    def handle(self, *args, **options):
+        service = CandidateService()
+        tile = service.get_tile(options['lat'], options['lng'])
+        radius_km = options['max_distance']
+
+        def get_or_set(key, compute, ttl):
+            value = cache.get(key)
+            if value is None:
+                value = compute()
+                cache.set(key, value, ttl)
+            return value
+
+        def swr(key, compute, ttl):
+            return stale_while_revalidate(key, compute, ttl=ttl, grace=ttl)
+
+        for name, strategy in (('get/set', get_or_set), ('stale_while_revalidate', swr)):
+            key = f"loadtest_{name}_{tile}"
+            cache.delete(key)
+            queries = []
+            latencies = []
+            lock = threading.Lock()
+
+            def compute():
+                with lock:
+                    queries.append(time.monotonic())
+                return service.fetch_candidates(tile, radius_km)
+
+            start = time.monotonic()
+            deadline = start + options['duration']
+
+            def worker():
+                try:
+                    while time.monotonic() < deadline:
+                        begin = time.perf_counter()
+                        strategy(key, compute, options['ttl'])
+                        with lock:
+                            latencies.append((time.perf_counter() - begin) * 1000)
+                finally:
+                    connection.close()
+
+            threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # Queries per one-second bucket; get/set spikes at every expiry
+            buckets = [0] * (int(options['duration']) + 1)
+            for at in queries:
+                buckets[min(len(buckets) - 1, int(at - start))] += 1
+            latencies.sort()
+            self.stdout.write(
+                f"{name:>24}: {len(queries)} DB queries for {len(latencies)} requests, "
+                f"peak {max(buckets)}/s, per second {buckets} | "
+                f"mean={statistics.mean(latencies):.2f}ms p99={latencies[int(len(latencies) * 0.99) - 1]:.2f}ms"
+            )
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+from apps.restaurants.services.hours_service import hours_bitmap
+
+
+def backfill_hours_bitmap(apps, schema_editor):
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    batch = []
+    for restaurant in Restaurant.objects.filter(hours__isnull=False).only('id', 'hours').iterator(chunk_size=2000):
+        restaurant.hours_bitmap = hours_bitmap(restaurant.hours)
+        batch.append(restaurant)
+        if len(batch) >= 2000:
+            Restaurant.objects.bulk_update(batch, ['hours_bitmap'])
+            batch = []
+    Restaurant.objects.bulk_update(batch, ['hours_bitmap'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0003_usercuisineprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='hours_bitmap',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_hours_bitmap, migrations.RunPython.noop),
+    ]
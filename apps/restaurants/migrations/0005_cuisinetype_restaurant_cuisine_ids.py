@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-19 16:20
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0004_restaurant_hours_bitmap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CuisineType',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='cuisine_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.RemoveIndex(
+            model_name='restaurant',
+            name='restaurants_cuisine_c26f70_idx',
+        ),
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT INTO restaurants_cuisinetype (name)
+                SELECT DISTINCT unnest(cuisine_types) FROM restaurants_restaurant
+                ON CONFLICT (name) DO NOTHING
+                """,
+                """
+                UPDATE restaurants_restaurant r
+                SET cuisine_ids = ARRAY(
+                    SELECT DISTINCT c.id
+                    FROM unnest(r.cuisine_types) AS n(name)
+                    JOIN restaurants_cuisinetype c ON c.name = n.name
+                    ORDER BY 1
+                )
+                WHERE cardinality(r.cuisine_types) > 0
+                """,
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['cuisine_ids'], name='restaurants_cuisine_ids_gin'),
+        ),
+    ]
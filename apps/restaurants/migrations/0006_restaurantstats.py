@@ -0,0 +1,47 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0002_remove_receipt_price_positive_and_more'),
+        ('restaurants', '0005_cuisinetype_restaurant_cuisine_ids'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE MATERIALIZED VIEW restaurants_restaurantstats AS
+                SELECT
+                    restaurant_id,
+                    COUNT(*)::integer AS visit_count,
+                    COUNT(DISTINCT user_id)::integer AS unique_visitors,
+                    AVG(price)::numeric(10, 2) AS avg_spend,
+                    (percentile_cont(0.5) WITHIN GROUP (ORDER BY price::double precision))::numeric(10, 2) AS median_spend
+                FROM receipts_receipt
+                GROUP BY restaurant_id
+                """,
+                # REFRESH ... CONCURRENTLY needs a unique index
+                "CREATE UNIQUE INDEX restaurants_restaurantstats_pk ON restaurants_restaurantstats (restaurant_id)",
+            ],
+            reverse_sql="DROP MATERIALIZED VIEW restaurants_restaurantstats",
+        ),
+        migrations.CreateModel(
+            name='RestaurantStats',
+            fields=[
+                ('restaurant', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='stats', serialize=False, to='restaurants.restaurant')),
+                ('visit_count', models.IntegerField()),
+                ('unique_visitors', models.IntegerField()),
+                ('avg_spend', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('median_spend', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                'db_table': 'restaurants_restaurantstats',
+                'managed': False,
+            },
+        ),
+    ]
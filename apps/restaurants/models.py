@@ -1,7 +1,35 @@
-from django.db import models
+from datetime import datetime, time
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Upper
 from django.contrib.gis.db import models as gis_models
+from apps.restaurants.services.hours_service import hours_bitmap
+
+class CuisineType(models.Model):
+    """Vocabulary of cuisine names, giving each a compact integer id"""
+
+    name = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def ids_for(cls, names, create=True):
+        """Sorted ids of ``names``, adding unknown names when ``create`` is set"""
+        names = list(dict.fromkeys(names or []))
+        if not names:
+            return []
+        known = dict(cls.objects.filter(name__in=names).values_list('name', 'id'))
+        missing = [name for name in names if name not in known]
+        if create and missing:
+            cls.objects.bulk_create([cls(name=name) for name in missing], ignore_conflicts=True)
+            known.update(cls.objects.filter(name__in=missing).values_list('name', 'id'))
+        return sorted(known[name] for name in names if name in known)
+
 
 class Restaurant(models.Model):
     place_id = models.CharField(max_length=255, unique=True)
@@ -12,6 +40,9 @@ class Restaurant(models.Model):
         blank=True,
         default=list
     )
+    # CuisineType ids of cuisine_types, kept in sync on save and GIN indexed
+    # so overlap filters can use an index
+    cuisine_ids = ArrayField(models.BigIntegerField(), blank=True, default=list, editable=False)
     rating = models.FloatField(
         null=True,
         blank=True,
@@ -28,6 +59,8 @@ class Restaurant(models.Model):
     website = models.URLField(null=True, blank=True)
     phone_number = models.CharField(max_length=20, null=True, blank=True)
     hours = models.JSONField(null=True, blank=True)
+    # Derived from hours on save, see hours_service for the layout
+    hours_bitmap = models.BinaryField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -36,11 +69,186 @@ class Restaurant(models.Model):
         indexes = [
             models.Index(fields=['place_id']),
             models.Index(fields=['name']),
-            models.Index(fields=['cuisine_types']),
+            # Serves name__istartswith (UPPER(name) LIKE 'X%'), the typeahead fallback
+            models.Index(OpClass(Upper('name'), name='text_pattern_ops'), name='restaurants_name_prefix'),
+            GinIndex(fields=['cuisine_ids'], name='restaurants_cuisine_ids_gin'),
             models.Index(fields=['rating']),
             gis_models.Index(fields=["location"]),
         ]
 
     def __str__(self):
         return f"{self.name} ({self.place_id})"
+
+    # Columns derived from another column on save
+    DERIVED_FIELDS = {'hours': 'hours_bitmap', 'cuisine_types': 'cuisine_ids'}
+
+    # cuisine_types as loaded or last saved, None for new instances
+    _saved_cuisine_types = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'cuisine_types' in instance.__dict__:
+            instance._saved_cuisine_types = list(instance.cuisine_types)
+        return instance
+
+    def cuisine_types_changed(self, update_fields=None):
+        if update_fields is not None:
+            return 'cuisine_types' in update_fields
+        if 'cuisine_types' in self.get_deferred_fields():
+            return False
+        return self._saved_cuisine_types is None or self.cuisine_types != self._saved_cuisine_types
+
+    def save(self, *args, **kwargs):
+        self.hours_bitmap = hours_bitmap(self.hours)
+        update_fields = kwargs.get('update_fields')
+        # Resolving cuisine ids is a query, skip it when cuisines are untouched
+        if self.cuisine_types_changed(update_fields):
+            self.cuisine_ids = CuisineType.ids_for(self.cuisine_types)
+        if update_fields is not None:
+            derived = {self.DERIVED_FIELDS[field] for field in update_fields if field in self.DERIVED_FIELDS}
+            kwargs['update_fields'] = {*update_fields, *derived}
+        super().save(*args, **kwargs)
+        if 'cuisine_types' not in self.get_deferred_fields():
+            self._saved_cuisine_types = list(self.cuisine_types)
     
+
+class RestaurantStats(models.Model):
+    """
+    Visit and spend statistics of a restaurant over all receipts.
+
+    Read-only view of the materialized view created in migration 0006.
+    It is refreshed concurrently by the refresh_restaurant_stats task, so
+    reads never aggregate receipts.
+    """
+
+    restaurant = models.OneToOneField(
+        Restaurant,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        related_name='stats'
+    )
+    visit_count = models.IntegerField()
+    unique_visitors = models.IntegerField()
+    avg_spend = models.DecimalField(max_digits=10, decimal_places=2)
+    median_spend = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        managed = False
+        db_table = 'restaurants_restaurantstats'
+
+    @classmethod
+    def refresh(cls, concurrently=True):
+        """Recompute the view; concurrently keeps it readable meanwhile"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}{cls._meta.db_table}"
+            )
+
+
+class RestaurantNeighbors(models.Model):
+    """
+    Top-K co-visited restaurants of a restaurant, built offline from receipts.
+
+    ``neighbor_ids[i]`` is paired with ``scores[i]`` (cosine similarity of
+    the two restaurants' visitor sets), best first.
+    """
+    restaurant = models.OneToOneField(
+        Restaurant,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='neighbors'
+    )
+    neighbor_ids = ArrayField(models.BigIntegerField(), default=list)
+    scores = ArrayField(models.FloatField(), default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Neighbors of {self.restaurant_id}"
+
+
+class UserCuisineProfile(models.Model):
+    """
+    Time-decayed count of the cuisines a user has eaten.
+
+    Updated whenever a receipt is linked to (or unlinked from) a restaurant,
+    so reading a user's preferences is a single primary-key lookup. Weights
+    halve every ``HALF_LIFE_DAYS``; they are stored as of ``decayed_at``.
+    """
+    HALF_LIFE_DAYS = 90
+
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='cuisine_profile'
+    )
+    weights = models.JSONField(default=dict)
+    decayed_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Cuisine profile of {self.user_id}"
+
+    @classmethod
+    def decay_factor(cls, since, now):
+        elapsed_days = (now - since).total_seconds() / 86400
+        return 0.5 ** (max(elapsed_days, 0) / cls.HALF_LIFE_DAYS)
+
+    @classmethod
+    def visit_weight(cls, visit_date, now=None):
+        """Weight of a visit on ``visit_date`` as of ``now``, as ``rebuild`` counts it"""
+        visited_at = timezone.make_aware(datetime.combine(visit_date, time.min))
+        return cls.decay_factor(visited_at, now or timezone.now())
+
+    def decayed_weights(self, now=None):
+        factor = self.decay_factor(self.decayed_at, now or timezone.now())
+        return {cuisine: weight * factor for cuisine, weight in self.weights.items()}
+
+    def top_cuisines(self, limit=5):
+        weights = self.decayed_weights()
+        return sorted(weights, key=lambda cuisine: (-weights[cuisine], cuisine))[:limit]
+
+    @classmethod
+    def record_visit(cls, user_id, cuisine_types, weight=1.0, rebuild_missing=True):
+        """
+        Add ``weight`` to each cuisine (negative to undo a visit).
+
+        Pass the ``visit_weight`` of the receipt's date, so a visit adds and
+        later removes what ``rebuild`` counts for it. A user without a
+        profile yet gets one rebuilt from their receipts, which already
+        include the visit being recorded.
+        """
+        if not cuisine_types:
+            return
+        now = timezone.now()
+        with transaction.atomic():
+            profile = cls.objects.select_for_update().filter(user_id=user_id).first()
+            if profile is None:
+                if rebuild_missing:
+                    cls.rebuild(user_id)
+                return
+            weights = profile.decayed_weights(now)
+            for cuisine in set(cuisine_types):
+                weights[cuisine] = weights.get(cuisine, 0.0) + weight
+            profile.weights = {cuisine: value for cuisine, value in weights.items() if value > 1e-6}
+            profile.decayed_at = now
+            profile.save()
+
+    @classmethod
+    def rebuild(cls, user_id):
+        """Recompute the profile from the user's whole receipt history"""
+        from apps.receipts.models import Receipt
+
+        now = timezone.now()
+        weights = {}
+        visits = Receipt.objects.filter(user_id=user_id).values_list('date', 'restaurant__cuisine_types')
+        for visit_date, cuisine_types in visits:
+            factor = cls.visit_weight(visit_date, now)
+            for cuisine in set(cuisine_types or []):
+                weights[cuisine] = weights.get(cuisine, 0.0) + factor
+
+        profile, _ = cls.objects.update_or_create(
+            user_id=user_id, defaults={'weights': weights, 'decayed_at': now}
+        )
+        return profile
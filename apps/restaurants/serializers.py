@@ -1,6 +1,9 @@
+from django.contrib.auth import get_user_model
 from apps.restaurants.models import Restaurant
 from rest_framework import serializers
 
+User = get_user_model()
+
 class RestaurantSerializer(serializers.ModelSerializer):
     distance_km = serializers.SerializerMethodField()
     latitude = serializers.SerializerMethodField()
@@ -34,6 +37,30 @@ class RestaurantSerializer(serializers.ModelSerializer):
         return ", ".join(obj.cuisine_types) if obj.cuisine_types else "Various"
 
 
+def represent_restaurant(row):
+    """
+    RestaurantSerializer output for a values() row (see restaurant_values).
+
+    Builds the same dict directly, skipping DRF's per-field machinery on
+    the hot recommendation path.
+    """
+    distance_km = row.get('distance_km')
+    return {
+        'place_id': row['place_id'],
+        'name': row['name'],
+        'address': row['address'],
+        'cuisine_types': row['cuisine_types'],
+        'cuisine_display': ", ".join(row['cuisine_types']) if row['cuisine_types'] else "Various",
+        'rating': row['rating'],
+        'price_level': row['price_level'],
+        'latitude': row['latitude'],
+        'longitude': row['longitude'],
+        'website': row['website'],
+        'phone_number': row['phone_number'],
+        'distance_km': round(distance_km, 2) if distance_km is not None else None,
+    }
+
+
 class RecommendationSerializer(serializers.Serializer):
     """Serializer for the complete recommendation response"""
     
@@ -55,3 +82,46 @@ class RecommendationSerializer(serializers.Serializer):
                     rec.pop('place_id', None)
         return data
 
+
+
+class BatchLocationSerializer(serializers.Serializer):
+    """One location of a batch recommendation request"""
+
+    key = serializers.CharField(max_length=50)
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+    max_distance = serializers.FloatField(min_value=0, max_value=50, default=10)
+    price_level = serializers.IntegerField(min_value=0, max_value=4, required=False, allow_null=True)
+    open_at = serializers.DateTimeField(required=False, allow_null=True)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=20)
+
+
+class BatchRecommendationRequestSerializer(serializers.Serializer):
+    """Serializer for a batch of recommendation locations"""
+
+    locations = BatchLocationSerializer(many=True, allow_empty=False, max_length=10)
+
+    def validate_locations(self, locations):
+        keys = [location['key'] for location in locations]
+        if len(set(keys)) != len(keys):
+            raise serializers.ValidationError("Location keys must be unique")
+        return locations
+
+
+class GroupRecommendationRequestSerializer(serializers.Serializer):
+    """Serializer for a group recommendation request"""
+
+    user_ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=20)
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+    max_distance = serializers.FloatField(min_value=0, max_value=50, default=10)
+    price_level = serializers.IntegerField(min_value=0, max_value=4, required=False, allow_null=True)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=20)
+
+    def validate_user_ids(self, user_ids):
+        user_ids = list(dict.fromkeys(user_ids))
+        found = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        unknown = [user_id for user_id in user_ids if user_id not in found]
+        if unknown:
+            raise serializers.ValidationError(f"Unknown users: {unknown}")
+        return user_ids
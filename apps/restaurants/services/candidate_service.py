@@ -0,0 +1,251 @@
+import math
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db import connection
+from apps.restaurants.models import Restaurant, RestaurantStats
+from apps.restaurants.services.hours_service import hours_matrix
+from common.cache import get_fresh_many, get_versions, stale_while_revalidate, store_refreshable, versioned_key
+from common.geo import EARTH_RADIUS_KM, geohash_bbox, geohash_cells, geohash_center, geohash_encode, haversine_km
+
+
+def get_region_precision():
+    return getattr(settings, 'RECOMMENDATION_REGION_PRECISION', 4)
+
+
+def region_namespace(lat, lng):
+    """Cache version namespace of the coarse region containing a coordinate"""
+    return f"region:{geohash_encode(lat, lng, get_region_precision())}"
+
+
+# Cache version namespace bumped each time the RestaurantStats view is refreshed
+STATS_NAMESPACE = 'restaurant_stats'
+
+
+def stats_version():
+    """Current version of the RestaurantStats view, see refresh_restaurant_stats"""
+    return get_versions([STATS_NAMESPACE])[STATS_NAMESPACE]
+
+
+def current_visitors(restaurant_ids):
+    """Unique visitors of each of ``restaurant_ids`` from RestaurantStats, 0 when unknown"""
+    stats = RestaurantStats.objects.order_by('restaurant_id').values_list('restaurant_id', 'unique_visitors')
+    stats_ids, stats_visitors = [], []
+    for restaurant_id, visitors in stats.iterator(chunk_size=50_000):
+        stats_ids.append(restaurant_id)
+        stats_visitors.append(visitors or 0)
+    stats_ids = np.asarray(stats_ids, dtype=np.int64)
+    stats_visitors = np.asarray(stats_visitors, dtype=np.int32)
+
+    visitors = np.zeros(len(restaurant_ids), dtype=np.int32)
+    if not len(stats_ids):
+        return visitors
+    rows = np.minimum(np.searchsorted(stats_ids, restaurant_ids), len(stats_ids) - 1)
+    found = stats_ids[rows] == restaurant_ids
+    visitors[found] = stats_visitors[rows[found]]
+    return visitors
+
+
+def encode_cuisines(cuisine_lists, cuisine_bits=None):
+    """
+    Encode lists of cuisines as rows of a uint64 bitmask matrix.
+
+    Returns (mask, cuisine_bits) where cuisine_bits maps each cuisine to its
+    bit. Pass an existing vocabulary as ``cuisine_bits`` to encode against it;
+    cuisines missing from it are ignored.
+    """
+    if cuisine_bits is None:
+        vocabulary = sorted({cuisine for cuisines in cuisine_lists for cuisine in cuisines})
+        cuisine_bits = {cuisine: bit for bit, cuisine in enumerate(vocabulary)}
+    words = max(1, math.ceil(len(cuisine_bits) / 64))
+    mask = np.zeros((len(cuisine_lists), words), dtype=np.uint64)
+    for row, cuisines in enumerate(cuisine_lists):
+        for cuisine in cuisines:
+            bit = cuisine_bits.get(cuisine)
+            if bit is not None:
+                mask[row, bit // 64] |= np.uint64(1 << (bit % 64))
+    return mask, cuisine_bits
+
+
+def build_candidates(
+    ids, lngs, lats, ratings, price_levels, cuisine_lists, cuisine_bits=None, hours_bitmaps=None, visitors=None
+):
+    """
+    Column-wise candidate set as NumPy arrays.
+
+    Unknown ratings are NaN and unknown price levels -1, so every column has
+    a fixed dtype and can be scored without Python-level loops. Opening
+    hours are a (n, 84) uint8 matrix of quarter-hour bits (see
+    hours_service), all ones where hours are unknown. Visitors are unique
+    visitors from RestaurantStats, 0 when unknown.
+    """
+    cuisine_mask, cuisine_bits = encode_cuisines(cuisine_lists, cuisine_bits)
+    if hours_bitmaps is None:
+        hours_bitmaps = [None] * len(ids)
+    if visitors is None:
+        visitors = [0] * len(ids)
+    return {
+        'id': np.asarray(ids, dtype=np.int64),
+        'lng': np.asarray(lngs, dtype=np.float64),
+        'lat': np.asarray(lats, dtype=np.float64),
+        'rating': np.asarray(
+            [np.nan if rating is None else rating for rating in ratings], dtype=np.float64
+        ),
+        'price_level': np.asarray(
+            [-1 if price is None else price for price in price_levels], dtype=np.int8
+        ),
+        'cuisine_mask': cuisine_mask,
+        'cuisine_bits': cuisine_bits,
+        'hours': hours_matrix(hours_bitmaps),
+        'visitors': np.asarray([count or 0 for count in visitors], dtype=np.int32),
+    }
+
+
+class CandidateService:
+    """
+    Non-personalized recommendation candidates shared by all users.
+
+    Candidates are cached per geohash tile, radius (rounded up to a whole km)
+    and price level. A tile's set holds every restaurant within the radius of
+    any point in the tile, so each user in it filters the same set down to
+    their exact position and applies their own preferences in memory.
+
+    Keys carry the versions of every coarse region the set reaches into.
+    Saving or deleting a restaurant bumps its region's version (see
+    signals.py), so affected tiles miss on the next request and the TTL
+    only has to bound memory, not staleness.
+    """
+
+    def __init__(self, precision=None, ttl=None):
+        self.precision = precision or getattr(settings, 'RECOMMENDATION_TILE_PRECISION', 6)
+        self.ttl = ttl or getattr(settings, 'RECOMMENDATION_TILE_CACHE_TTL', 3600)
+        self.grace = getattr(settings, 'RECOMMENDATION_TILE_CACHE_GRACE', 120)
+
+    def get_tile(self, lat, lng):
+        return geohash_encode(lat, lng, self.precision)
+
+    @staticmethod
+    def cache_key(tile, radius_km, price_level=None):
+        return f"rec_tile_v3_{tile}_{math.ceil(radius_km)}_{price_level}"
+
+    @staticmethod
+    def reach(tile, radius_km):
+        """(center_lat, center_lng, km) covering every point within ``radius_km`` of ``tile``"""
+        center_lat, center_lng = geohash_center(tile)
+        _, _, max_lat, max_lng = geohash_bbox(tile)
+        return center_lat, center_lng, radius_km + haversine_km(center_lat, center_lng, max_lat, max_lng)
+
+    def region_namespaces(self, tile, radius_km):
+        center_lat, center_lng, reach_km = self.reach(tile, math.ceil(radius_km))
+        dlat = math.degrees(reach_km / EARTH_RADIUS_KM)
+        dlng = dlat / max(math.cos(math.radians(center_lat)), 1e-6)
+        cells = geohash_cells(
+            center_lat - dlat, center_lng - dlng, center_lat + dlat, center_lng + dlng, get_region_precision()
+        )
+        return [f"region:{cell}" for cell in cells]
+
+    def versioned_cache_key(self, tile, radius_km, price_level=None):
+        return versioned_key(self.cache_key(tile, radius_km, price_level), *self.region_namespaces(tile, radius_km))
+
+    def get_candidates(self, lat, lng, radius_km, price_level=None):
+        tile = self.get_tile(lat, lng)
+        # Busy tiles are refreshed by one request while the others keep
+        # using the previous set
+        return stale_while_revalidate(
+            self.versioned_cache_key(tile, radius_km, price_level),
+            lambda: self.fetch_candidates(tile, math.ceil(radius_km), price_level),
+            ttl=self.ttl,
+            grace=self.grace,
+        )
+
+    def get_candidates_many(self, locations):
+        """
+        Candidates for several (lat, lng, radius_km, price_level) at once.
+
+        Cached tiles are read with one ``get_many``; all missing ones are
+        loaded together by ``fetch_candidates_many`` and cached.
+        """
+        requests = [
+            (self.get_tile(lat, lng), math.ceil(radius_km), price_level)
+            for lat, lng, radius_km, price_level in locations
+        ]
+        keys = [self.versioned_cache_key(*request) for request in requests]
+        found = get_fresh_many(keys)
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            fetched = self.fetch_candidates_many([requests[keys.index(key)] for key in missing])
+            for key, candidates in zip(missing, fetched):
+                store_refreshable(key, candidates, self.ttl, self.grace)
+                found[key] = candidates
+        return [found[key] for key in keys]
+
+    def fetch_candidates_many(self, requests):
+        """
+        Load candidates for several (tile, radius_km, price_level) in one query.
+
+        The tile centers go into a VALUES list joined to restaurants with
+        ST_DWithin, so every tile still uses the GiST index on location.
+        """
+        rows_sql = []
+        params = []
+        for index, (tile, radius_km, price_level) in enumerate(requests):
+            center_lat, center_lng, reach_km = self.reach(tile, radius_km)
+            rows_sql.append(
+                "(%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, %s::double precision, %s::integer)"
+            )
+            params += [index, center_lng, center_lat, reach_km * 1000, price_level]
+
+        sql = f"""
+            SELECT t.idx, r.id, ST_X(r.location::geometry), ST_Y(r.location::geometry),
+                   r.rating, r.price_level, r.cuisine_types, r.hours_bitmap, s.unique_visitors
+            FROM (VALUES {', '.join(rows_sql)}) AS t(idx, center, reach_m, price_level)
+            JOIN {Restaurant._meta.db_table} r ON ST_DWithin(r.location, t.center, t.reach_m)
+            LEFT JOIN {RestaurantStats._meta.db_table} s ON s.restaurant_id = r.id
+            WHERE t.price_level IS NULL OR r.price_level = t.price_level
+        """
+        grouped = [[] for _ in requests]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for index, *row in cursor.fetchall():
+                grouped[index].append(row)
+
+        return [
+            build_candidates(
+                ids=[row[0] for row in rows],
+                lngs=[row[1] for row in rows],
+                lats=[row[2] for row in rows],
+                ratings=[row[3] for row in rows],
+                price_levels=[row[4] for row in rows],
+                cuisine_lists=[row[5] for row in rows],
+                hours_bitmaps=[row[6] for row in rows],
+                visitors=[row[7] for row in rows],
+            )
+            for rows in grouped
+        ]
+
+    def fetch_candidates(self, tile, radius_km, price_level=None):
+        """Load every restaurant reachable from somewhere inside ``tile``"""
+        center_lat, center_lng, reach_km = self.reach(tile, radius_km)
+
+        queryset = Restaurant.objects.filter(
+            location__dwithin=(Point(center_lng, center_lat), D(km=reach_km))
+        )
+        if price_level is not None:
+            queryset = queryset.filter(price_level=price_level)
+
+        rows = list(queryset.order_by().values_list(
+            'id', 'location', 'rating', 'price_level', 'cuisine_types', 'hours_bitmap',
+            'stats__unique_visitors'
+        ))
+        return build_candidates(
+            ids=[row[0] for row in rows],
+            lngs=[row[1].x for row in rows],
+            lats=[row[1].y for row in rows],
+            ratings=[row[2] for row in rows],
+            price_levels=[row[3] for row in rows],
+            cuisine_lists=[row[4] for row in rows],
+            hours_bitmaps=[row[5] for row in rows],
+            visitors=[row[6] for row in rows],
+        )
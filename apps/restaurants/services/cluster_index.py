@@ -0,0 +1,307 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from apps.restaurants.models import Restaurant
+from common.geo import MERCATOR_MAX_LAT, mercator_latlng, mercator_xy
+
+logger = logging.getLogger(__name__)
+
+# Grid cells per tile side at every zoom; a power of two so each cell is
+# exactly four cells of the next zoom (64 px cells on 512 px tiles)
+CELLS_PER_TILE = 8
+
+MAX_CLUSTER_ZOOM = 16
+
+# Viewports spanning more cells than this are rejected, which bounds the
+# work per query whatever the number of restaurants
+MAX_VIEWPORT_CELLS = 4096
+
+
+def grid_size(zoom):
+    return (1 << zoom) * CELLS_PER_TILE
+
+
+def cell_keys(x, y, zoom):
+    """Row-major cell keys of normalized Mercator coordinates at ``zoom``"""
+    size = grid_size(zoom)
+    columns = np.minimum((x * size).astype(np.int64), size - 1)
+    rows = np.minimum((y * size).astype(np.int64), size - 1)
+    return rows * size + columns
+
+
+def aggregate(keys, counts, sum_x, sum_y, id_sums, drop_empty=True):
+    """
+    Sum cluster columns per key, dropping clusters that reached zero.
+
+    Deltas are aggregated with ``drop_empty=False``: a cell one restaurant
+    leaves as another enters nets a zero count but not zero sums.
+    """
+    keys, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts, minlength=len(keys)).round().astype(np.int64)
+    level = {
+        'key': keys,
+        'count': counts,
+        'sum_x': np.bincount(inverse, weights=sum_x, minlength=len(keys)),
+        'sum_y': np.bincount(inverse, weights=sum_y, minlength=len(keys)),
+        # Exact integer sums, float bincount would round large ids
+        'id_sum': np.zeros(len(keys), dtype=np.int64),
+    }
+    np.add.at(level['id_sum'], inverse, id_sums)
+    if not drop_empty:
+        return level
+    keep = counts != 0
+    return {field: values[keep] for field, values in level.items()}
+
+
+class RestaurantClusterIndex:
+    """
+    Grid clusters of restaurants for every map zoom, held in NumPy arrays.
+
+    At each zoom the Web Mercator plane is cut into cells of 1/8 tile, and a
+    cluster is the count and coordinate sums of the restaurants in a cell,
+    so its centroid is the mean position. Levels are sorted by row-major
+    cell key, and a viewport query is two ``searchsorted`` calls per row of
+    cells it spans. The cost depends on the viewport's size in cells, never
+    on the number of restaurants. A cell's ``id_sum`` is the id of its only
+    restaurant when its count is one.
+
+    Refreshes are incremental and run in a background thread. Restaurants
+    changed since the last refresh (by ``updated_at``) or deleted subtract
+    their previous contribution and add their new one at every zoom, so no
+    level is rebuilt from the full point set. Until the first load has
+    finished, clusters are grouped by PostGIS.
+    """
+
+    def __init__(self, refresh_interval=None, refresh_overlap=None):
+        self.refresh_interval = refresh_interval or getattr(
+            settings, 'RESTAURANT_CLUSTER_REFRESH_SECONDS', 60
+        )
+        self.refresh_overlap = timedelta(seconds=refresh_overlap if refresh_overlap is not None else getattr(
+            settings, 'RESTAURANT_INDEX_REFRESH_OVERLAP_SECONDS', 300
+        ))
+        self._data = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_ready(self):
+        return self._data is not None
+
+    def load(self):
+        """Cluster every restaurant with a location, replacing the current data"""
+        ids, x, y, _, updated_until = self._fetch_points(Restaurant.objects.filter(location__isnull=False))
+        order = np.argsort(ids)
+        points = {'id': ids[order], 'x': x[order], 'y': y[order]}
+        self._data = {
+            'points': points,
+            'levels': self._levels(points['id'], points['x'], points['y'], np.ones(len(ids))),
+            'updated_until': updated_until,
+        }
+        self._refreshed_at = time.monotonic()
+        logger.info(f"Cluster index loaded with {len(ids)} restaurants")
+
+    def load_in_background(self):
+        """Load in a background thread, unless a load or refresh is already running"""
+        self._run_in_background(self.load, 'Cluster index not loaded, PostGIS groups clusters until it is')
+
+    def _run_in_background(self, method, failure):
+        if not self._lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                method()
+            except Exception as e:
+                logger.warning(f"{failure}: {e}")
+                self._refreshed_at = time.monotonic()
+            finally:
+                self._lock.release()
+                connection.close()
+
+        threading.Thread(target=run, name='restaurant-cluster-index', daemon=True).start()
+
+    def refresh(self):
+        """Apply restaurants changed or deleted since the last load or refresh"""
+        data = self._data
+        if data is None or data['updated_until'] is None:
+            return self.load()
+
+        # Re-read a window below the high-water mark for late commits
+        ids, x, y, changed_ids, updated_until = self._fetch_points(
+            Restaurant.objects.filter(updated_at__gt=data['updated_until'] - self.refresh_overlap)
+        )
+        located_ids = np.fromiter(
+            Restaurant.objects.filter(location__isnull=False).order_by()
+            .values_list('id', flat=True).iterator(chunk_size=10_000),
+            dtype=np.int64,
+        )
+        located = np.isin(ids, located_ids)
+        ids, x, y = ids[located], x[located], y[located]
+        self._refreshed_at = time.monotonic()
+
+        points = data['points']
+        previous = np.isin(points['id'], changed_ids) | ~np.isin(points['id'], located_ids)
+        updated_until = max(filter(None, [data['updated_until'], updated_until]))
+        if not previous.any() and not len(ids):
+            self._data = {**data, 'updated_until': updated_until}
+            return
+
+        # Remove the previous positions of changed restaurants, add the new ones
+        delta_ids = np.concatenate([points['id'][previous], ids])
+        delta_x = np.concatenate([points['x'][previous], x])
+        delta_y = np.concatenate([points['y'][previous], y])
+        signs = np.concatenate([-np.ones(previous.sum()), np.ones(len(ids))])
+        delta = self._levels(delta_ids, delta_x, delta_y, signs, drop_empty=False)
+
+        levels = {
+            zoom: aggregate(*(
+                np.concatenate([level[field], delta[zoom][field]])
+                for field in ('key', 'count', 'sum_x', 'sum_y', 'id_sum')
+            ))
+            for zoom, level in data['levels'].items()
+        }
+        ids = np.concatenate([points['id'][~previous], ids])
+        x = np.concatenate([points['x'][~previous], x])
+        y = np.concatenate([points['y'][~previous], y])
+        order = np.argsort(ids)
+        self._data = {
+            'points': {'id': ids[order], 'x': x[order], 'y': y[order]},
+            'levels': levels,
+            'updated_until': updated_until,
+        }
+
+    def maybe_refresh(self):
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self._run_in_background(self.refresh, 'Cluster index refresh failed')
+
+    def get_clusters(self, min_lat, min_lng, max_lat, max_lng, zoom):
+        """Clusters inside a bounding box at ``zoom``, as dicts with lat, lng, count and id"""
+        zoom = max(0, min(int(zoom), MAX_CLUSTER_ZOOM))
+        size = grid_size(zoom)
+        (min_x, max_x), (max_y, min_y) = (
+            np.clip(np.floor(values * size), 0, size - 1).astype(np.int64)
+            for values in mercator_xy([min_lat, max_lat], [min_lng, max_lng])
+        )
+        if min_x > max_x:
+            raise ValueError("Bounding boxes crossing the antimeridian are not supported")
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > MAX_VIEWPORT_CELLS:
+            raise ValueError("Bounding box too large for this zoom")
+
+        if self._data is None:
+            self.load_in_background()
+            counts, sum_x, sum_y, id_sums = self._query_cells(size, min_x, max_x, min_y, max_y)
+        else:
+            self.maybe_refresh()
+            counts, sum_x, sum_y, id_sums = self._index_cells(zoom, size, min_x, max_x, min_y, max_y)
+        if not len(counts):
+            return []
+
+        lats, lngs = mercator_latlng(sum_x / counts, sum_y / counts)
+        return [
+            {
+                'lat': round(float(lat), 6),
+                'lng': round(float(lng), 6),
+                'count': int(count),
+                'id': int(id_sum) if count == 1 else None,
+            }
+            for lat, lng, count, id_sum in zip(lats, lngs, counts, id_sums)
+        ]
+
+    def _index_cells(self, zoom, size, min_x, max_x, min_y, max_y):
+        level = self._data['levels'][zoom]
+        keys = level['key']
+        slices = []
+        for row in range(min_y, max_y + 1):
+            start = np.searchsorted(keys, row * size + min_x, side='left')
+            end = np.searchsorted(keys, row * size + max_x, side='right')
+            if end > start:
+                slices.append(np.arange(start, end))
+        rows = np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+        return level['count'][rows], level['sum_x'][rows], level['sum_y'][rows], level['id_sum'][rows]
+
+    @staticmethod
+    def _query_cells(size, min_x, max_x, min_y, max_y):
+        """The same cells grouped by PostGIS, for requests served before the index is loaded"""
+        (south, north), (west, east) = mercator_latlng(
+            [min_x / size, (max_x + 1) / size], [(max_y + 1) / size, min_y / size]
+        )
+        sql = f"""
+            SELECT count(*), sum(x), sum(y), sum(id)
+            FROM (
+                SELECT id, x, y,
+                       LEAST(floor(x * %(size)s), %(size)s - 1) AS column_,
+                       LEAST(floor(y * %(size)s), %(size)s - 1) AS row_
+                FROM (
+                    SELECT id,
+                           (ST_X(location::geometry) + 180.0) / 360.0 AS x,
+                           (1.0 - asinh(tan(radians(
+                               LEAST(GREATEST(ST_Y(location::geometry), -%(max_lat)s), %(max_lat)s)
+                           ))) / pi()) / 2.0 AS y
+                    FROM {Restaurant._meta.db_table}
+                    WHERE location && ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)::geography
+                ) AS points
+            ) AS cells
+            WHERE column_ BETWEEN %(min_x)s AND %(max_x)s AND row_ BETWEEN %(min_y)s AND %(max_y)s
+            GROUP BY row_, column_
+            ORDER BY row_, column_
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'size': size, 'max_lat': MERCATOR_MAX_LAT,
+                'west': float(west), 'south': float(south), 'east': float(east), 'north': float(north),
+                'min_x': int(min_x), 'max_x': int(max_x), 'min_y': int(min_y), 'max_y': int(max_y),
+            })
+            rows = cursor.fetchall()
+        counts, sum_x, sum_y, id_sums = zip(*rows) if rows else ([], [], [], [])
+        return (
+            np.asarray(counts, dtype=np.int64), np.asarray(sum_x, dtype=np.float64),
+            np.asarray(sum_y, dtype=np.float64), np.asarray(id_sums, dtype=np.int64),
+        )
+
+    @staticmethod
+    def _levels(ids, x, y, weights, drop_empty=True):
+        """Clusters of weighted points at every zoom, each aggregated from the next finer one"""
+        levels = {}
+        keys = cell_keys(x, y, MAX_CLUSTER_ZOOM)
+        level = aggregate(keys, weights, x * weights, y * weights, ids * weights.astype(np.int64), drop_empty)
+        levels[MAX_CLUSTER_ZOOM] = level
+        for zoom in range(MAX_CLUSTER_ZOOM - 1, -1, -1):
+            finer_size = grid_size(zoom + 1)
+            rows, columns = np.divmod(level['key'], finer_size)
+            level = aggregate(
+                (rows >> 1) * grid_size(zoom) + (columns >> 1),
+                level['count'], level['sum_x'], level['sum_y'], level['id_sum'], drop_empty,
+            )
+            levels[zoom] = level
+        return levels
+
+    @staticmethod
+    def _fetch_points(queryset):
+        """(ids, x, y) of located restaurants, every restaurant id read and the latest ``updated_at``"""
+        ids, lats, lngs, changed_ids = [], [], [], []
+        updated_until = None
+        values = queryset.order_by().values_list('id', 'location', 'updated_at')
+        for restaurant_id, location, updated_at in values.iterator(chunk_size=10_000):
+            changed_ids.append(restaurant_id)
+            if updated_until is None or updated_at > updated_until:
+                updated_until = updated_at
+            if location is None:
+                continue
+            ids.append(restaurant_id)
+            lats.append(location.y)
+            lngs.append(location.x)
+        x, y = mercator_xy(lats, lngs)
+        return (
+            np.asarray(ids, dtype=np.int64), x, y,
+            np.asarray(changed_ids, dtype=np.int64), updated_until,
+        )
+
+
+# One index per worker process, loaded at startup when
+# settings.RESTAURANT_CLUSTER_INDEX_ENABLED is set and after the first request otherwise
+cluster_index = RestaurantClusterIndex()
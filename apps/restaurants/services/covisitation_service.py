@@ -0,0 +1,136 @@
+import logging
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from apps.receipts.models import Receipt
+from apps.restaurants.models import Restaurant, RestaurantNeighbors
+from common.cache import bump_version
+
+logger = logging.getLogger(__name__)
+
+
+class CovisitationModelBuilder:
+    """
+    Builds the item-item co-visitation model from receipt history.
+
+    Every user is a binary row over restaurants (visited or not), and the
+    co-visitation matrix C = XᵀX is accumulated over chunks of users read
+    from a server-side cursor. Memory is bounded by one chunk plus C, never
+    by the number of receipts. Similarity is cosine,
+    C[i, j] / sqrt(C[i, i] * C[j, j]), and only the top-K neighbors of each
+    restaurant are stored.
+    """
+
+    def __init__(self, top_k=20, users_per_chunk=20_000, min_covisits=2, batch_size=5_000):
+        self.top_k = top_k
+        self.users_per_chunk = users_per_chunk
+        self.min_covisits = min_covisits
+        self.batch_size = batch_size
+
+    def build(self):
+        """Rebuild RestaurantNeighbors, returning the number of restaurants stored"""
+        restaurant_ids = np.fromiter(
+            Restaurant.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=50_000),
+            dtype=np.int64,
+        )
+        similarity = self.similarity(self.covisits(restaurant_ids))
+
+        with transaction.atomic():
+            RestaurantNeighbors.objects.all().delete()
+            stored = 0
+            batch = []
+            for row in range(similarity.shape[0]):
+                neighbors = self.top_neighbors(similarity, row)
+                if neighbors is None:
+                    continue
+                columns, scores = neighbors
+                batch.append(RestaurantNeighbors(
+                    restaurant_id=int(restaurant_ids[row]),
+                    neighbor_ids=restaurant_ids[columns].tolist(),
+                    scores=scores.tolist(),
+                ))
+                if len(batch) >= self.batch_size:
+                    RestaurantNeighbors.objects.bulk_create(batch)
+                    stored += len(batch)
+                    batch = []
+            RestaurantNeighbors.objects.bulk_create(batch)
+            stored += len(batch)
+
+        # Cached neighbor boosts of every user are now stale
+        bump_version('covisitation')
+        logger.info(f"Co-visitation model built for {stored} restaurants")
+        return stored
+
+    def covisits(self, restaurant_ids):
+        """Sparse restaurant x restaurant matrix of shared visitors"""
+        size = len(restaurant_ids)
+        covisits = sparse.csr_matrix((size, size), dtype=np.float32)
+        for users, restaurants in self.user_chunks(restaurant_ids):
+            if not len(users):
+                continue
+            _, user_rows = np.unique(users, return_inverse=True)
+            visits = sparse.csr_matrix(
+                (np.ones(len(user_rows), dtype=np.float32), (user_rows, restaurants)),
+                shape=(user_rows.max() + 1, size),
+            )
+            covisits = covisits + (visits.T @ visits).tocsr()
+        return covisits
+
+    def user_chunks(self, restaurant_ids):
+        """Yield (user_ids, restaurant columns) for chunks of whole users"""
+        pairs = (
+            Receipt.objects.order_by('user_id')
+            .values_list('user_id', 'restaurant_id')
+            .distinct()
+            .iterator(chunk_size=50_000)
+        )
+        users, restaurants = [], []
+        chunk_users = 0
+        last_user = None
+        for user_id, restaurant_id in pairs:
+            if user_id != last_user:
+                if chunk_users >= self.users_per_chunk:
+                    yield self._chunk(users, restaurants, restaurant_ids)
+                    users, restaurants, chunk_users = [], [], 0
+                chunk_users += 1
+                last_user = user_id
+            users.append(user_id)
+            restaurants.append(restaurant_id)
+        if users:
+            yield self._chunk(users, restaurants, restaurant_ids)
+
+    @staticmethod
+    def _chunk(users, restaurants, restaurant_ids):
+        users = np.asarray(users, dtype=np.int64)
+        restaurants = np.asarray(restaurants, dtype=np.int64)
+        if not len(restaurant_ids):
+            return users[:0], restaurants[:0]
+        columns = np.searchsorted(restaurant_ids, restaurants)
+        # Restaurants created after restaurant_ids was loaded have no column
+        known = restaurant_ids[np.minimum(columns, len(restaurant_ids) - 1)] == restaurants
+        return users[known], columns[known]
+
+    def similarity(self, covisits):
+        """Cosine similarity from co-visit counts, dropping rare pairs and self-pairs"""
+        visitors = covisits.diagonal()
+        covisits = covisits.tocsr(copy=True)
+        covisits.setdiag(0)
+        covisits.data[covisits.data < self.min_covisits] = 0
+        covisits.eliminate_zeros()
+
+        rows = np.repeat(np.arange(covisits.shape[0]), np.diff(covisits.indptr))
+        covisits.data = covisits.data / np.sqrt(visitors[rows] * visitors[covisits.indices])
+        return covisits
+
+    def top_neighbors(self, similarity, row):
+        """(columns, scores) of the best ``top_k`` neighbors of ``row``, or None"""
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        if start == end:
+            return None
+        columns = similarity.indices[start:end]
+        scores = similarity.data[start:end]
+        if len(scores) > self.top_k:
+            best = np.argpartition(-scores, self.top_k - 1)[:self.top_k]
+            columns, scores = columns[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return columns[order], scores[order]
@@ -1,10 +1,23 @@
-import requests
+import hashlib
 import logging
+import requests
 
 from config import settings
 
 logger = logging.getLogger(__name__)
 
+
+def normalize_query(query):
+    """Lowercase and collapse whitespace so equivalent queries share a key"""
+    return " ".join(str(query).lower().split())
+
+
+def place_lookup_key(query):
+    """Cache key for the single-flight lookup of a normalized query"""
+    digest = hashlib.sha1(normalize_query(query).encode()).hexdigest()
+    return f"place_lookup_{digest}"
+
+
 class GooglePlacesService:
     def __init__(self):
         self.api_key = getattr(settings, 'GOOGLE_PLACES_API_KEY', None)
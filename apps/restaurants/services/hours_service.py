@@ -0,0 +1,93 @@
+import logging
+import math
+
+import numpy as np
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# One bit per quarter hour of the week, Monday 00:00 first. Bit ``slot`` is
+# bit ``slot % 8`` (least significant first) of byte ``slot // 8``, the
+# order Postgres get_bit() uses for bytea.
+SLOTS_PER_DAY = 96
+WEEK_SLOTS = 7 * SLOTS_PER_DAY
+BITMAP_BYTES = WEEK_SLOTS // 8
+
+DAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def _slot(day, clock, round_up=False):
+    """Week slot of ``clock`` ('HH:MM' or Google's 'HHMM') on ``day`` (0 = Monday)"""
+    digits = clock.replace(':', '')
+    minutes = int(digits[:2]) * 60 + int(digits[2:4])
+    quarter = math.ceil(minutes / 15) if round_up else minutes // 15
+    return day * SLOTS_PER_DAY + quarter
+
+
+def _periods(hours):
+    """Yield (start, end) week slots, end exclusive and possibly past the week"""
+    if 'periods' in hours:
+        # Google Places opening_hours, days counted from Sunday
+        for period in hours['periods']:
+            opens, closes = period.get('open'), period.get('close')
+            if opens is None:
+                continue
+            start = _slot((opens['day'] + 6) % 7, opens['time'])
+            if closes is None:
+                # Open around the clock
+                yield start, start + WEEK_SLOTS
+                continue
+            end = _slot((closes['day'] + 6) % 7, closes['time'], round_up=True)
+            yield start, end if end > start else end + WEEK_SLOTS
+        return
+
+    # {'monday': {'open': '09:00', 'close': '22:00'}, ...}, a list of such per day
+    for day, name in enumerate(DAYS):
+        entries = hours.get(name) or []
+        if isinstance(entries, dict):
+            entries = [entries]
+        for entry in entries:
+            start = _slot(day, entry['open'])
+            end = _slot(day, entry['close'], round_up=True)
+            # Closing at or before opening means after midnight
+            yield start, end if end > start else end + SLOTS_PER_DAY
+
+
+def hours_bitmap(hours):
+    """Quarter-hour bitmap of the week for ``Restaurant.hours``, None if unknown"""
+    if not hours:
+        return None
+    bits = 0
+    try:
+        for start, end in _periods(hours):
+            for slot in range(start, min(end, start + WEEK_SLOTS)):
+                bits |= 1 << (slot % WEEK_SLOTS)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        logger.warning(f"Unparseable opening hours {hours!r}: {e}")
+        return None
+    return bits.to_bytes(BITMAP_BYTES, 'little')
+
+
+def week_slot(moment):
+    """Week slot of a datetime, aware ones are read in the current time zone"""
+    if timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return moment.weekday() * SLOTS_PER_DAY + moment.hour * 4 + moment.minute // 15
+
+
+def hours_matrix(bitmaps):
+    """
+    Stack bitmaps into a (n, BITMAP_BYTES) uint8 matrix.
+
+    Unknown hours become all ones, so they never filter a restaurant out.
+    """
+    matrix = np.full((len(bitmaps), BITMAP_BYTES), 0xFF, dtype=np.uint8)
+    for row, bitmap in enumerate(bitmaps):
+        if bitmap is not None:
+            matrix[row] = np.frombuffer(bitmap, dtype=np.uint8)
+    return matrix
+
+
+def open_mask(matrix, slot):
+    """Boolean array, True for rows open during ``slot``"""
+    return (matrix[:, slot // 8] >> (slot % 8)) & 1 == 1
@@ -0,0 +1,78 @@
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from apps.receipts.models import Receipt
+from apps.restaurants.services.candidate_service import CandidateService
+from apps.restaurants.services.recommendation_service import RecommendationService
+from common.geo import geohash_center
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+class RecommendationPrewarmer:
+    """
+    Fills the recommendation caches of recently active users before lunch.
+
+    A user's usual location is the center of the candidate tile they ate
+    in most often over the last ``active_days``. Warming that location
+    computes their cuisine profile, co-visitation boosts and the shared
+    tile candidates, which leaves only the final row fetch to the request.
+    Work is split into batches so it can be spread out over time and never
+    competes with live traffic for the database.
+    """
+
+    def __init__(self, active_days=None, max_users=None, batch_size=None, max_distance_km=10):
+        self.active_days = active_days or getattr(settings, 'RECOMMENDATION_PREWARM_ACTIVE_DAYS', 30)
+        self.max_users = max_users or getattr(settings, 'RECOMMENDATION_PREWARM_MAX_USERS', 5_000)
+        self.batch_size = batch_size or getattr(settings, 'RECOMMENDATION_PREWARM_BATCH_SIZE', 200)
+        self.max_distance_km = max_distance_km
+        self.tiles = CandidateService()
+
+    def active_locations(self):
+        """[user_id, lat, lng] of the most active users, busiest first"""
+        since = timezone.now().date() - timedelta(days=self.active_days)
+        visits = (
+            Receipt.objects.filter(date__gte=since, restaurant__location__isnull=False)
+            .order_by()
+            .values_list('user_id', 'restaurant__location')
+            .iterator(chunk_size=10_000)
+        )
+        tiles = defaultdict(Counter)
+        for user_id, location in visits:
+            tiles[user_id][self.tiles.get_tile(location.y, location.x)] += 1
+
+        busiest = sorted(tiles.items(), key=lambda item: sum(item[1].values()), reverse=True)
+        locations = []
+        for user_id, counts in busiest[:self.max_users]:
+            lat, lng = geohash_center(counts.most_common(1)[0][0])
+            locations.append([user_id, lat, lng])
+        return locations
+
+    def batches(self, locations):
+        for start in range(0, len(locations), self.batch_size):
+            yield locations[start:start + self.batch_size]
+
+    def warm(self, locations):
+        """Warm the caches for a batch of [user_id, lat, lng], returning users warmed"""
+        users = User.objects.in_bulk([user_id for user_id, _, _ in locations])
+        warmed = 0
+        for user_id, lat, lng in locations:
+            user = users.get(user_id)
+            if user is None:
+                continue
+            service = RecommendationService(user=user, lat=lat, lng=lng, max_distance_km=self.max_distance_km)
+            try:
+                service.get_user_top_cuisines()
+                service.get_neighbor_boosts()
+                service.get_candidates()
+            except Exception as e:
+                logger.warning(f"Pre-warming recommendations for user {user_id} failed: {e}")
+                continue
+            warmed += 1
+        return warmed
@@ -0,0 +1,165 @@
+import numpy as np
+from django.conf import settings
+from django.db.models import Case, F, FloatField, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Abs, Cast, Coalesce, Exp
+from apps.restaurants.models import Restaurant
+from apps.restaurants.services.candidate_service import encode_cuisines
+from common.geo import haversine_km_array
+
+# Relative weight of each ranking signal, override with
+# settings.RECOMMENDATION_RANKING_WEIGHTS
+DEFAULT_RANKING_WEIGHTS = {
+    'distance': 0.3,
+    'rating': 0.3,
+    'cuisine': 0.3,
+    'price': 0.1,
+    'covisitation': 0.15,
+    'popularity': 0.1,
+}
+
+# Unique visitors at which popularity reaches 1 - 1/e (~0.63)
+POPULARITY_SCALE = 20.0
+
+# Price level assumed when the request does not ask for one
+DEFAULT_TARGET_PRICE_LEVEL = 2
+
+# Restaurants outside the user's cuisines need at least this rating
+MIN_RATING = 3.5
+
+
+def get_ranking_weights():
+    weights = dict(DEFAULT_RANKING_WEIGHTS)
+    weights.update(getattr(settings, 'RECOMMENDATION_RANKING_WEIGHTS', {}))
+    return weights
+
+
+class RankingService:
+    """
+    Builds the SQL score used to rank recommendation candidates.
+
+    score = w_distance * exp(-distance / decay)
+          + w_rating   * rating / 5
+          + w_cuisine  * |cuisines ∩ user cuisines| / |user cuisines|
+          + w_price    * (1 - |price_level - target| / 4)
+          + w_covisitation * boost
+          + w_popularity * (1 - exp(-unique visitors / POPULARITY_SCALE))
+
+    Every component is in [0, 1] so the weights read as proportions.
+    The distance decay is a third of the search radius. ``boosts`` maps
+    restaurant ids to their co-visitation similarity with the user's recent
+    visits (see CovisitationModelBuilder). Unique visitors come from the
+    RestaurantStats materialized view.
+    """
+
+    def __init__(self, max_distance_km, cuisines=None, price_level=None, boosts=None, weights=None):
+        self.decay_m = max(float(max_distance_km), 0.1) * 1000 / 3
+        self.cuisines = list(cuisines or [])
+        self.target_price = price_level if price_level is not None else DEFAULT_TARGET_PRICE_LEVEL
+        self.boosts = boosts or {}
+        self.weights = weights or get_ranking_weights()
+
+    def distance_score(self):
+        """Expects the queryset to be annotated with ``distance``"""
+        return Exp(Cast(F('distance'), FloatField()) / Value(-self.decay_m))
+
+    def rating_score(self):
+        return Coalesce(F('rating'), Value(0.0)) / Value(5.0)
+
+    def cuisine_score(self):
+        if not self.cuisines:
+            return Value(0.0)
+        overlap = RawSQL(
+            f'cardinality(ARRAY(SELECT unnest("{Restaurant._meta.db_table}"."cuisine_types") '
+            f'INTERSECT SELECT unnest(%s::varchar[])))',
+            (self.cuisines,),
+            output_field=IntegerField(),
+        )
+        return Cast(overlap, FloatField()) / Value(float(len(self.cuisines)))
+
+    def price_score(self):
+        return Case(
+            When(price_level__isnull=True, then=Value(0.5)),
+            default=Value(1.0) - Abs(
+                Cast(F('price_level'), FloatField()) - Value(float(self.target_price))
+            ) / Value(4.0),
+            output_field=FloatField(),
+        )
+
+    def covisitation_score(self):
+        if not self.boosts:
+            return Value(0.0)
+        return Case(
+            *[When(id=restaurant_id, then=Value(float(boost))) for restaurant_id, boost in self.boosts.items()],
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+
+    def popularity_score(self):
+        visitors = Cast(Coalesce(F('stats__unique_visitors'), Value(0)), FloatField())
+        return Value(1.0) - Exp(visitors / Value(-POPULARITY_SCALE))
+
+    def score(self):
+        return (
+            Value(self.weights['distance']) * self.distance_score()
+            + Value(self.weights['rating']) * self.rating_score()
+            + Value(self.weights['cuisine']) * self.cuisine_score()
+            + Value(self.weights['price']) * self.price_score()
+            + Value(self.weights['covisitation']) * self.covisitation_score()
+            + Value(self.weights['popularity']) * self.popularity_score()
+        )
+
+    def score_candidates(self, candidates, lat, lng, max_distance_km):
+        """
+        Score a candidate set (see CandidateService) in one vectorized pass.
+
+        Returns (scores, distance_km). Candidates outside ``max_distance_km``
+        or failing the rating floor get a score of -inf.
+        """
+        distance_km = haversine_km_array(lat, lng, candidates['lat'], candidates['lng'])
+        rating = candidates['rating']
+        price_level = candidates['price_level']
+
+        user_mask, _ = encode_cuisines([self.cuisines], candidates['cuisine_bits'])
+        overlap = np.bitwise_count(candidates['cuisine_mask'] & user_mask).sum(axis=1)
+
+        cuisine = overlap / len(self.cuisines) if self.cuisines else np.zeros(len(distance_km))
+        price = np.where(
+            price_level < 0, 0.5, 1.0 - np.abs(price_level - self.target_price) / 4.0
+        )
+        scores = (
+            self.weights['distance'] * np.exp(distance_km * 1000 / -self.decay_m)
+            + self.weights['rating'] * np.nan_to_num(rating) / 5.0
+            + self.weights['cuisine'] * cuisine
+            + self.weights['price'] * price
+            + self.weights['covisitation'] * self.candidate_boosts(candidates['id'])
+            + self.weights['popularity'] * (1.0 - np.exp(candidates['visitors'] / -POPULARITY_SCALE))
+        )
+
+        # NaN ratings compare False, so unrated places need a cuisine match
+        eligible = (distance_km <= max_distance_km) & ((rating >= MIN_RATING) | (overlap > 0))
+        return np.where(eligible, scores, -np.inf), distance_km
+
+    def candidate_boosts(self, restaurant_ids):
+        """Co-visitation boost of each id, 0 for ids without one"""
+        if not self.boosts:
+            return np.zeros(len(restaurant_ids))
+        boost_ids = np.fromiter(self.boosts.keys(), dtype=np.int64, count=len(self.boosts))
+        boosts = np.fromiter(self.boosts.values(), dtype=np.float64, count=len(self.boosts))
+        order = np.argsort(boost_ids)
+        boost_ids, boosts = boost_ids[order], boosts[order]
+        positions = np.minimum(np.searchsorted(boost_ids, restaurant_ids), len(boost_ids) - 1)
+        return np.where(boost_ids[positions] == restaurant_ids, boosts[positions], 0.0)
+
+    @staticmethod
+    def top_k(scores, distance_km, limit):
+        """Indices of the ``limit`` best scores, nearest first among equal scores"""
+        candidates = np.flatnonzero(np.isfinite(scores))
+        if len(candidates) > limit:
+            best = np.argpartition(-scores[candidates], limit - 1)[:limit]
+            candidates = candidates[best]
+        return candidates[np.lexsort((distance_km[candidates], -scores[candidates]))]
+
+    def rank(self, queryset):
+        """Annotate ``score`` and order best first, nearest breaking ties"""
+        return queryset.annotate(score=self.score()).order_by('-score', 'distance')
@@ -1,83 +1,324 @@
+import logging
+import numpy as np
 from django.contrib.gis.geos import Point
+from django.contrib.postgres.expressions import ArraySubquery
 from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.measure import D
 from django.core.cache import cache
-from django.db import connection
-from apps.restaurants.models import Restaurant
+from django.db.models import F, FloatField, Func, IntegerField, Q, Value
+from apps.receipts.models import Receipt
+from apps.restaurants.models import CuisineType, Restaurant, RestaurantNeighbors, UserCuisineProfile
+from apps.restaurants.services.candidate_service import CandidateService
+from apps.restaurants.services.hours_service import open_mask, week_slot
+from apps.restaurants.services.ranking_service import MIN_RATING, RankingService
+from apps.restaurants.services.spatial_index import spatial_index
+from common.cache import versioned_key
+
+logger = logging.getLogger(__name__)
+
+# Receipts whose restaurants' co-visited neighbors get boosted
+RECENT_VISITS = 10
+
+# Per-user entries are invalidated by version bumps (see signals.py), the
+# TTL only evicts users who stopped coming back
+USER_CACHE_TTL = 24 * 3600
+
+# Columns of a restaurant row on the values() fast path
+RESTAURANT_VALUE_FIELDS = (
+    'id', 'place_id', 'name', 'address', 'cuisine_types', 'rating',
+    'price_level', 'website', 'phone_number', 'latitude', 'longitude',
+)
+
+
+def restaurant_values(queryset, *extra):
+    """Restaurant rows as dicts, coordinates read with ST_Y/ST_X in SQL"""
+    return queryset.annotate(
+        latitude=Func(F('location'), template='ST_Y(%(expressions)s::geometry)', output_field=FloatField()),
+        longitude=Func(F('location'), template='ST_X(%(expressions)s::geometry)', output_field=FloatField()),
+    ).values(*RESTAURANT_VALUE_FIELDS, *extra)
+
+
+def cuisine_overlap(cuisines):
+    """
+    Filter for restaurants serving any of ``cuisines``.
+
+    Names are resolved to CuisineType ids inside the same statement and
+    matched against the GIN-indexed ``cuisine_ids`` column.
+    """
+    cuisine_ids = ArraySubquery(CuisineType.objects.filter(name__in=cuisines).values('id'))
+    return Q(cuisine_ids__overlap=cuisine_ids)
+
 
 class RecommendationService:
     """
     Generates restaurant recommendations for a user based on location,
     cuisine preferences, distance, and price level.
 
-    - Caches top cuisines from user's receipt history.
-    - Filters and ranks restaurants by proximity, rating, and match with preferences.
+    - Reads top cuisines from the user's UserCuisineProfile (cached under
+      the user's version namespace, bumped whenever their receipts change).
+    - Boosts restaurants co-visited with the user's recent ones
+      (RestaurantNeighbors, built offline by CovisitationModelBuilder).
+    - Ranks restaurants in one query by a weighted score of proximity, rating,
+      match with preferences and price (see RankingService).
     - Uses PostGIS for geospatial filtering and efficient queries.
+    - Can rank from tile-cached candidates shared by all users instead
+      (get_cached_recommendations), personalizing in memory. Candidates come
+      from the in-process spatial index when it is loaded.
+    - With ``open_at``, drops restaurants whose hours bitmap says they are
+      closed at that time. Restaurants with unknown hours are kept.
     """
 
-    def __init__(self, user, lat, lng, max_distance_km=10, price_level=None):
+    def __init__(self, user, lat, lng, max_distance_km=10, price_level=None, open_at=None):
         self.user = user
         self.user_location = Point(float(lng), float(lat))
         self.max_distance_km = float(max_distance_km)
         self.price_level = price_level
+        self.open_at = open_at
 
     def get_user_top_cuisines(self, limit=5):
-        cache_key = f"user_cuisines_{self.user.id}"
+        cache_key = versioned_key(f"user_cuisines_{self.user.id}", f"user:{self.user.id}")
         cached = cache.get(cache_key)
         if cached:
             return cached
 
-        top_cuisines = self.get_top_cuisines_from_db(self.user.id, limit)
-        cache.set(cache_key, top_cuisines, 3600)
+        try:
+            profile = UserCuisineProfile.objects.get(pk=self.user.id)
+        except UserCuisineProfile.DoesNotExist:
+            profile = UserCuisineProfile.rebuild(self.user.id)
+
+        top_cuisines = profile.top_cuisines(limit)
+        cache.set(cache_key, top_cuisines, USER_CACHE_TTL)
         return top_cuisines
 
-    @staticmethod
-    def get_top_cuisines_from_db(user_id, limit=5):
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT unnest(restaurant.cuisine_types) AS cuisine, COUNT(*) as count
-                FROM receipts_receipt AS receipt
-                JOIN restaurants_restaurant AS restaurant ON receipt.restaurant_id = restaurant.id
-                WHERE receipt.user_id = %s
-                GROUP BY cuisine
-                ORDER BY count DESC
-                LIMIT %s;
-            """, [user_id, limit])
-            return [row[0] for row in cursor.fetchall()]
+    def get_neighbor_boosts(self):
+        """Map of restaurant id -> similarity to one of the user's recent visits"""
+        cache_key = versioned_key(f"user_neighbors_{self.user.id}", f"user:{self.user.id}", 'covisitation')
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        recent = (
+            Receipt.objects.filter(user_id=self.user.id)
+            .order_by('-date', '-created_at')
+            .values('restaurant_id')[:RECENT_VISITS]
+        )
+        boosts = {}
+        rows = RestaurantNeighbors.objects.filter(restaurant_id__in=recent).values_list('neighbor_ids', 'scores')
+        for neighbor_ids, scores in rows:
+            for neighbor_id, score in zip(neighbor_ids, scores):
+                boosts[neighbor_id] = max(boosts.get(neighbor_id, 0.0), score)
+
+        cache.set(cache_key, boosts, USER_CACHE_TTL)
+        return boosts
 
     def get_recommendations(self, limit=20):
-        """Get restaurant recommendations"""
+        """Get restaurant recommendations ranked in a single query"""
         user_cuisines = self.get_user_top_cuisines()
 
-        base_queryset = Restaurant.objects.filter(
-            location__isnull=False,
-            location__distance_lte=(self.user_location, D(km=self.max_distance_km))
+        # ST_DWithin on geography is answered from the GiST index on location
+        queryset = Restaurant.objects.filter(
+            location__dwithin=(self.user_location, D(km=self.max_distance_km))
         )
 
         if self.price_level is not None:
-            base_queryset = base_queryset.filter(price_level=self.price_level)
+            queryset = queryset.filter(price_level=self.price_level)
 
-        base_queryset = base_queryset.annotate(distance=Distance('location', self.user_location))
+        if self.open_at is not None:
+            # Unknown hours are NULL and kept, bit 0 means closed
+            open_bit = Func(
+                F('hours_bitmap'), Value(week_slot(self.open_at)),
+                function='get_bit', output_field=IntegerField(),
+            )
+            queryset = queryset.alias(open_bit=open_bit).filter(Q(hours_bitmap__isnull=True) | Q(open_bit=1))
 
+        # Places matching the user's cuisines qualify regardless of rating
+        quality = Q(rating__gte=MIN_RATING)
         if user_cuisines:
-            preferred = (
-                base_queryset.filter(cuisine_types__overlap=user_cuisines)
-                .order_by('-rating', 'distance')
-            )
-            preferred_ids = list(preferred.values_list('id', flat=True)[:limit // 2])
-            preferred_restaurants = list(preferred.filter(id__in=preferred_ids))
+            quality |= cuisine_overlap(user_cuisines)
+        queryset = queryset.filter(quality).annotate(
+            distance=Distance('location', self.user_location)
+        )
+
+        ranking = RankingService(
+            max_distance_km=self.max_distance_km,
+            cuisines=user_cuisines,
+            price_level=self.price_level,
+            boosts=self.get_neighbor_boosts(),
+        )
+        return list(ranking.rank(queryset)[:limit])
+
+    def get_cached_recommendations(self, limit=20, values=False):
+        """
+        Rank the shared candidate set of the user's tile in memory.
+
+        Produces the same ranking as get_recommendations, but the only
+        per-request query is the final fetch of the chosen rows. With
+        ``values`` the rows are plain dicts (see fetch_ranked_values).
+        """
+        restaurant_ids = self.get_ranked_ids(limit)
+        return self.fetch_ranked_values(restaurant_ids) if values else self.fetch_ranked(restaurant_ids)
+
+    def get_ranked_ids(self, limit=20):
+        """Ids of the ``limit`` best candidates, best first, without loading rows"""
+        candidates = self.get_candidates()
+        ranking = RankingService(
+            max_distance_km=self.max_distance_km,
+            cuisines=self.get_user_top_cuisines(),
+            price_level=self.price_level,
+            boosts=self.get_neighbor_boosts(),
+        )
+        scores, distance_km = self.score(ranking, candidates)
+        top = ranking.top_k(scores, distance_km, limit)
+        return candidates['id'][top].tolist()
 
-            other = (
-                base_queryset.exclude(id__in=preferred_ids)
-                .filter(rating__gte=3.5)
-                .order_by('-rating', 'distance')[:limit - len(preferred_restaurants)]
+    def score(self, ranking, candidates):
+        """RankingService scores with closed restaurants made ineligible"""
+        lat, lng = self.user_location.y, self.user_location.x
+        scores, distance_km = ranking.score_candidates(candidates, lat, lng, self.max_distance_km)
+        if self.open_at is not None:
+            scores[~open_mask(candidates['hours'], week_slot(self.open_at))] = -np.inf
+        return scores, distance_km
+
+    def get_candidates(self):
+        """Candidates from the spatial index if loaded, else the tile-cached PostGIS query"""
+        lat, lng = self.user_location.y, self.user_location.x
+        if spatial_index.is_ready:
+            try:
+                return spatial_index.get_candidates(lat, lng, self.max_distance_km, self.price_level)
+            except Exception as e:
+                logger.warning(f"Spatial index query failed, falling back to PostGIS: {e}")
+        return CandidateService().get_candidates(lat, lng, self.max_distance_km, self.price_level)
+
+    def fetch_ranked(self, restaurant_ids):
+        """Load restaurants with their distance, keeping the given order"""
+        restaurants = Restaurant.objects.annotate(
+            distance=Distance('location', self.user_location)
+        ).in_bulk(restaurant_ids)
+        return [restaurants[i] for i in restaurant_ids if i in restaurants]
+
+    def fetch_ranked_values(self, restaurant_ids):
+        """Like fetch_ranked, but dict rows with ``distance_km`` and no model instances"""
+        queryset = Restaurant.objects.filter(id__in=restaurant_ids).annotate(
+            distance=Distance('location', self.user_location)
+        )
+        rows = {row['id']: row for row in restaurant_values(queryset, 'distance')}
+        ranked = []
+        for restaurant_id in restaurant_ids:
+            row = rows.get(restaurant_id)
+            if row is None:
+                continue
+            distance = row.pop('distance')
+            row['distance_km'] = distance.km if distance is not None else None
+            ranked.append(row)
+        return ranked
+
+
+class BatchRecommendationService:
+    """
+    Recommendations for several locations of one user in one pass.
+
+    The user's cuisines and co-visitation boosts are computed once, the
+    candidate sets of all locations come from one cache read plus at most
+    one query for the missing tiles, and the chosen restaurants of every
+    location are loaded together as values() rows. Distances are taken from
+    the in-memory scoring (haversine) rather than annotated per location by
+    PostGIS.
+    """
+
+    def __init__(self, user, locations):
+        # locations: dicts with lat, lng and optional max_distance_km, price_level, open_at, limit
+        self.user = user
+        self.services = [
+            RecommendationService(
+                user=user,
+                lat=location['lat'],
+                lng=location['lng'],
+                max_distance_km=location.get('max_distance_km', 10),
+                price_level=location.get('price_level'),
+                open_at=location.get('open_at'),
             )
+            for location in locations
+        ]
+        self.limits = [location.get('limit', 20) for location in locations]
+
+    def get_user_top_cuisines(self):
+        return self.services[0].get_user_top_cuisines() if self.services else []
+
+    def get_candidates(self):
+        if spatial_index.is_ready:
+            return [service.get_candidates() for service in self.services]
+        return CandidateService().get_candidates_many([
+            (service.user_location.y, service.user_location.x, service.max_distance_km, service.price_level)
+            for service in self.services
+        ])
 
-            results = preferred_restaurants + list(other)
-        else:
-            results = list(
-                base_queryset.filter(rating__gte=3.5)
-                .order_by('-rating', 'distance')[:limit]
+    def get_recommendations(self):
+        """One list of restaurant rows per location, in the order given"""
+        if not self.services:
+            return []
+        user_cuisines = self.get_user_top_cuisines()
+        boosts = self.services[0].get_neighbor_boosts()
+
+        ranked = []
+        for service, limit, candidates in zip(self.services, self.limits, self.get_candidates()):
+            ranking = RankingService(
+                max_distance_km=service.max_distance_km,
+                cuisines=user_cuisines,
+                price_level=service.price_level,
+                boosts=boosts,
             )
+            scores, distance_km = service.score(ranking, candidates)
+            top = ranking.top_k(scores, distance_km, limit)
+            ranked.append(list(zip(candidates['id'][top].tolist(), distance_km[top].tolist())))
+
+        restaurant_ids = {restaurant_id for pairs in ranked for restaurant_id, _ in pairs}
+        rows = {row['id']: row for row in restaurant_values(Restaurant.objects.filter(id__in=restaurant_ids))}
+
+        # The same restaurant can be near several locations, copy its row
+        return [
+            [{**rows[restaurant_id], 'distance_km': distance_km} for restaurant_id, distance_km in pairs if restaurant_id in rows]
+            for pairs in ranked
+        ]
+
+
+class GroupRecommendationService(RecommendationService):
+    """
+    Recommendations suiting a group of users at one location.
+
+    All members' cuisine profiles are read in one query and merged, each
+    member's decayed weights normalized to sum to 1 so everybody counts
+    equally. The merged top cuisines then feed the same single ranked
+    query as for one user. Co-visitation boosts are personal and not used.
+    """
+
+    def __init__(self, user_ids, lat, lng, max_distance_km=10, price_level=None, open_at=None):
+        super().__init__(None, lat, lng, max_distance_km, price_level, open_at)
+        self.user_ids = list(user_ids)
+        self._merged_weights = None
+
+    def get_user_top_cuisines(self, limit=5):
+        merged = self.get_merged_weights()
+        return sorted(merged, key=lambda cuisine: (-merged[cuisine], cuisine))[:limit]
+
+    def get_merged_weights(self):
+        """Sum of the members' normalized cuisine weights, computed once"""
+        if self._merged_weights is not None:
+            return self._merged_weights
+        profiles = {
+            profile.user_id: profile
+            for profile in UserCuisineProfile.objects.filter(user_id__in=self.user_ids)
+        }
+        merged = {}
+        for user_id in self.user_ids:
+            profile = profiles.get(user_id) or UserCuisineProfile.rebuild(user_id)
+            weights = profile.decayed_weights()
+            total = sum(weights.values())
+            if not total:
+                continue
+            for cuisine, weight in weights.items():
+                merged[cuisine] = merged.get(cuisine, 0.0) + weight / total
+        self._merged_weights = merged
+        return merged
 
-        return results[:limit]
+    def get_neighbor_boosts(self):
+        return {}
@@ -0,0 +1,62 @@
+import math
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class RecommendationSnapshot:
+    """
+    A ranked recommendation list frozen under an opaque token.
+
+    The first request ranks the top ``size`` restaurants once and stores
+    their ids in order, together with the query that produced them. Later
+    pages slice the stored ids and fetch only that page, so paging is
+    cheap and stays consistent even if rankings change meanwhile.
+    """
+
+    def __init__(self, token, data):
+        self.token = token
+        self.data = data
+
+    @staticmethod
+    def cache_key(token):
+        return f"rec_snapshot_{token}"
+
+    @classmethod
+    def create(cls, service, location, size=None, ttl=None):
+        """Rank for ``service`` and store the result, ``location`` is the label echoed back"""
+        size = size or getattr(settings, 'RECOMMENDATION_SNAPSHOT_SIZE', 200)
+        ttl = ttl or getattr(settings, 'RECOMMENDATION_SNAPSHOT_TTL', 900)
+        data = {
+            'user_id': service.user.id,
+            'lat': service.user_location.y,
+            'lng': service.user_location.x,
+            'max_distance_km': service.max_distance_km,
+            'price_level': service.price_level,
+            'location': location,
+            'user_preferences': service.get_user_top_cuisines(),
+            'ids': service.get_ranked_ids(size),
+        }
+        token = secrets.token_urlsafe(16)
+        cache.set(cls.cache_key(token), data, ttl)
+        return cls(token, data)
+
+    @classmethod
+    def load(cls, token, user):
+        """The snapshot behind ``token`` if it exists and belongs to ``user``"""
+        data = cache.get(cls.cache_key(token))
+        if data is None or data['user_id'] != user.id:
+            return None
+        return cls(token, data)
+
+    @property
+    def count(self):
+        return len(self.data['ids'])
+
+    def pages(self, page_size):
+        return max(1, math.ceil(self.count / page_size))
+
+    def page_ids(self, page, page_size):
+        start = (page - 1) * page_size
+        return self.data['ids'][start:start + page_size]
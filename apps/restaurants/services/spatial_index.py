@@ -0,0 +1,254 @@
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from apps.restaurants.models import Restaurant
+from apps.restaurants.services.candidate_service import build_candidates, current_visitors, stats_version
+from common.geo import EARTH_RADIUS_KM, haversine_km_array
+
+logger = logging.getLogger(__name__)
+
+# Grid cell size in degrees (~1.1 km of latitude)
+DEFAULT_CELL_DEG = 0.01
+
+# Cell keys pack (row, column) into one int64: row * _ROW_STRIDE + column
+_ROW_STRIDE = 1 << 20
+
+_ROW_FIELDS = ('id', 'lng', 'lat', 'rating', 'price_level', 'cuisine_types', 'hours_bitmap', 'visitors')
+_ARRAY_FIELDS = ('id', 'lng', 'lat', 'rating', 'price_level', 'cuisine_mask', 'hours', 'visitors')
+_SORTED_FIELDS = _ARRAY_FIELDS + ('cell_keys',)
+
+
+class RestaurantSpatialIndex:
+    """
+    In-process grid index of restaurants held in NumPy arrays.
+
+    Rows are sorted by grid cell so a radius query is a handful of
+    ``searchsorted`` calls plus one vectorized distance filter. Each worker
+    loads its own copy and refreshes it in a background thread: restaurants
+    changed since the last refresh (by ``updated_at``) replace their rows,
+    which are inserted at their sorted position, and deleted restaurants
+    are dropped. A refresh builds new arrays and swaps them in, so readers
+    never see a half-applied update. Once the RestaurantStats view has been
+    refreshed (see ``stats_version``), the next refresh also reloads the
+    visitor counts of every row, so popularity ranks like the SQL path.
+
+    Cuisines are stored as bitmasks (one bit per cuisine in the index's
+    vocabulary) so overlap with a user's cuisines is a popcount. Cuisines
+    first seen on refresh get the next free bits, so stored masks stay valid.
+    """
+
+    def __init__(self, cell_deg=DEFAULT_CELL_DEG, refresh_interval=None, refresh_overlap=None):
+        self.cell_deg = cell_deg
+        self.refresh_interval = refresh_interval or getattr(
+            settings, 'RESTAURANT_SPATIAL_INDEX_REFRESH_SECONDS', 60
+        )
+        self.refresh_overlap = timedelta(seconds=refresh_overlap if refresh_overlap is not None else getattr(
+            settings, 'RESTAURANT_INDEX_REFRESH_OVERLAP_SECONDS', 300
+        ))
+        self._data = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_ready(self):
+        return self._data is not None
+
+    def load(self):
+        """Load every restaurant with a location, replacing the current data"""
+        # Read before the rows, so a stats refresh during the load is applied next time
+        version = stats_version()
+        rows = self._fetch_rows(Restaurant.objects.filter(location__isnull=False))
+        data = self._build(rows)
+        data['stats_version'] = version
+        self._data = data
+        self._refreshed_at = time.monotonic()
+        logger.info(f"Spatial index loaded with {len(self._data['id'])} restaurants")
+
+    def load_in_background(self):
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                logger.warning(f"Spatial index not loaded, falling back to PostGIS: {e}")
+            finally:
+                connection.close()
+
+        threading.Thread(target=run, name='restaurant-spatial-index', daemon=True).start()
+
+    def refresh(self):
+        """Apply restaurants changed or deleted since the last load or refresh"""
+        data = self._data
+        if data is None or data['updated_until'] is None:
+            return self.load()
+
+        # A transaction committing late saves rows with an updated_at before
+        # the high-water mark, so every refresh re-reads a window below it
+        changed = self._fetch_rows(
+            Restaurant.objects.filter(updated_at__gt=data['updated_until'] - self.refresh_overlap)
+        )
+        located_ids = np.fromiter(
+            Restaurant.objects.filter(location__isnull=False).order_by()
+            .values_list('id', flat=True).iterator(chunk_size=10_000),
+            dtype=np.int64,
+        )
+        patched = self._patch(data, changed, located_ids)
+        version = stats_version()
+        if version != data['stats_version']:
+            patched['visitors'] = current_visitors(patched['id'])
+        patched['stats_version'] = version
+        self._data = patched
+        self._refreshed_at = time.monotonic()
+
+    def maybe_refresh(self):
+        """Start a background refresh once the data is older than the refresh interval"""
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        # One thread refreshes, requests keep reading the current arrays
+        if not self._lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Spatial index refresh failed: {e}")
+                self._refreshed_at = time.monotonic()
+            finally:
+                self._lock.release()
+                connection.close()
+
+        threading.Thread(target=run, name='restaurant-spatial-index-refresh', daemon=True).start()
+
+    def get_candidates(self, lat, lng, radius_km, price_level=None):
+        """Restaurants within ``radius_km`` of (lat, lng), in the CandidateService format"""
+        self.maybe_refresh()
+        data = self._data
+        rows = self._rows_in_radius(data, lat, lng, radius_km)
+        if price_level is not None:
+            rows = rows[data['price_level'][rows] == price_level]
+
+        candidates = {field: data[field][rows] for field in _ARRAY_FIELDS}
+        candidates['cuisine_bits'] = data['cuisine_bits']
+        return candidates
+
+    def _rows_in_radius(self, data, lat, lng, radius_km):
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        row_min, row_max = self._cell(lat - dlat), self._cell(lat + dlat)
+        col_min, col_max = self._cell(lng - dlng), self._cell(lng + dlng)
+
+        keys = data['cell_keys']
+        slices = []
+        for row in range(row_min, row_max + 1):
+            start = np.searchsorted(keys, row * _ROW_STRIDE + col_min, side='left')
+            end = np.searchsorted(keys, row * _ROW_STRIDE + col_max, side='right')
+            if end > start:
+                slices.append(np.arange(start, end))
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+
+        rows = np.concatenate(slices)
+        distance_km = haversine_km_array(lat, lng, data['lat'][rows], data['lng'][rows])
+        return rows[distance_km <= radius_km]
+
+    def _cell(self, degrees):
+        # Offset keeps cell numbers positive for the whole globe
+        return int(math.floor((degrees + 180.0) / self.cell_deg))
+
+    def _cell_keys(self, lat, lng):
+        return (
+            np.floor((lat + 180.0) / self.cell_deg).astype(np.int64) * _ROW_STRIDE
+            + np.floor((lng + 180.0) / self.cell_deg).astype(np.int64)
+        )
+
+    def _candidates(self, rows, cuisine_bits=None):
+        """Candidate arrays of fetched rows with their cell keys, sorted by cell"""
+        data = build_candidates(
+            rows['id'], rows['lng'], rows['lat'], rows['rating'],
+            rows['price_level'], rows['cuisine_types'], cuisine_bits=cuisine_bits,
+            hours_bitmaps=rows['hours_bitmap'], visitors=rows['visitors'],
+        )
+        data['cell_keys'] = self._cell_keys(data['lat'], data['lng'])
+        order = np.argsort(data['cell_keys'], kind='stable')
+        for field in _SORTED_FIELDS:
+            data[field] = data[field][order]
+        return data
+
+    def _build(self, rows):
+        data = self._candidates(rows)
+        data['updated_until'] = rows['updated_until']
+        return data
+
+    def _patch(self, data, changed, located_ids):
+        """
+        New arrays with the rows of changed restaurants replaced and those
+        of restaurants no longer located dropped. The remaining rows are
+        still sorted, so changed ones are inserted at their sorted position
+        and nothing is re-encoded or re-sorted.
+        """
+        keep = ~np.isin(data['id'], np.asarray(changed['changed_ids'], dtype=np.int64))
+        keep &= np.isin(data['id'], located_ids)
+
+        cuisine_bits = data['cuisine_bits']
+        new_cuisines = sorted(
+            {cuisine for cuisines in changed['cuisine_types'] for cuisine in cuisines} - cuisine_bits.keys()
+        )
+        if new_cuisines:
+            cuisine_bits = {
+                **cuisine_bits,
+                **{cuisine: len(cuisine_bits) + bit for bit, cuisine in enumerate(new_cuisines)},
+            }
+        rows = self._candidates(changed, cuisine_bits)
+        # Restaurants deleted since they were fetched
+        located = np.isin(rows['id'], located_ids)
+        rows = {field: rows[field][located] for field in _SORTED_FIELDS}
+
+        kept = {field: data[field][keep] for field in _SORTED_FIELDS}
+        missing_words = rows['cuisine_mask'].shape[1] - kept['cuisine_mask'].shape[1]
+        if missing_words > 0:
+            kept['cuisine_mask'] = np.pad(kept['cuisine_mask'], ((0, 0), (0, missing_words)))
+
+        positions = np.searchsorted(kept['cell_keys'], rows['cell_keys'], side='right')
+        patched = {
+            field: np.insert(kept[field], positions, rows[field], axis=0)
+            for field in _SORTED_FIELDS
+        }
+        patched['cuisine_bits'] = cuisine_bits
+        patched['updated_until'] = max(filter(None, [data['updated_until'], changed['updated_until']]))
+        return patched
+
+    @staticmethod
+    def _fetch_rows(queryset):
+        rows = {field: [] for field in _ROW_FIELDS}
+        rows['changed_ids'] = []
+        rows['updated_until'] = None
+        values = queryset.order_by().values_list(
+            'id', 'location', 'rating', 'price_level', 'cuisine_types', 'hours_bitmap',
+            'stats__unique_visitors', 'updated_at'
+        )
+        for restaurant_id, location, rating, price_level, cuisine_types, bitmap, visitors, updated_at in values.iterator(chunk_size=10_000):
+            rows['changed_ids'].append(restaurant_id)
+            if rows['updated_until'] is None or updated_at > rows['updated_until']:
+                rows['updated_until'] = updated_at
+            if location is None:
+                continue
+            rows['id'].append(restaurant_id)
+            rows['lng'].append(location.x)
+            rows['lat'].append(location.y)
+            rows['rating'].append(rating)
+            rows['price_level'].append(price_level)
+            rows['cuisine_types'].append(cuisine_types)
+            rows['hours_bitmap'].append(None if bitmap is None else bytes(bitmap))
+            rows['visitors'].append(visitors)
+        return rows
+
+
+# One index per worker process, loaded at startup when
+# settings.RESTAURANT_SPATIAL_INDEX_ENABLED is set
+spatial_index = RestaurantSpatialIndex()
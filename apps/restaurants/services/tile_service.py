@@ -0,0 +1,124 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from apps.restaurants.models import CuisineType, Restaurant, RestaurantStats
+from common.cache import versioned_key
+from common.geo import tiles_for_point
+
+MAX_ZOOM = 22
+
+# Tile coordinate space and the buffer around it, in tile units
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+
+MVT_LAYER = 'restaurants'
+
+
+def get_invalidation_zoom():
+    return getattr(settings, 'RESTAURANT_TILE_INVALIDATION_ZOOM', 16)
+
+
+def tile_namespace(z, x, y):
+    """
+    Cache version namespace of a tile.
+
+    Tiles deeper than the invalidation zoom share the namespace of their
+    ancestor at that zoom, so a change bumps a bounded number of versions.
+    """
+    zoom = min(z, get_invalidation_zoom())
+    shift = z - zoom
+    return f"tile:{zoom}/{x >> shift}/{y >> shift}"
+
+
+def point_tile_namespaces(lat, lng):
+    """Namespaces of every tile, at every zoom, that renders a restaurant at (lat, lng)"""
+    margin = MVT_BUFFER / MVT_EXTENT
+    return [
+        f"tile:{zoom}/{x}/{y}"
+        for zoom in range(get_invalidation_zoom() + 1)
+        for x, y in tiles_for_point(lat, lng, zoom, margin)
+    ]
+
+
+class VectorTileService:
+    """
+    Restaurants as Mapbox vector tiles rendered by PostGIS ``ST_AsMVT``.
+
+    The cache is content addressed: a tile's key (coordinates, filters and
+    the tile's version, see ``tile_namespace``) maps to the SHA-256 of the
+    rendered bytes, and the bytes are stored once under that hash. Empty
+    and identical tiles share one entry, and the hash doubles as the ETag.
+    Saving or deleting a restaurant bumps the versions of the tiles it
+    appears in (see signals.py), so only those tiles are re-rendered.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or getattr(settings, 'RESTAURANT_TILE_CACHE_TTL', 24 * 3600)
+
+    @staticmethod
+    def content_key(digest):
+        return f"mvt_content_{digest}"
+
+    @staticmethod
+    def tile_key(z, x, y, cuisines=(), price_level=None, min_rating=None):
+        filters = f"{','.join(sorted(cuisines))}|{price_level}|{min_rating}"
+        filters_digest = hashlib.sha256(filters.encode()).hexdigest()[:16]
+        return versioned_key(f"mvt_tile_{z}_{x}_{y}_{filters_digest}", tile_namespace(z, x, y))
+
+    def get_tile(self, z, x, y, cuisines=(), price_level=None, min_rating=None):
+        """Return (tile bytes, content hash)"""
+        key = self.tile_key(z, x, y, cuisines, price_level, min_rating)
+        digest = cache.get(key)
+        if digest is not None:
+            content = cache.get(self.content_key(digest))
+            if content is not None:
+                return content, digest
+
+        content = self.render(z, x, y, cuisines, price_level, min_rating)
+        digest = hashlib.sha256(content).hexdigest()
+        cache.set_many({self.content_key(digest): content, key: digest}, self.ttl)
+        return content, digest
+
+    def render(self, z, x, y, cuisines=(), price_level=None, min_rating=None):
+        """Render one tile; the GiST index on location selects the restaurants"""
+        cuisine_ids = CuisineType.ids_for(cuisines, create=False) if cuisines else None
+        sql = f"""
+            WITH bounds AS (
+                SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS tile,
+                       ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s) AS area
+            )
+            SELECT ST_AsMVT(features, %(layer)s, %(extent)s, 'geom', 'id')
+            FROM (
+                SELECT r.id, r.name, r.rating, r.price_level,
+                       array_to_string(r.cuisine_types, ',') AS cuisines,
+                       COALESCE(s.unique_visitors, 0) AS visitors,
+                       ST_AsMVTGeom(
+                           ST_Transform(r.location::geometry, 3857), bounds.tile, %(extent)s, %(buffer)s, true
+                       ) AS geom
+                FROM {Restaurant._meta.db_table} r
+                CROSS JOIN bounds
+                LEFT JOIN {RestaurantStats._meta.db_table} s ON s.restaurant_id = r.id
+                WHERE r.location && ST_Transform(bounds.area, 4326)::geography
+                  AND (%(cuisine_ids)s::bigint[] IS NULL OR r.cuisine_ids && %(cuisine_ids)s::bigint[])
+                  AND (%(price_level)s::integer IS NULL OR r.price_level = %(price_level)s::integer)
+                  AND (%(min_rating)s::double precision IS NULL OR r.rating >= %(min_rating)s::double precision)
+            ) AS features
+            WHERE features.geom IS NOT NULL
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {
+                'z': z,
+                'x': x,
+                'y': y,
+                'margin': MVT_BUFFER / MVT_EXTENT,
+                'layer': MVT_LAYER,
+                'extent': MVT_EXTENT,
+                'buffer': MVT_BUFFER,
+                'cuisine_ids': cuisine_ids,
+                'price_level': price_level,
+                'min_rating': min_rating,
+            })
+            content = cursor.fetchone()[0]
+        return bytes(content) if content is not None else b''
@@ -0,0 +1,265 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from apps.restaurants.models import Restaurant
+from apps.restaurants.services.candidate_service import current_visitors, stats_version
+from apps.restaurants.services.ranking_service import POPULARITY_SCALE
+from common.geo import haversine_km_array
+
+logger = logging.getLogger(__name__)
+
+# Keys are fixed-width so the sorted key column is one contiguous array
+KEY_LENGTH = 48
+
+# Shorter queries match too much of the index to rank quickly
+MIN_QUERY_LENGTH = 2
+
+# A restaurant is found by its full name and by the start of each later word
+MAX_ALIASES = 4
+
+# Score = popularity + proximity, with a bonus when the full name matches
+POPULARITY_WEIGHT = 0.5
+PROXIMITY_WEIGHT = 0.5
+PROXIMITY_DECAY_KM = 2.0
+FULL_NAME_BONUS = 0.2
+
+_APOSTROPHES = re.compile(r"['’`]")
+_NON_WORD = re.compile(r"[\W_]+")
+
+_ENTRY_FIELDS = ('key', 'id', 'full_name', 'name', 'address', 'lat', 'lng', 'visitors')
+
+
+def normalize_name(text):
+    """Case-folded, accent-free words separated by single spaces"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = _APOSTROPHES.sub('', text.casefold())
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+def name_aliases(name):
+    """Normalized keys of a name: the full name, then from each later word on"""
+    words = normalize_name(name).split()
+    return [' '.join(words[start:])[:KEY_LENGTH] for start in range(min(len(words), MAX_ALIASES))]
+
+
+class RestaurantTypeaheadIndex:
+    """
+    In-process prefix index of restaurant names for autocompletion.
+
+    Every restaurant contributes one entry per alias (see ``name_aliases``),
+    and entries are kept sorted by key so the matches of a prefix are the
+    contiguous slice between two ``searchsorted`` calls. The slice is then
+    ranked by popularity and, when the client sends its position, distance.
+
+    Like the spatial index, each worker holds its own copy and refreshes it
+    in the background from ``Restaurant.updated_at``: entries of changed and
+    deleted restaurants are dropped, new entries are merged in without
+    resorting, and the new arrays are swapped in at once. Visitor counts
+    are reloaded once the RestaurantStats view has been refreshed.
+    """
+
+    def __init__(self, refresh_interval=None, refresh_overlap=None):
+        self.refresh_interval = refresh_interval or getattr(
+            settings, 'RESTAURANT_TYPEAHEAD_REFRESH_SECONDS', 60
+        )
+        self.refresh_overlap = timedelta(seconds=refresh_overlap if refresh_overlap is not None else getattr(
+            settings, 'RESTAURANT_INDEX_REFRESH_OVERLAP_SECONDS', 300
+        ))
+        self._data = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_ready(self):
+        return self._data is not None
+
+    def load(self):
+        """Index every restaurant, replacing the current data"""
+        # Read before the rows, so a stats refresh during the load is applied next time
+        version = stats_version()
+        entries, _, updated_until = self._fetch_entries(Restaurant.objects.all())
+        entries['updated_until'] = updated_until
+        entries['stats_version'] = version
+        self._data = entries
+        self._refreshed_at = time.monotonic()
+        logger.info(f"Typeahead index loaded with {len(entries['key'])} names")
+
+    def load_in_background(self):
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                logger.warning(f"Typeahead index not loaded, falling back to the database: {e}")
+            finally:
+                connection.close()
+
+        threading.Thread(target=run, name='restaurant-typeahead-index', daemon=True).start()
+
+    def refresh(self):
+        """Apply restaurants changed or deleted since the last load or refresh"""
+        data = self._data
+        if data is None or data['updated_until'] is None:
+            return self.load()
+
+        # A transaction committing late saves rows with an updated_at before
+        # the high-water mark, so every refresh re-reads a window below it
+        changed, changed_ids, updated_until = self._fetch_entries(
+            Restaurant.objects.filter(updated_at__gt=data['updated_until'] - self.refresh_overlap)
+        )
+        restaurant_ids = np.fromiter(
+            Restaurant.objects.order_by().values_list('id', flat=True).iterator(chunk_size=10_000),
+            dtype=np.int64,
+        )
+        version = stats_version()
+
+        keep = ~np.isin(data['id'], np.asarray(changed_ids, dtype=np.int64))
+        keep &= np.isin(data['id'], restaurant_ids)
+        kept = {field: data[field][keep] for field in _ENTRY_FIELDS}
+        # Restaurants deleted since they were fetched
+        current = np.isin(changed['id'], restaurant_ids)
+        changed = {field: changed[field][current] for field in _ENTRY_FIELDS}
+        # Both sides are sorted, so inserting at the searchsorted positions
+        # keeps the merged keys sorted
+        positions = np.searchsorted(kept['key'], changed['key'])
+        merged = {field: np.insert(kept[field], positions, changed[field]) for field in _ENTRY_FIELDS}
+        if version != data['stats_version']:
+            merged['visitors'] = current_visitors(merged['id'])
+        merged['stats_version'] = version
+        merged['updated_until'] = max(filter(None, [data['updated_until'], updated_until]))
+        self._data = merged
+        self._refreshed_at = time.monotonic()
+
+    def maybe_refresh(self):
+        """Start a background refresh once the data is older than the refresh interval"""
+        if time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        # One thread refreshes, searches keep reading the current arrays
+        if not self._lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Typeahead index refresh failed: {e}")
+                self._refreshed_at = time.monotonic()
+            finally:
+                self._lock.release()
+                connection.close()
+
+        threading.Thread(target=run, name='restaurant-typeahead-index-refresh', daemon=True).start()
+
+    def search(self, query, lat=None, lng=None, limit=8):
+        """Best ``limit`` restaurants whose name or a later word of it starts with ``query``"""
+        prefix = normalize_name(query)[:KEY_LENGTH - 1]
+        if len(prefix) < MIN_QUERY_LENGTH:
+            return []
+        self.maybe_refresh()
+        data = self._data
+
+        keys = data['key']
+        start = np.searchsorted(keys, prefix, side='left')
+        end = np.searchsorted(keys, prefix + '\U0010ffff', side='left')
+        if start == end:
+            return []
+
+        visitors = data['visitors'][start:end]
+        scores = POPULARITY_WEIGHT * (1.0 - np.exp(-visitors / POPULARITY_SCALE))
+        scores += FULL_NAME_BONUS * data['full_name'][start:end]
+        distance_km = None
+        if lat is not None and lng is not None:
+            distance_km = haversine_km_array(lat, lng, data['lat'][start:end], data['lng'][start:end])
+            # Restaurants without a location get no proximity score
+            scores += PROXIMITY_WEIGHT * np.nan_to_num(np.exp(-distance_km / PROXIMITY_DECAY_KM))
+
+        # A restaurant can match through several aliases, so keep enough
+        # entries to still have ``limit`` distinct restaurants
+        best = np.arange(len(scores))
+        keep = limit * MAX_ALIASES
+        if len(scores) > keep:
+            best = np.argpartition(-scores, keep - 1)[:keep]
+        best = best[np.argsort(-scores[best], kind='stable')]
+
+        results, seen = [], set()
+        for row in best:
+            restaurant_id = int(data['id'][start + row])
+            if restaurant_id in seen:
+                continue
+            seen.add(restaurant_id)
+            distance = None if distance_km is None else float(distance_km[row])
+            results.append({
+                'id': restaurant_id,
+                'name': data['name'][start + row],
+                'address': data['address'][start + row],
+                'distance_km': None if distance is None or np.isnan(distance) else round(distance, 2),
+            })
+            if len(results) == limit:
+                break
+        return results
+
+    @staticmethod
+    def _fetch_entries(queryset):
+        """Sorted entry arrays for ``queryset``, its restaurant ids and latest ``updated_at``"""
+        entries = {field: [] for field in _ENTRY_FIELDS}
+        changed_ids = []
+        updated_until = None
+        values = queryset.order_by().values_list(
+            'id', 'name', 'address', 'location', 'stats__unique_visitors', 'updated_at'
+        )
+        for restaurant_id, name, address, location, visitors, updated_at in values.iterator(chunk_size=10_000):
+            changed_ids.append(restaurant_id)
+            if updated_until is None or updated_at > updated_until:
+                updated_until = updated_at
+            for position, alias in enumerate(name_aliases(name)):
+                entries['key'].append(alias)
+                entries['id'].append(restaurant_id)
+                entries['full_name'].append(position == 0)
+                entries['name'].append(name)
+                entries['address'].append(address)
+                entries['lat'].append(np.nan if location is None else location.y)
+                entries['lng'].append(np.nan if location is None else location.x)
+                entries['visitors'].append(visitors or 0)
+
+        arrays = {
+            'key': np.asarray(entries['key'], dtype=f'<U{KEY_LENGTH}'),
+            'id': np.asarray(entries['id'], dtype=np.int64),
+            'full_name': np.asarray(entries['full_name'], dtype=bool),
+            'name': np.asarray(entries['name'], dtype=object),
+            'address': np.asarray(entries['address'], dtype=object),
+            'lat': np.asarray(entries['lat'], dtype=np.float64),
+            'lng': np.asarray(entries['lng'], dtype=np.float64),
+            'visitors': np.asarray(entries['visitors'], dtype=np.int32),
+        }
+        order = np.argsort(arrays['key'], kind='stable')
+        return {field: array[order] for field, array in arrays.items()}, changed_ids, updated_until
+
+
+def search_restaurants(query, lat=None, lng=None, limit=8):
+    """Typeahead matches from the index, or from the database until it is loaded"""
+    if typeahead_index.is_ready:
+        return typeahead_index.search(query, lat, lng, limit)
+
+    prefix = query.strip()
+    if len(prefix) < MIN_QUERY_LENGTH:
+        return []
+    # An index scan on restaurants_name_prefix, see Restaurant.Meta
+    rows = (
+        Restaurant.objects.filter(name__istartswith=prefix)
+        .order_by(F('stats__unique_visitors').desc(nulls_last=True), 'name')
+        .values('id', 'name', 'address')[:limit]
+    )
+    return [{**row, 'distance_km': None} for row in rows]
+
+
+# One index per worker process, loaded at startup when
+# settings.RESTAURANT_TYPEAHEAD_INDEX_ENABLED is set
+typeahead_index = RestaurantTypeaheadIndex()
@@ -0,0 +1,85 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from apps.receipts.models import Receipt
+from apps.restaurants.models import Restaurant, UserCuisineProfile
+from apps.restaurants.services.candidate_service import region_namespace
+from apps.restaurants.services.tile_service import point_tile_namespaces
+from common.cache import bump_version, bump_versions
+
+
+def restaurant_cuisines(restaurant_id):
+    if restaurant_id is None:
+        return []
+    return Restaurant.objects.filter(id=restaurant_id).values_list('cuisine_types', flat=True).first() or []
+
+
+def invalidate_user_recommendations(user_id):
+    bump_version(f"user:{user_id}")
+
+
+def invalidate_locations(*locations):
+    """Invalidate cached candidates and map tiles around restaurant locations"""
+    namespaces = set()
+    for location in locations:
+        if location is not None:
+            namespaces.add(region_namespace(location.y, location.x))
+            namespaces.update(point_tile_namespaces(location.y, location.x))
+    bump_versions(namespaces)
+
+
+@receiver(post_init, sender=Restaurant)
+def remember_location(sender, instance, **kwargs):
+    instance._cached_location = instance.__dict__.get('location')
+
+
+@receiver(post_save, sender=Restaurant)
+def invalidate_restaurant_regions(sender, instance, **kwargs):
+    # A move invalidates both the region it left and the one it entered
+    invalidate_locations(instance.location, instance._cached_location)
+    instance._cached_location = instance.location
+
+
+@receiver(post_delete, sender=Restaurant)
+def invalidate_deleted_restaurant_region(sender, instance, **kwargs):
+    invalidate_locations(instance.location)
+
+
+@receiver(post_init, sender=Receipt)
+def remember_linked_restaurant(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields don't trigger a query
+    instance._linked_restaurant_id = instance.__dict__.get('restaurant_id')
+    instance._linked_visit_date = instance.__dict__.get('date')
+
+
+def visit_weight(visit_date):
+    # Visits count with their decayed weight, as UserCuisineProfile.rebuild counts them
+    return UserCuisineProfile.visit_weight(visit_date) if visit_date is not None else 1.0
+
+
+@receiver(post_save, sender=Receipt)
+def update_cuisine_profile(sender, instance, created, **kwargs):
+    previous = None if created else instance._linked_restaurant_id
+    previous_date = instance._linked_visit_date
+    if not created and previous == instance.restaurant_id and previous_date == instance.date:
+        return
+
+    if previous is not None:
+        UserCuisineProfile.record_visit(
+            instance.user_id, restaurant_cuisines(previous), weight=-visit_weight(previous_date)
+        )
+    UserCuisineProfile.record_visit(
+        instance.user_id, restaurant_cuisines(instance.restaurant_id), weight=visit_weight(instance.date)
+    )
+    instance._linked_restaurant_id = instance.restaurant_id
+    instance._linked_visit_date = instance.date
+    invalidate_user_recommendations(instance.user_id)
+
+
+@receiver(post_delete, sender=Receipt)
+def remove_from_cuisine_profile(sender, instance, **kwargs):
+    UserCuisineProfile.record_visit(
+        instance.user_id, restaurant_cuisines(instance.restaurant_id),
+        weight=-visit_weight(instance.date), rebuild_missing=False,
+    )
+    invalidate_user_recommendations(instance.user_id)
@@ -0,0 +1,51 @@
+import logging
+from celery import shared_task
+from django.conf import settings
+
+from apps.restaurants.models import RestaurantStats
+from apps.restaurants.services.candidate_service import STATS_NAMESPACE
+from apps.restaurants.services.covisitation_service import CovisitationModelBuilder
+from apps.restaurants.services.prewarm_service import RecommendationPrewarmer
+from common.cache import bump_version
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def build_covisitation_model():
+    """Nightly rebuild of the restaurant co-visitation neighbors"""
+    stored = CovisitationModelBuilder().build()
+    logger.info(f"Stored co-visitation neighbors for {stored} restaurants")
+    return stored
+
+
+@shared_task
+def refresh_restaurant_stats():
+    """Recompute visit and spend statistics without blocking readers"""
+    RestaurantStats.refresh(concurrently=True)
+    # In-process indexes reload their visitor counts on their next refresh
+    bump_version(STATS_NAMESPACE)
+    logger.info("Restaurant stats refreshed")
+
+
+@shared_task
+def prewarm_recommendations():
+    """
+    Queue cache warming for active users ahead of the lunch peak.
+
+    Batches are staggered by RECOMMENDATION_PREWARM_BATCH_INTERVAL seconds
+    so only one batch queries the database at a time.
+    """
+    prewarmer = RecommendationPrewarmer()
+    interval = getattr(settings, 'RECOMMENDATION_PREWARM_BATCH_INTERVAL', 10)
+    batches = 0
+    for index, batch in enumerate(prewarmer.batches(prewarmer.active_locations())):
+        warm_recommendation_batch.apply_async(args=[batch], countdown=index * interval)
+        batches += 1
+    logger.info(f"Queued {batches} recommendation pre-warming batches")
+    return batches
+
+
+@shared_task
+def warm_recommendation_batch(locations):
+    return RecommendationPrewarmer().warm(locations)
@@ -1,19 +1,53 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
 from jsonschema import ValidationError
+import numpy as np
 import pytest
 from django.contrib.gis.geos import Point
 from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
 from rest_framework import status
 
-from apps.restaurants.models import Restaurant
-from apps.restaurants.serializers import RecommendationSerializer, RestaurantSerializer
-from apps.restaurants.services.recommendation_service import RecommendationService
-from apps.restaurants.tests.factories import RestaurantFactory
+from apps.receipts.tests.factories import ReceiptFactory
+from apps.restaurants.models import (
+    CuisineType,
+    Restaurant,
+    RestaurantNeighbors,
+    RestaurantStats,
+    UserCuisineProfile,
+)
+from apps.restaurants.services.covisitation_service import CovisitationModelBuilder
+from apps.restaurants.serializers import RecommendationSerializer, RestaurantSerializer, represent_restaurant
+from apps.restaurants.services.candidate_service import CandidateService, build_candidates
+from apps.restaurants.services.cluster_index import RestaurantClusterIndex
+from apps.restaurants.services.ranking_service import RankingService
+from apps.restaurants.services.recommendation_service import RecommendationService, cuisine_overlap
+from apps.restaurants.services.hours_service import hours_bitmap, hours_matrix, open_mask, week_slot
+from apps.restaurants.services.prewarm_service import RecommendationPrewarmer
+from apps.restaurants.services.snapshot_service import RecommendationSnapshot
+from apps.restaurants.services.spatial_index import RestaurantSpatialIndex
+from apps.restaurants.services.tile_service import VectorTileService, point_tile_namespaces
+from apps.restaurants.services.typeahead_index import RestaurantTypeaheadIndex
+from apps.restaurants.tasks import prewarm_recommendations, refresh_restaurant_stats
+from apps.restaurants.tests.factories import RestaurantFactory, UserFactory
+from common.cache import get_versions, stale_while_revalidate
 
 pytest_plugins = [
     'apps.users.tests.fixtures',
     'pytest_mock'
 ]
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Candidate sets are shared per tile, don't let them leak between tests
+    cache.clear()
+    yield
+    cache.clear()
+
 # Test Restaurant Model
 @pytest.mark.django_db
 def test_restaurant_model_creation():
@@ -104,6 +138,44 @@ def test_recommendation_service_cuisine_preference(guest_user, mocker):
     recommendations = service.get_recommendations(limit=2)
     assert recommendations[0].id == italian_restaurant.id  # Italian should come first due to preference
 
+@pytest.mark.django_db
+def test_recommendation_service_ranks_in_single_query(guest_user, mocker, django_assert_num_queries):
+    mocker.patch(
+        'apps.restaurants.services.recommendation_service.RecommendationService.get_user_top_cuisines',
+        return_value=['Italian']
+    )
+    mocker.patch(
+        'apps.restaurants.services.recommendation_service.RecommendationService.get_neighbor_boosts',
+        return_value={}
+    )
+    RestaurantFactory.create_batch(3, location=Point(13.4050, 52.5200), cuisine_types=['Italian'])
+
+    service = RecommendationService(user=guest_user, lat=52.5200, lng=13.4050, max_distance_km=5)
+
+    with django_assert_num_queries(1):
+        recommendations = service.get_recommendations(limit=10)
+    assert len(recommendations) == 3
+    assert all(hasattr(r, 'score') for r in recommendations)
+
+@pytest.mark.django_db
+def test_recommendation_service_score_ordering(guest_user, mocker):
+    mocker.patch(
+        'apps.restaurants.services.recommendation_service.RecommendationService.get_user_top_cuisines',
+        return_value=['Thai']
+    )
+    near = RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Greek'], rating=4.0)
+    far = RestaurantFactory.create(location=Point(13.4500, 52.5200), cuisine_types=['Greek'], rating=4.0)
+    low_rated_preferred = RestaurantFactory.create(
+        location=Point(13.4050, 52.5200), cuisine_types=['Thai'], rating=3.0
+    )
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Greek'], rating=3.0)
+
+    service = RecommendationService(user=guest_user, lat=52.5200, lng=13.4050, max_distance_km=5)
+    recommendations = service.get_recommendations(limit=10)
+
+    # Low rated places only qualify when they match the user's cuisines
+    assert [r.id for r in recommendations] == [low_rated_preferred.id, near.id, far.id]
+
 # # Test RecommendationView API
 @pytest.mark.django_db
 def test_recommendation_view_missing_params(authenticated_guest_client):
@@ -121,6 +193,20 @@ def test_recommendation_view_invalid_params(authenticated_guest_client):
     assert response.status_code == status.HTTP_400_BAD_REQUEST
     assert 'Invalid parameters' in response.json()['error']
 
+    response = client.get('/api/v1/recommendations/?lat=52.5200&lng=13.4050&limit=many')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db
+def test_recommendation_view_clamps_limit(authenticated_guest_client):
+    client, _ = authenticated_guest_client
+    RestaurantFactory.create_batch(2, location=Point(13.4050, 52.5200))
+
+    for limit in (0, -3):
+        response = client.get(f'/api/v1/recommendations/?lat=52.5200&lng=13.4050&limit={limit}')
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()['recommendations']) == 1
+        assert response.json()['pages'] == 2
+
 @pytest.mark.django_db
 def test_recommendation_view_success(authenticated_guest_client):
     client, user = authenticated_guest_client
@@ -143,26 +229,700 @@ def test_recommendation_view_success(authenticated_guest_client):
     assert response.json()['price_level_filter'] == 2
 
 @pytest.mark.django_db
-def test_recommendation_view_cache(authenticated_guest_client, mocker):
+def test_recommendation_view_cache_shared_per_tile(authenticated_guest_client, mocker):
     client, user = authenticated_guest_client
-    cache_key = f"rec_{user.id}_52.5200_13.4050_5_2_1"
-    
-    # Mock cache
-    cached_data = {
-        'recommendations': [],
-        'total_count': 0,
-        'location': '52.5200, 13.4050',
-        'max_distance_km': 5.0,
-        'price_level_filter': 2,
-        'user_preferences': []
-    }
-    cache.set(cache_key, cached_data, 300)
-    
-    response = client.get('/api/v1/recommendations/?lat=52.5200&lng=13.4050&max_distance=5&price_level=2&limit=1')
-    
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Italian'], rating=4.5)
+    fetch = mocker.spy(CandidateService, 'fetch_candidates')
+
+    # Two nearby points in the same tile reuse one candidate query
+    first = client.get('/api/v1/recommendations/?lat=52.5200&lng=13.4050&max_distance=5')
+    second = client.get('/api/v1/recommendations/?lat=52.5201&lng=13.4051&max_distance=5')
+
+    assert first.status_code == status.HTTP_200_OK
+    assert second.json()['total_count'] == 1
+    assert fetch.call_count == 1
+    assert cache.get(CandidateService().versioned_cache_key('u33dc0', 5, None)) is not None
+
+@pytest.mark.django_db
+def test_recommendation_view_pages_from_snapshot(authenticated_guest_client, django_assert_max_num_queries):
+    client, user = authenticated_guest_client
+    for i in range(5):
+        RestaurantFactory.create(location=Point(13.4050 + i / 1000, 52.5200), rating=4.0 + i / 10)
+
+    first = client.get('/api/v1/recommendations/?lat=52.5200&lng=13.4050&max_distance=5&limit=2').json()
+    assert (first['count'], first['page'], first['pages']) == (5, 1, 3)
+
+    # Later pages ignore restaurants added after the snapshot was taken
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), rating=5.0)
+    pages = [first]
+    for page in (2, 3):
+        with django_assert_max_num_queries(2):
+            response = client.get(f"/api/v1/recommendations/?snapshot={first['snapshot']}&page={page}&limit=2")
+        assert response.status_code == status.HTTP_200_OK
+        pages.append(response.json())
+
+    place_ids = [r['place_id'] for page in pages for r in page['recommendations']]
+    assert len(place_ids) == len(set(place_ids)) == 5
+    assert pages[2]['location'] == '52.5200, 13.4050'
+
+@pytest.mark.django_db
+def test_recommendation_snapshot_is_private(authenticated_guest_client):
+    client, _ = authenticated_guest_client
+    RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    service = RecommendationService(user=UserFactory.create(), lat=52.5200, lng=13.4050)
+    snapshot = RecommendationSnapshot.create(service, location='52.52, 13.405')
+
+    response = client.get(f"/api/v1/recommendations/?snapshot={snapshot.token}&page=1")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.django_db
+def test_restaurant_change_invalidates_tile_candidates(authenticated_guest_client, mocker):
+    client, user = authenticated_guest_client
+    restaurant = RestaurantFactory.create(location=Point(13.4050, 52.5200), rating=4.5)
+    far_away = RestaurantFactory.create(location=Point(2.3522, 48.8566), rating=4.5)
+    fetch = mocker.spy(CandidateService, 'fetch_candidates')
+    url = '/api/v1/recommendations/?lat=52.5200&lng=13.4050&max_distance=5'
+
+    client.get(url)
+    far_away.rating = 3.0
+    far_away.save()
+    client.get(url)
+    assert fetch.call_count == 1
+
+    # Only changes inside the regions the tile reaches bump its key
+    restaurant.rating = 2.0
+    restaurant.save()
+    response = client.get(url)
+    assert fetch.call_count == 2
+    assert response.json()['total_count'] == 0
+
+@pytest.mark.django_db
+def test_restaurant_move_bumps_versions_in_one_batch(mocker):
+    restaurant = RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    namespaces = point_tile_namespaces(52.5200, 13.4050) + point_tile_namespaces(48.8566, 2.3522)
+    before = get_versions(namespaces)
+    get_many = mocker.spy(cache, 'get_many')
+    set_many = mocker.spy(cache, 'set_many')
+    incr = mocker.spy(cache, 'incr')
+
+    restaurant.location = Point(2.3522, 48.8566)
+    restaurant.save()
+
+    assert get_many.call_count == set_many.call_count == 1
+    assert incr.call_count == 0
+    after = get_versions(namespaces)
+    assert all(after[namespace] > before[namespace] for namespace in namespaces)
+
+class TestStaleWhileRevalidate:
+    """Test that an expiring hot key is recomputed by one caller only."""
+
+    @staticmethod
+    def run_concurrently(target, count=20):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(target())) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_expired_entry_refreshed_once_and_served_stale(self):
+        calls = []
+
+        def slow_compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'fresh'
+
+        # Logically expired, still inside the grace period
+        cache.set('swr_test', ('stale', time.time() - 1, 0.2), 60)
+        results = self.run_concurrently(lambda: stale_while_revalidate('swr_test', slow_compute, ttl=60))
+
+        assert len(calls) == 1
+        assert set(results) == {'stale', 'fresh'}
+        assert results.count('fresh') == 1
+        assert stale_while_revalidate('swr_test', slow_compute, ttl=60) == 'fresh'
+
+    def test_cold_key_computed_once(self):
+        calls = []
+
+        def slow_compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = self.run_concurrently(lambda: stale_while_revalidate('swr_cold', slow_compute, ttl=60))
+
+        assert len(calls) == 1
+        assert results == ['value'] * 20
+
+    def test_failed_refresh_serves_stale(self):
+        def broken():
+            raise RuntimeError('database unavailable')
+
+        cache.set('swr_broken', ('stale', time.time() - 1, 0.0), 60)
+        assert stale_while_revalidate('swr_broken', broken, ttl=60) == 'stale'
+
+@pytest.mark.django_db
+def test_batch_recommendations_match_single_location(authenticated_guest_client, mocker):
+    client, user = authenticated_guest_client
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Thai'], rating=4.5)
+    RestaurantFactory.create(location=Point(13.4100, 52.5230), rating=3.9, price_level=3)
+    RestaurantFactory.create(location=Point(13.3000, 52.4500), rating=4.8)
+    locations = [
+        {'key': 'office', 'lat': 52.5200, 'lng': 13.4050, 'max_distance': 2},
+        {'key': 'home', 'lat': 52.4500, 'lng': 13.3000, 'max_distance': 2, 'limit': 5},
+        {'key': 'here', 'lat': 52.5200, 'lng': 13.4050, 'max_distance': 2, 'price_level': 3},
+    ]
+    fetch_many = mocker.spy(CandidateService, 'fetch_candidates_many')
+
+    response = client.post('/api/v1/recommendations/batch/', {'locations': locations}, format='json')
+
     assert response.status_code == status.HTTP_200_OK
-    assert response.json() == cached_data
-    
+    assert fetch_many.call_count == 1
+    results = response.json()['results']
+    for location in locations:
+        service = RecommendationService(
+            user=user, lat=location['lat'], lng=location['lng'],
+            max_distance_km=location['max_distance'], price_level=location.get('price_level'),
+        )
+        expected = [r.place_id for r in service.get_recommendations(limit=location.get('limit', 20))]
+        assert [r['place_id'] for r in results[location['key']]['recommendations']] == expected
+    assert results['office']['recommendations'][0]['distance_km'] == 0.0
+
+@pytest.mark.django_db
+def test_batch_recommendations_reject_duplicate_keys(authenticated_guest_client):
+    client, _ = authenticated_guest_client
+    location = {'key': 'home', 'lat': 52.5200, 'lng': 13.4050}
+    response = client.post('/api/v1/recommendations/batch/', {'locations': [location, location]}, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db
+def test_fast_serialization_matches_restaurant_serializer(guest_user):
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Thai'], rating=4.5)
+    RestaurantFactory.create(location=Point(13.4100, 52.5230), cuisine_types=[], website=None, phone_number=None)
+    RestaurantFactory.create(location=Point(13.4200, 52.5210), rating=None, price_level=None, cuisine_types=['Greek'])
+    service = RecommendationService(user=guest_user, lat=52.5200, lng=13.4050, max_distance_km=5)
+    service.get_user_top_cuisines = lambda limit=5: ['Greek']
+
+    expected = RestaurantSerializer(service.get_cached_recommendations(limit=10), many=True).data
+    fast = [represent_restaurant(row) for row in service.get_cached_recommendations(limit=10, values=True)]
+
+    assert len(fast) == 3
+    assert fast == [dict(row) for row in expected]
+
+@pytest.mark.django_db
+def test_cached_recommendations_match_single_query(guest_user, mocker):
+    mocker.patch(
+        'apps.restaurants.services.recommendation_service.RecommendationService.get_user_top_cuisines',
+        return_value=['Thai']
+    )
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Greek'], rating=4.0)
+    RestaurantFactory.create(location=Point(13.4500, 52.5200), cuisine_types=['Greek'], rating=4.8)
+    RestaurantFactory.create(location=Point(13.4100, 52.5230), cuisine_types=['Thai'], rating=3.0)
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Greek'], rating=3.0)
+    RestaurantFactory.create(location=Point(13.6000, 52.5200), cuisine_types=['Thai'], rating=5.0)
+
+    service = RecommendationService(user=guest_user, lat=52.5200, lng=13.4050, max_distance_km=5)
+
+    expected = [r.id for r in service.get_recommendations(limit=10)]
+    assert [r.id for r in service.get_cached_recommendations(limit=10)] == expected
+    assert all(hasattr(r, 'distance') for r in service.get_cached_recommendations(limit=10))
+
+@pytest.mark.django_db
+def test_spatial_index_candidates_match_postgis(guest_user, mocker):
+    mocker.patch(
+        'apps.restaurants.services.recommendation_service.RecommendationService.get_user_top_cuisines',
+        return_value=['Thai']
+    )
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Greek'], rating=4.0)
+    RestaurantFactory.create(location=Point(13.4500, 52.5200), cuisine_types=['Thai'], rating=3.0, price_level=None)
+    RestaurantFactory.create(location=Point(13.6000, 52.5200), cuisine_types=['Thai'], rating=5.0)
+    service = RecommendationService(user=guest_user, lat=52.5200, lng=13.4050, max_distance_km=5)
+    expected = [r.id for r in service.get_cached_recommendations(limit=10)]
+
+    index = RestaurantSpatialIndex()
+    index.load()
+    mocker.patch('apps.restaurants.services.recommendation_service.spatial_index', index)
+    fetch = mocker.spy(CandidateService, 'fetch_candidates')
+
+    assert [r.id for r in service.get_cached_recommendations(limit=10)] == expected
+    assert fetch.call_count == 0
+
+@pytest.mark.django_db
+def test_spatial_index_incremental_refresh():
+    restaurant = RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    index = RestaurantSpatialIndex()
+    index.load()
+
+    moved = RestaurantFactory.create(location=Point(13.4060, 52.5200))
+    restaurant.location = Point(14.0000, 52.5200)
+    restaurant.save()
+    index.refresh()
+
+    candidates = index.get_candidates(52.5200, 13.4050, 1)
+    assert list(candidates['id']) == [moved.id]
+
+    # Deleted restaurants are dropped, and rows committed with an updated_at
+    # just below the high-water mark are still picked up
+    late = RestaurantFactory.create(location=Point(13.4055, 52.5200), cuisine_types=['Ethiopian'])
+    Restaurant.objects.filter(id=late.id).update(updated_at=index._data['updated_until'] - timedelta(seconds=30))
+    moved.delete()
+    index.refresh()
+
+    candidates = index.get_candidates(52.5200, 13.4050, 1)
+    assert list(candidates['id']) == [late.id]
+    assert 'Ethiopian' in candidates['cuisine_bits']
+
+@pytest.mark.django_db
+def test_spatial_index_reloads_visitors_after_stats_refresh():
+    restaurant = RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    # Old enough to be outside the refresh overlap window
+    Restaurant.objects.filter(id=restaurant.id).update(updated_at=timezone.now() - timedelta(days=1))
+    index = RestaurantSpatialIndex()
+    index.load()
+    ReceiptFactory.create_batch(2, restaurant=restaurant)
+
+    # Unchanged restaurants keep their counts until the stats view is refreshed
+    index.refresh()
+    assert list(index.get_candidates(52.5200, 13.4050, 1)['visitors']) == [0]
+
+    refresh_restaurant_stats()
+    index.refresh()
+    assert list(index.get_candidates(52.5200, 13.4050, 1)['visitors']) == [2]
+
+@pytest.mark.django_db
+def test_typeahead_index_ranks_prefix_matches():
+    near = RestaurantFactory.create(name="Luigi's Pizzeria", location=Point(13.4050, 52.5200))
+    far = RestaurantFactory.create(name="Pizza Café", location=Point(13.6000, 52.5200))
+    RestaurantFactory.create(name="Pasta Bar", location=Point(13.4050, 52.5200))
+    index = RestaurantTypeaheadIndex()
+    index.load()
+
+    # Later words match too, accents and case are ignored
+    assert [r['id'] for r in index.search('PIZZ', lat=52.5200, lng=13.4050)] == [near.id, far.id]
+    assert [r['id'] for r in index.search('cafe')] == [far.id]
+    assert index.search('p') == []
+
+    far.name = "Burger Joint"
+    far.save()
+    index.refresh()
+    assert [r['id'] for r in index.search('pizz')] == [near.id]
+    assert [r['id'] for r in index.search('burg')] == [far.id]
+
+    # Rows committed with an updated_at just below the high-water mark are still indexed
+    late = RestaurantFactory.create(name="Burrito Bar")
+    Restaurant.objects.filter(id=late.id).update(updated_at=index._data['updated_until'] - timedelta(seconds=30))
+    index.refresh()
+    assert [r['id'] for r in index.search('burr')] == [late.id]
+
+@pytest.mark.django_db
+def test_typeahead_index_drops_deleted_and_reloads_visitors():
+    quiet, popular, closed = RestaurantFactory.create_batch(3, name="Noodle Bar")
+    # Old enough to be outside the refresh overlap window
+    Restaurant.objects.update(updated_at=timezone.now() - timedelta(days=1))
+    index = RestaurantTypeaheadIndex()
+    index.load()
+
+    ReceiptFactory.create_batch(2, restaurant=popular)
+    closed.delete()
+    refresh_restaurant_stats()
+    index.refresh()
+
+    assert [r['id'] for r in index.search('nood')] == [popular.id, quiet.id]
+
+@pytest.mark.django_db
+def test_typeahead_fallback_uses_prefix_index():
+    RestaurantFactory.create(name="Pizza Café")
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = Restaurant.objects.filter(name__istartswith='piz').explain()
+    assert 'restaurants_name_prefix' in plan
+
+@pytest.mark.django_db
+def test_typeahead_index_refreshes_in_background(mocker):
+    restaurant = RestaurantFactory.create(name="Pizza Café")
+    index = RestaurantTypeaheadIndex()
+    index.load()
+    index._refreshed_at = time.monotonic() - 3600
+    refreshed_by = []
+    refresh = mocker.patch.object(index, 'refresh', side_effect=lambda: refreshed_by.append(threading.current_thread()))
+
+    # A due refresh does not hold up the search that triggers it
+    assert [r['id'] for r in index.search('pizz')] == [restaurant.id]
+    assert index._lock.acquire(timeout=5)
+    refresh.assert_called_once()
+    assert refreshed_by != [threading.current_thread()]
+
+@pytest.mark.django_db
+def test_typeahead_endpoint(authenticated_guest_client, mocker):
+    client, _ = authenticated_guest_client
+    restaurant = RestaurantFactory.create(name="Sushi Place", location=Point(13.4050, 52.5200))
+    url = '/api/v1/restaurants/typeahead/?q=sus&lat=52.5200&lng=13.4050'
+
+    # The database answers until the index is loaded
+    response = client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+    assert [r['id'] for r in response.json()['results']] == [restaurant.id]
+
+    index = RestaurantTypeaheadIndex()
+    index.load()
+    mocker.patch('apps.restaurants.services.typeahead_index.typeahead_index', index)
+    response = client.get(url)
+    assert response.json()['results'] == [
+        {'id': restaurant.id, 'name': "Sushi Place", 'address': restaurant.address, 'distance_km': 0.0}
+    ]
+
+@pytest.mark.django_db
+def test_vector_tiles_cached_per_tile(authenticated_guest_client, mocker):
+    client, _ = authenticated_guest_client
+    restaurant = RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Thai'], rating=4.5)
+    far_away = RestaurantFactory.create(location=Point(2.3522, 48.8566), rating=4.5)
+    render = mocker.spy(VectorTileService, 'render')
+    url = '/api/v1/tiles/14/8802/5373.mvt'
+
+    response = client.get(url)
+    assert response.status_code == status.HTTP_200_OK
+    assert response['Content-Type'] == 'application/vnd.mapbox-vector-tile'
+    assert len(response.content) > 0
+    assert client.get(f'{url}?cuisine=Greek').content == b''
+
+    # Changes elsewhere keep the tile, the ETag saves the download
+    far_away.rating = 3.0
+    far_away.save()
+    cached = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert cached.status_code == status.HTTP_304_NOT_MODIFIED
+    assert render.call_count == 2
+
+    restaurant.name = "Renamed"
+    restaurant.save()
+    changed = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert changed.status_code == status.HTTP_200_OK
+    assert changed['ETag'] != response['ETag']
+    assert render.call_count == 3
+
+@pytest.mark.django_db
+def test_vector_tile_out_of_range(authenticated_guest_client):
+    client, _ = authenticated_guest_client
+    assert client.get('/api/v1/tiles/2/4/0.mvt').status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.django_db
+def test_cluster_index_groups_by_zoom_and_refreshes():
+    RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    RestaurantFactory.create(location=Point(13.4052, 52.5202))
+    moved = RestaurantFactory.create(location=Point(13.4100, 52.5200))
+    index = RestaurantClusterIndex()
+    index.load()
+    bbox = (52.50, 13.38, 52.54, 13.43)
+
+    (cluster,) = index.get_clusters(*bbox, zoom=10)
+    assert cluster['count'] == 3 and cluster['id'] is None
+    assert cluster['lat'] == pytest.approx(52.5201, abs=1e-4)
+    assert sorted(c['count'] for c in index.get_clusters(*bbox, zoom=16)) == [1, 2]
+
+    moved.location = Point(2.3522, 48.8566)
+    moved.save()
+    index.refresh()
+    assert index.get_clusters(*bbox, zoom=10) == [
+        {'lat': pytest.approx(52.5201, abs=1e-4), 'lng': pytest.approx(13.4051, abs=1e-4), 'count': 2, 'id': None}
+    ]
+    assert [c['id'] for c in index.get_clusters(48.85, 2.35, 48.86, 2.36, zoom=16)] == [moved.id]
+    with pytest.raises(ValueError):
+        index.get_clusters(-80, -170, 80, 170, zoom=12)
+
+@pytest.mark.django_db
+def test_cluster_index_refresh_swaps_cell_members():
+    leaving = RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    entering = RestaurantFactory.create(location=Point(2.3522, 48.8566))
+    deleted = RestaurantFactory.create(location=Point(2.3530, 48.8570))
+    index = RestaurantClusterIndex()
+    index.load()
+
+    # The Berlin cell keeps a count of one while its member changes
+    leaving.location = Point(2.3522, 48.8566)
+    leaving.save()
+    entering.location = Point(13.4060, 52.5210)
+    entering.save()
+    deleted.delete()
+    index.refresh()
+
+    assert index.get_clusters(52.50, 13.38, 52.54, 13.43, zoom=10) == [
+        {'lat': pytest.approx(52.5210, abs=1e-4), 'lng': pytest.approx(13.4060, abs=1e-4), 'count': 1, 'id': entering.id}
+    ]
+    assert [c['id'] for c in index.get_clusters(48.85, 2.35, 48.86, 2.36, zoom=16)] == [leaving.id]
+
+@pytest.mark.django_db
+def test_cluster_index_falls_back_to_postgis_until_loaded(mocker):
+    RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    RestaurantFactory.create(location=Point(13.4052, 52.5202))
+    index = RestaurantClusterIndex()
+    load = mocker.patch.object(index, 'load_in_background')
+    loaded = RestaurantClusterIndex()
+    loaded.load()
+    bbox = (52.50, 13.38, 52.54, 13.43)
+
+    for zoom in (10, 16):
+        expected = loaded.get_clusters(*bbox, zoom=zoom)
+        assert index.get_clusters(*bbox, zoom=zoom) == [
+            {**cluster, 'lat': pytest.approx(cluster['lat']), 'lng': pytest.approx(cluster['lng'])}
+            for cluster in expected
+        ]
+    load.assert_called()
+
+@pytest.mark.django_db
+def test_covisitation_model_boosts_neighbors(guest_user):
+    visited, neighbor, unrelated = RestaurantFactory.create_batch(3, location=Point(13.4050, 52.5200))
+    for user in UserFactory.create_batch(2):
+        ReceiptFactory.create(user=user, restaurant=visited)
+        ReceiptFactory.create(user=user, restaurant=neighbor)
+    ReceiptFactory.create(restaurant=unrelated)
+    ReceiptFactory.create(user=guest_user, restaurant=visited)
+
+    stored = CovisitationModelBuilder(users_per_chunk=1).build()
+
+    assert stored == 2
+    neighbors = RestaurantNeighbors.objects.get(restaurant=visited)
+    assert neighbors.neighbor_ids == [neighbor.id]
+    service = RecommendationService(user=guest_user, lat=52.5200, lng=13.4050, max_distance_km=5)
+    assert service.get_neighbor_boosts() == {neighbor.id: pytest.approx(2 / 6 ** 0.5)}
+    assert service.get_recommendations(limit=1)[0].id == neighbor.id
+    assert service.get_cached_recommendations(limit=1)[0].id == neighbor.id
+
+@pytest.mark.django_db
+def test_covisitation_skips_restaurants_created_during_build():
+    first, created_between, second, created_last = RestaurantFactory.create_batch(4)
+    for user in UserFactory.create_batch(2):
+        for restaurant in (first, created_between, second, created_last):
+            ReceiptFactory.create(user=user, restaurant=restaurant)
+
+    # Restaurant ids as loaded before the other two existed
+    restaurant_ids = np.array([first.id, second.id], dtype=np.int64)
+    covisits = CovisitationModelBuilder().covisits(restaurant_ids)
+
+    assert covisits.toarray().tolist() == [[2, 2], [2, 2]]
+
+@pytest.mark.django_db
+def test_cuisine_profile_follows_receipts(guest_user, django_assert_num_queries):
+    thai = RestaurantFactory.create(cuisine_types=['Thai'])
+    greek = RestaurantFactory.create(cuisine_types=['Greek', 'Mediterranean'])
+    ReceiptFactory.create(user=guest_user, restaurant=thai)
+    service = RecommendationService(user=guest_user, lat=52.5200, lng=13.4050)
+    assert service.get_user_top_cuisines() == ['Thai']
+
+    # New receipts are reflected right away, not after the cache TTL
+    receipt = ReceiptFactory.create(user=guest_user, restaurant=greek)
+    ReceiptFactory.create(user=guest_user, restaurant=greek)
+    with django_assert_num_queries(1):
+        assert service.get_user_top_cuisines() == ['Greek', 'Mediterranean', 'Thai']
+
+    receipt.restaurant = thai
+    receipt.save()
+    # Today's visits are decayed from midnight, as rebuild() counts them
+    profile = UserCuisineProfile.objects.get(pk=guest_user.id)
+    assert profile.weights['Thai'] == pytest.approx(2, rel=1e-2)
+    assert profile.weights['Greek'] == pytest.approx(1, rel=1e-2)
+
+    receipt.delete()
+    profile.refresh_from_db()
+    assert profile.weights['Thai'] == pytest.approx(1, rel=1e-2)
+
+@pytest.mark.django_db
+def test_cuisine_profile_weights_visits_by_date(guest_user):
+    thai = RestaurantFactory.create(cuisine_types=['Thai'])
+    greek = RestaurantFactory.create(cuisine_types=['Greek'])
+    today = timezone.localdate()
+    ReceiptFactory.create(user=guest_user, restaurant=thai, date=today)
+    old = ReceiptFactory.create(user=guest_user, restaurant=greek, date=today - timedelta(days=180))
+    backdated = ReceiptFactory.create(user=guest_user, restaurant=thai, date=today - timedelta(days=90))
+
+    def weights():
+        return UserCuisineProfile.objects.get(pk=guest_user.id).decayed_weights()
+
+    # Backdated receipts count with their decayed weight, not 1.0
+    assert weights()['Greek'] == pytest.approx(0.25, rel=1e-2)
+    assert weights()['Thai'] == pytest.approx(1.5, rel=1e-2)
+
+    # Relinking, moving and deleting old receipts remove exactly what they added
+    old.restaurant = thai
+    old.save()
+    backdated.date = today
+    backdated.save()
+    old.delete()
+    incremental = weights()
+    assert set(incremental) == {'Thai'}
+    assert incremental == pytest.approx(UserCuisineProfile.rebuild(guest_user.id).decayed_weights(), rel=1e-6)
+
+@pytest.mark.django_db
+def test_prewarm_fills_caches_of_active_users(mocker, django_assert_num_queries):
+    office = RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Thai'])
+    home = RestaurantFactory.create(location=Point(13.3000, 52.4500))
+    regular, colleague = UserFactory.create_batch(2)
+    ReceiptFactory.create_batch(3, user=regular, restaurant=office)
+    ReceiptFactory.create(user=regular, restaurant=home)
+    ReceiptFactory.create(user=colleague, restaurant=office)
+    cache.clear()
+
+    prewarmer = RecommendationPrewarmer(batch_size=1)
+    locations = prewarmer.active_locations()
+    assert [user_id for user_id, _, _ in locations] == [regular.id, colleague.id]
+    assert CandidateService().get_tile(*locations[0][1:]) == CandidateService().get_tile(52.5200, 13.4050)
+
+    fetch = mocker.spy(CandidateService, 'fetch_candidates')
+    assert sum(prewarmer.warm(batch) for batch in prewarmer.batches(locations)) == 2
+    # Both users work in the same tile, its candidates are loaded once
+    assert fetch.call_count == 1
+
+    service = RecommendationService(user=regular, lat=locations[0][1], lng=locations[0][2])
+    with django_assert_num_queries(0):
+        assert service.get_user_top_cuisines() == ['Thai']
+        service.get_candidates()
+
+@pytest.mark.django_db
+def test_prewarm_task_staggers_batches(mocker, settings):
+    settings.RECOMMENDATION_PREWARM_BATCH_SIZE = 1
+    settings.RECOMMENDATION_PREWARM_BATCH_INTERVAL = 30
+    ReceiptFactory.create_batch(3, restaurant=RestaurantFactory.create())
+    apply_async = mocker.patch('apps.restaurants.tasks.warm_recommendation_batch.apply_async')
+
+    assert prewarm_recommendations() == 3
+    assert [call.kwargs['countdown'] for call in apply_async.call_args_list] == [0, 30, 60]
+
+def test_hours_bitmap_from_both_hours_formats():
+    weekly = hours_bitmap({'monday': {'open': '09:00', 'close': '22:00'}, 'saturday': {'open': '18:00', 'close': '02:00'}})
+    google = hours_bitmap({'periods': [{'open': {'day': 1, 'time': '0900'}, 'close': {'day': 1, 'time': '2200'}}]})
+    matrix = hours_matrix([weekly, google, None])
+
+    def is_open(*moment):
+        return open_mask(matrix, week_slot(datetime(*moment))).tolist()
+
+    # 2026-10-19 is a Monday, unknown hours always count as open
+    assert len(weekly) == 84
+    assert is_open(2026, 10, 19, 8, 59) == [False, False, True]
+    assert is_open(2026, 10, 19, 9, 0) == [True, True, True]
+    assert is_open(2026, 10, 19, 21, 59) == [True, True, True]
+    assert is_open(2026, 10, 19, 22, 0) == [False, False, True]
+    # Saturday night past midnight
+    assert is_open(2026, 10, 25, 1, 45) == [True, False, True]
+    assert hours_bitmap({'monday': 'closed'}) is None
+
+@pytest.mark.django_db
+def test_recommendations_filter_open_at(guest_user):
+    lunch = {day: {'open': '11:00', 'close': '15:00'} for day in ('monday', 'tuesday')}
+    lunch_place = RestaurantFactory.create(location=Point(13.4050, 52.5200), hours=lunch)
+    dinner_place = RestaurantFactory.create(location=Point(13.4051, 52.5200), hours={'monday': {'open': '18:00', 'close': '23:00'}})
+    unknown = RestaurantFactory.create(location=Point(13.4052, 52.5200), hours=None)
+    assert dinner_place.hours_bitmap is not None
+
+    service = RecommendationService(
+        user=guest_user, lat=52.5200, lng=13.4050, max_distance_km=5, open_at=datetime(2026, 10, 19, 12, 30)
+    )
+    expected = {lunch_place.id, unknown.id}
+    assert {r.id for r in service.get_recommendations()} == expected
+    assert {r.id for r in service.get_cached_recommendations()} == expected
+
+@pytest.mark.django_db
+def test_cuisine_ids_follow_cuisine_types():
+    restaurant = RestaurantFactory.create(cuisine_types=['Thai', 'Asian'])
+    assert restaurant.cuisine_ids == CuisineType.ids_for(['Asian', 'Thai'], create=False)
+
+    restaurant.cuisine_types = ['Greek']
+    restaurant.save(update_fields=['cuisine_types'])
+    restaurant.refresh_from_db()
+    assert restaurant.cuisine_ids == [CuisineType.objects.get(name='Greek').id]
+    assert list(Restaurant.objects.filter(cuisine_overlap(['Greek', 'Unknown']))) == [restaurant]
+    assert not Restaurant.objects.filter(cuisine_overlap(['Thai'])).exists()
+
+@pytest.mark.django_db
+def test_cuisine_ids_only_resolved_when_cuisines_change(django_assert_num_queries):
+    restaurant = Restaurant.objects.get(id=RestaurantFactory.create(cuisine_types=['Thai']).id)
+
+    # Only the UPDATE, no CuisineType lookup
+    restaurant.rating = 4.5
+    with django_assert_num_queries(1):
+        restaurant.save(update_fields=['rating'])
+    with django_assert_num_queries(1):
+        restaurant.save()
+
+    restaurant.cuisine_types.append('Vegan')
+    restaurant.save()
+    assert restaurant.cuisine_ids == CuisineType.ids_for(['Thai', 'Vegan'], create=False)
+
+@pytest.mark.django_db
+def test_cuisine_overlap_uses_gin_index():
+    RestaurantFactory.create_batch(3, cuisine_types=['Thai'])
+    with connection.cursor() as cursor:
+        # Tiny test tables would always be scanned sequentially otherwise
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = Restaurant.objects.filter(cuisine_overlap(['Thai'])).explain()
+    assert 'restaurants_cuisine_ids_gin' in plan
+
+@pytest.mark.django_db
+def test_restaurant_stats_rank_popular_places_higher(guest_user):
+    quiet = RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    popular = RestaurantFactory.create(location=Point(13.4050, 52.5200))
+    visitors = UserFactory.create_batch(3)
+    for user, price in zip(visitors, ['10.00', '20.00', '60.00']):
+        ReceiptFactory.create(user=user, restaurant=popular, price=Decimal(price))
+    ReceiptFactory.create(user=visitors[0], restaurant=popular, price=Decimal('30.00'))
+
+    RestaurantStats.refresh(concurrently=False)
+    RestaurantStats.refresh()
+
+    stats = RestaurantStats.objects.get(restaurant=popular)
+    assert (stats.visit_count, stats.unique_visitors) == (4, 3)
+    assert stats.avg_spend == Decimal('30.00')
+    assert stats.median_spend == Decimal('25.00')
+    assert not RestaurantStats.objects.filter(restaurant=quiet).exists()
+
+    service = RecommendationService(user=guest_user, lat=52.5200, lng=13.4050, max_distance_km=5)
+    assert [r.id for r in service.get_recommendations()] == [popular.id, quiet.id]
+    assert [r.id for r in service.get_cached_recommendations()] == [popular.id, quiet.id]
+
+@pytest.mark.django_db
+def test_group_recommendations_merge_profiles(authenticated_admin_client, django_assert_max_num_queries):
+    client, _ = authenticated_admin_client
+    thai = RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Thai'], rating=3.0)
+    greek = RestaurantFactory.create(location=Point(13.4060, 52.5200), cuisine_types=['Greek'], rating=3.0)
+    RestaurantFactory.create(location=Point(13.4050, 52.5200), cuisine_types=['Mexican'], rating=3.0)
+    alice, bob = UserFactory.create_batch(2)
+    ReceiptFactory.create_batch(3, user=alice, restaurant=thai)
+    ReceiptFactory.create(user=bob, restaurant=thai)
+    ReceiptFactory.create(user=bob, restaurant=greek)
+
+    payload = {'user_ids': [alice.id, bob.id], 'lat': 52.5200, 'lng': 13.4050, 'max_distance': 5}
+    # Authentication, user check, all profiles, the ranked query
+    with django_assert_max_num_queries(4):
+        response = client.post('/api/v1/recommendations/group/', payload, format='json')
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()['user_preferences'] == ['Thai', 'Greek']
+    assert [r['place_id'] for r in response.json()['recommendations']] == [thai.place_id, greek.place_id]
+
+@pytest.mark.django_db
+def test_group_recommendations_require_manager(authenticated_guest_client):
+    client, user = authenticated_guest_client
+    payload = {'user_ids': [user.id], 'lat': 52.5200, 'lng': 13.4050}
+    response = client.post('/api/v1/recommendations/group/', payload, format='json')
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+def test_vectorized_scoring_filters_and_orders_candidates():
+    candidates = build_candidates(
+        ids=[1, 2, 3, 4, 5],
+        lngs=[13.4050, 13.4300, 13.4050, 13.4050, 13.6000],
+        lats=[52.5200, 52.5200, 52.5200, 52.5200, 52.5200],
+        ratings=[4.0, 4.0, None, 3.0, 5.0],
+        price_levels=[2, 2, None, 2, 2],
+        cuisine_lists=[['Greek'], ['Greek'], ['Thai'], ['Greek'], ['Thai']],
+    )
+    ranking = RankingService(max_distance_km=5, cuisines=['Thai'])
+
+    scores, distance_km = ranking.score_candidates(candidates, 52.5200, 13.4050, 5)
+    top = ranking.top_k(scores, distance_km, limit=10)
+
+    # 4 is below the rating floor without a cuisine match, 5 is out of range
+    assert candidates['id'][top].tolist() == [3, 1, 2]
+    assert ranking.top_k(scores, distance_km, limit=1).tolist() == [2]
+
 @pytest.mark.django_db
 def test_recommendation_serializer():
     restaurant = RestaurantFactory.create(
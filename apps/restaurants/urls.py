@@ -1,7 +1,17 @@
 from django.urls import path
-from .views import RecommendationView
+from .views import GroupRecommendationView, RecommendationBatchView, RecommendationView, RestaurantClusterView, RestaurantTileView, RestaurantTypeaheadView
 
 urlpatterns = [
-    #GET /api/recommendations?lat=52.5200&lng=13.4050&max_distance=5&price_level=2&limit=4
+    #GET /api/recommendations?lat=52.5200&lng=13.4050&max_distance=5&price_level=2&limit=4&open_at=now
     path('recommendations/', RecommendationView.as_view(), name='restaurant-recommendations'),
+    #POST /api/recommendations/batch/ {"locations": [{"key": "home", "lat": 52.52, "lng": 13.405}, ...]}
+    path('recommendations/batch/', RecommendationBatchView.as_view(), name='restaurant-recommendations-batch'),
+    #POST /api/recommendations/group/ {"user_ids": [1, 2, 3], "lat": 52.52, "lng": 13.405}
+    path('recommendations/group/', GroupRecommendationView.as_view(), name='restaurant-recommendations-group'),
+    #GET /api/restaurants/typeahead/?q=pizz&lat=52.5200&lng=13.4050&limit=8
+    path('restaurants/typeahead/', RestaurantTypeaheadView.as_view(), name='restaurant-typeahead'),
+    #GET /api/tiles/14/8802/5373.mvt?cuisine=Thai,Greek&price_level=2&min_rating=4
+    path('tiles/<int:z>/<int:x>/<int:y>.mvt', RestaurantTileView.as_view(), name='restaurant-tiles'),
+    #GET /api/restaurants/clusters/?bbox=13.0,52.3,13.8,52.7&zoom=10
+    path('restaurants/clusters/', RestaurantClusterView.as_view(), name='restaurant-clusters'),
 ]
\ No newline at end of file
@@ -1,12 +1,42 @@
-from rest_framework.generics import ListAPIView
+from rest_framework.generics import GenericAPIView, ListAPIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework import status
-from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from drf_spectacular.utils import extend_schema, OpenApiParameter
-from apps.restaurants.serializers import RecommendationSerializer
-from apps.restaurants.services.recommendation_service import RecommendationService
+from apps.restaurants.serializers import (
+    BatchRecommendationRequestSerializer,
+    GroupRecommendationRequestSerializer,
+    RecommendationSerializer,
+    represent_restaurant,
+)
+from apps.restaurants.services.cluster_index import cluster_index
+from apps.restaurants.services.recommendation_service import (
+    BatchRecommendationService,
+    GroupRecommendationService,
+    RecommendationService,
+)
+from apps.restaurants.services.snapshot_service import RecommendationSnapshot
+from apps.restaurants.services.tile_service import MAX_ZOOM, VectorTileService
+from apps.restaurants.services.typeahead_index import search_restaurants
 from common.pagination import DefaultPagination
+from common.permissions import IsAdminOrManager
+from common.renderers import MVTRenderer
+
+def parse_open_at(value):
+    """``open_at`` query parameter: 'now' or an ISO 8601 datetime"""
+    if not value:
+        return None
+    if value == 'now':
+        return timezone.now()
+    open_at = parse_datetime(value)
+    if open_at is None:
+        raise ValueError(f"open_at must be 'now' or an ISO 8601 datetime, got {value!r}")
+    return open_at
+
 
 class RecommendationView(ListAPIView):
     permission_classes = [IsAuthenticated]
@@ -14,38 +44,54 @@ class RecommendationView(ListAPIView):
     serializer_class = RecommendationSerializer
 
     def list(self, request, *args, **kwargs):
-        # Get required parameters
-        lat = request.query_params.get('lat')
-        lng = request.query_params.get('lng')
-        
-        if not lat or not lng:
-            return Response({
-                "error": "lat and lng parameters are required"
-            }, status=status.HTTP_400_BAD_REQUEST)
-
-        # Get optional parameters
-        max_distance = request.query_params.get('max_distance', 10)
-        price_level = request.query_params.get('price_level')
-        limit = min(int(request.query_params.get('limit', 20)), 50)
+        token = request.query_params.get('snapshot')
 
         try:
-            # Check cache first
-            cache_key = f"rec_{request.user.id}_{lat}_{lng}_{max_distance}_{price_level}_{limit}"
-            cached_result = cache.get(cache_key)
-            
-            if cached_result:
-                return Response(cached_result)
-
-            # Get recommendations
-            service = RecommendationService(
-                user=request.user,
-                lat=float(lat),
-                lng=float(lng),
-                max_distance_km=float(max_distance),
-                price_level=int(price_level) if price_level else None
-            )
-            
-            restaurants = service.get_recommendations(limit)
+            # Page size, a page of the snapshot taken on the first request
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 50)
+            page = max(int(request.query_params.get('page', 1)), 1)
+
+            if token:
+                # Further pages are served from the ranking frozen under the token
+                snapshot = RecommendationSnapshot.load(token, request.user)
+                if snapshot is None:
+                    return Response({
+                        "error": "Recommendation snapshot expired or not found"
+                    }, status=status.HTTP_404_NOT_FOUND)
+                service = RecommendationService(
+                    user=request.user,
+                    lat=snapshot.data['lat'],
+                    lng=snapshot.data['lng'],
+                    max_distance_km=snapshot.data['max_distance_km'],
+                    price_level=snapshot.data['price_level'],
+                )
+            else:
+                # Get required parameters
+                lat = request.query_params.get('lat')
+                lng = request.query_params.get('lng')
+
+                if not lat or not lng:
+                    return Response({
+                        "error": "lat and lng parameters are required"
+                    }, status=status.HTTP_400_BAD_REQUEST)
+
+                # Get optional parameters
+                max_distance = request.query_params.get('max_distance', 10)
+                price_level = request.query_params.get('price_level')
+
+                # Candidates are cached per geo tile and shared across users,
+                # personalization is applied in memory on top
+                service = RecommendationService(
+                    user=request.user,
+                    lat=float(lat),
+                    lng=float(lng),
+                    max_distance_km=float(max_distance),
+                    price_level=int(price_level) if price_level else None,
+                    open_at=parse_open_at(request.query_params.get('open_at')),
+                )
+                snapshot = RecommendationSnapshot.create(service, location=f"{lat}, {lng}")
+
+            restaurants = service.fetch_ranked_values(snapshot.page_ids(page, limit))
             
             if not restaurants:
                 return Response({
@@ -53,26 +99,19 @@ class RecommendationView(ListAPIView):
                     "recommendations": []
                 }, status=status.HTTP_200_OK)
 
-            # Prepare response data
-            user_cuisines = service.get_user_top_cuisines()
-            
-            result = {
-                "recommendations": restaurants,
+            # Same shape as RecommendationSerializer, rows are built directly
+            return Response({
+                "recommendations": [represent_restaurant(row) for row in restaurants],
                 "total_count": len(restaurants),
-                "location": f"{lat}, {lng}",
-                "max_distance_km": float(max_distance),
-                "price_level_filter": int(price_level) if price_level else None,
-                "user_preferences": user_cuisines
-            }
-            
-            # Serialize the complete response
-            serializer = self.get_serializer(result)
-            response_data = serializer.data
-            
-            # Cache for 5 minutes
-            cache.set(cache_key, response_data, 300)
-            
-            return Response(response_data)
+                "location": snapshot.data['location'],
+                "max_distance_km": service.max_distance_km,
+                "price_level_filter": service.price_level,
+                "user_preferences": snapshot.data['user_preferences'],
+                "count": snapshot.count,
+                "page": page,
+                "pages": snapshot.pages(limit),
+                "snapshot": snapshot.token,
+            })
 
         except ValueError as e:
             return Response({
@@ -83,3 +122,175 @@ class RecommendationView(ListAPIView):
             return Response({
                 "error": "Something went wrong"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+
+class RecommendationBatchView(GenericAPIView):
+    """Recommendations for several locations (home, office, ...) in one call"""
+    permission_classes = [IsAuthenticated]
+    serializer_class = BatchRecommendationRequestSerializer
+
+    @extend_schema(request=BatchRecommendationRequestSerializer, responses={200: RecommendationSerializer(many=True)})
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        locations = serializer.validated_data['locations']
+
+        service = BatchRecommendationService(
+            user=request.user,
+            locations=[
+                {
+                    'lat': location['lat'],
+                    'lng': location['lng'],
+                    'max_distance_km': location['max_distance'],
+                    'price_level': location.get('price_level'),
+                    'open_at': location.get('open_at'),
+                    'limit': location['limit'],
+                }
+                for location in locations
+            ],
+        )
+        user_cuisines = service.get_user_top_cuisines()
+
+        results = {}
+        for location, restaurants in zip(locations, service.get_recommendations()):
+            results[location['key']] = {
+                "recommendations": [represent_restaurant(row) for row in restaurants],
+                "total_count": len(restaurants),
+                "location": f"{location['lat']}, {location['lng']}",
+                "max_distance_km": location['max_distance'],
+                "price_level_filter": location.get('price_level'),
+                "user_preferences": user_cuisines,
+            }
+
+        return Response({
+            "results": results,
+            "user_preferences": user_cuisines,
+        })
+
+
+
+class GroupRecommendationView(GenericAPIView):
+    """Places that suit a whole team, for admins and managers"""
+    permission_classes = [IsAdminOrManager]
+    serializer_class = GroupRecommendationRequestSerializer
+
+    @extend_schema(request=GroupRecommendationRequestSerializer, responses={200: RecommendationSerializer})
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        service = GroupRecommendationService(
+            user_ids=data['user_ids'],
+            lat=data['lat'],
+            lng=data['lng'],
+            max_distance_km=data['max_distance'],
+            price_level=data.get('price_level'),
+        )
+        restaurants = service.get_recommendations(data['limit'])
+        user_cuisines = service.get_user_top_cuisines()
+
+        result = RecommendationSerializer({
+            "recommendations": restaurants,
+            "total_count": len(restaurants),
+            "location": f"{data['lat']}, {data['lng']}",
+            "max_distance_km": data['max_distance'],
+            "price_level_filter": data.get('price_level'),
+            "user_preferences": user_cuisines,
+        }).data
+        return Response({**result, "user_ids": data['user_ids']})
+
+
+
+class RestaurantTypeaheadView(GenericAPIView):
+    """Restaurant name autocompletion, e.g. while entering a receipt"""
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(parameters=[
+        OpenApiParameter('q', str, required=True),
+        OpenApiParameter('lat', float),
+        OpenApiParameter('lng', float),
+        OpenApiParameter('limit', int),
+    ])
+    def get(self, request, *args, **kwargs):
+        try:
+            lat = request.query_params.get('lat')
+            lng = request.query_params.get('lng')
+            limit = min(int(request.query_params.get('limit', 8)), 20)
+            results = search_restaurants(
+                request.query_params.get('q', ''),
+                lat=float(lat) if lat and lng else None,
+                lng=float(lng) if lat and lng else None,
+                limit=limit,
+            )
+        except ValueError as e:
+            return Response({
+                "error": f"Invalid parameters: {str(e)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"results": results})
+
+
+
+class RestaurantTileView(GenericAPIView):
+    """Restaurants as a Mapbox vector tile, for the map view"""
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, MVTRenderer]
+
+    @extend_schema(parameters=[
+        OpenApiParameter('cuisine', str, description='Comma separated cuisines, any of them matches'),
+        OpenApiParameter('price_level', int),
+        OpenApiParameter('min_rating', float),
+    ])
+    def get(self, request, z, x, y, *args, **kwargs):
+        if z > MAX_ZOOM or x >= 1 << z or y >= 1 << z:
+            return Response({"error": "Tile out of range"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            cuisine = request.query_params.get('cuisine')
+            price_level = request.query_params.get('price_level')
+            min_rating = request.query_params.get('min_rating')
+            content, digest = VectorTileService().get_tile(
+                z, x, y,
+                cuisines=[name.strip() for name in cuisine.split(',') if name.strip()] if cuisine else (),
+                price_level=int(price_level) if price_level else None,
+                min_rating=float(min_rating) if min_rating else None,
+            )
+        except ValueError as e:
+            return Response({
+                "error": f"Invalid parameters: {str(e)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Tiles are content addressed, the hash is a strong ETag
+        etag = f'"{digest}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(content, content_type=MVTRenderer.media_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+
+class RestaurantClusterView(GenericAPIView):
+    """Restaurant clusters in a map viewport, for zoomed-out views"""
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(parameters=[
+        OpenApiParameter('bbox', str, required=True, description='min_lng,min_lat,max_lng,max_lat'),
+        OpenApiParameter('zoom', int, required=True),
+    ])
+    def get(self, request, *args, **kwargs):
+        try:
+            bbox = request.query_params.get('bbox', '')
+            min_lng, min_lat, max_lng, max_lat = (float(value) for value in bbox.split(','))
+            zoom = int(request.query_params.get('zoom', ''))
+            clusters = cluster_index.get_clusters(min_lat, min_lng, max_lat, max_lng, zoom)
+        except ValueError as e:
+            return Response({
+                "error": f"Invalid parameters: {str(e)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"zoom": zoom, "clusters": clusters})
@@ -0,0 +1,176 @@
+import logging
+import math
+import random
+import time
+import uuid
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def single_flight(key, compute, ttl=300, lock_timeout=30, wait_timeout=10, poll_interval=0.1):
+    """
+    Compute the value for ``key`` at most once across all workers.
+
+    The first caller takes a lock with ``cache.add`` (atomic on Redis),
+    runs ``compute`` and hands the result off under ``key`` for ``ttl``
+    seconds. Concurrent callers wait up to ``wait_timeout`` seconds and
+    reuse that result instead of repeating the work. If the lock holder
+    dies or the wait times out, the caller falls back to computing itself.
+    """
+    result = cache.get(key, _MISSING)
+    if result is not _MISSING:
+        return result
+
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, lock_timeout):
+        try:
+            result = compute()
+            cache.set(key, result, ttl)
+            return result
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    deadline = time.monotonic() + wait_timeout
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        result = cache.get(key, _MISSING)
+        if result is not _MISSING:
+            return result
+        if cache.get(lock_key) is None:
+            # Holder released the lock without storing a result (it failed)
+            break
+
+    logger.warning(f"single_flight: no result handed off for {key}, computing locally")
+    return compute()
+
+
+def _timed_entry(compute, ttl):
+    start = time.monotonic()
+    value = compute()
+    return value, time.time() + ttl, time.monotonic() - start
+
+
+def store_refreshable(key, value, ttl=300, grace=60, delta=0.0):
+    """Store ``value`` in the entry format read by ``stale_while_revalidate``"""
+    cache.set(key, (value, time.time() + ttl, delta), ttl + grace)
+
+
+def get_fresh_many(keys):
+    """Values of the ``stale_while_revalidate`` entries among ``keys`` that are not yet due"""
+    now = time.time()
+    return {
+        key: value
+        for key, (value, expires_at, _) in cache.get_many(keys).items()
+        if expires_at > now
+    }
+
+
+def stale_while_revalidate(key, compute, ttl=300, grace=60, beta=1.0, lock_timeout=30):
+    """
+    Cache ``compute()`` under ``key`` without stampedes on expiry.
+
+    Entries are kept ``grace`` seconds past their logical ``ttl``. Once an
+    entry is due, the first caller to take the ``{key}:lock`` lock
+    recomputes it while everyone else keeps being served the stale value.
+    Refresh also starts early with a probability that grows towards expiry
+    and with the time ``compute`` took (XFetch, scaled by ``beta``), so a
+    hot key is usually refreshed before it expires at all. A cold key
+    falls back to ``single_flight``.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        return single_flight(
+            key, lambda: _timed_entry(compute, ttl), ttl=ttl + grace, lock_timeout=lock_timeout
+        )[0]
+
+    value, expires_at, delta = entry
+    if time.time() - delta * beta * math.log(1.0 - random.random()) < expires_at:
+        return value
+
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    if not cache.add(lock_key, token, lock_timeout):
+        # Someone else is refreshing it
+        return value
+    try:
+        value, _, delta = _timed_entry(compute, ttl)
+        store_refreshable(key, value, ttl, grace, delta)
+        return value
+    except Exception as e:
+        logger.warning(f"stale_while_revalidate: refresh of {key} failed, serving stale value: {e}")
+        return value
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def _version_key(namespace):
+    return f"cache_version:{namespace}"
+
+
+def _new_version():
+    # Time based, so a counter lost to eviction never restarts at a version
+    # whose keys may still be cached
+    return time.time_ns() // 1000
+
+
+def get_versions(namespaces):
+    """Current version of each namespace, fetched in one round trip"""
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(list(keys))
+    versions = {}
+    for key, namespace in keys.items():
+        version = found.get(key)
+        if version is None:
+            version = _new_version()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        versions[namespace] = version
+    return versions
+
+
+def bump_version(namespace):
+    """
+    Invalidate every key built with ``versioned_key`` under ``namespace``.
+
+    This is O(1): old entries are never scanned or deleted, they just stop
+    being read and expire on their own TTL.
+    """
+    key = _version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _new_version()
+        cache.set(key, version, None)
+        return version
+
+
+def bump_versions(namespaces):
+    """
+    ``bump_version`` for many namespaces in two round trips.
+
+    Versions are read with ``get_many`` and written back with ``set_many``
+    instead of one ``incr`` each. New versions are time based and always
+    above the current ones, so a bump racing another one still moves every
+    namespace to a version no cached key was built with.
+    """
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    if not keys:
+        return {}
+    found = cache.get_many(list(keys))
+    now = _new_version()
+    versions = {key: max(now, found.get(key, 0) + 1) for key in keys}
+    cache.set_many(versions, None)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def versioned_key(key, *namespaces):
+    """``key`` suffixed with the current versions of ``namespaces``"""
+    versions = get_versions(namespaces)
+    return ':'.join([key, *(str(versions[namespace]) for namespace in namespaces)])
@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+_GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_GEOHASH_INDEX = {char: index for index, char in enumerate(_GEOHASH_BASE32)}
+
+
+def geohash_encode(lat, lng, precision=6):
+    """Encode a coordinate as a geohash of ``precision`` characters"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        coord, bounds = (lng, lng_range) if even else (lat, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            bounds[0] = mid
+        else:
+            bounds[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def geohash_bbox(geohash):
+    """Return (min_lat, min_lng, max_lat, max_lng) of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _GEOHASH_INDEX[char]
+        for shift in range(4, -1, -1):
+            bounds = lng_range if even else lat_range
+            mid = (bounds[0] + bounds[1]) / 2
+            if value >> shift & 1:
+                bounds[0] = mid
+            else:
+                bounds[1] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def geohash_center(geohash):
+    """Return the (lat, lng) center of a geohash cell"""
+    min_lat, min_lng, max_lat, max_lng = geohash_bbox(geohash)
+    return (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two coordinates in kilometers"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine_km_array(lat, lng, lats, lngs):
+    """Vectorized haversine distance from one coordinate to arrays of coordinates"""
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def geohash_cells(min_lat, min_lng, max_lat, max_lng, precision):
+    """Geohashes of every ``precision`` cell intersecting a bounding box"""
+    lng_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    cell_height = 180.0 / (1 << lat_bits)
+    cell_width = 360.0 / (1 << lng_bits)
+
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0 - 1e-9)
+    min_lng, max_lng = max(min_lng, -180.0), min(max_lng, 180.0 - 1e-9)
+    rows = range(math.floor((min_lat + 90.0) / cell_height), math.floor((max_lat + 90.0) / cell_height) + 1)
+    columns = range(math.floor((min_lng + 180.0) / cell_width), math.floor((max_lng + 180.0) / cell_width) + 1)
+    return sorted({
+        geohash_encode(-90.0 + (row + 0.5) * cell_height, -180.0 + (column + 0.5) * cell_width, precision)
+        for row in rows
+        for column in columns
+    })
+
+
+# Web Mercator stops at this latitude, tiles are square beyond it
+MERCATOR_MAX_LAT = 85.05112878
+
+
+def tiles_for_point(lat, lng, zoom, margin=0.0):
+    """
+    (x, y) of the XYZ tiles at ``zoom`` containing a coordinate.
+
+    With ``margin`` (a fraction of the tile size) neighboring tiles whose
+    buffered area reaches the coordinate are included too.
+    """
+    count = 1 << zoom
+    lat = max(min(lat, MERCATOR_MAX_LAT), -MERCATOR_MAX_LAT)
+    x = (lng + 180.0) / 360.0 * count
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * count
+
+    def around(value):
+        return sorted({min(max(math.floor(value + offset), 0), count - 1) for offset in (-margin, 0.0, margin)})
+
+    return [(column, row) for column in around(x) for row in around(y)]
+
+
+def mercator_xy(lats, lngs):
+    """Web Mercator coordinates of arrays of coordinates, normalized to [0, 1)"""
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -MERCATOR_MAX_LAT, MERCATOR_MAX_LAT)
+    x = (np.asarray(lngs, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lats))) / math.pi) / 2.0
+    return x, y
+
+
+def mercator_latlng(xs, ys):
+    """Inverse of ``mercator_xy``, returning (lats, lngs)"""
+    lngs = np.asarray(xs, dtype=np.float64) * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(math.pi * (1.0 - 2.0 * np.asarray(ys, dtype=np.float64)))))
+    return lats, lngs
@@ -0,0 +1,19 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class MVTRenderer(BaseRenderer):
+    """
+    Mapbox vector tiles, so clients can ask for them in ``Accept``.
+
+    Views return tile bytes in a plain HttpResponse; anything else (error
+    details) has no vector tile form and renders as an empty body.
+    """
+    media_type = 'application/vnd.mapbox-vector-tile'
+    format = 'mvt'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, (bytes, bytearray)):
+            return bytes(data)
+        return b''
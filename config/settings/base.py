@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from datetime import timedelta
+from celery.schedules import crontab
 from pathlib import Path
 import environ
 import os
@@ -190,10 +191,98 @@ SPECTACULAR_SETTINGS = {
 
 SWAGGER_USE_COMPAT_RENDERERS = False
 
+# Cache - point CACHE_URL at Redis so locks and cached values are shared
+# between the web and celery workers; falls back to local memory.
+CACHE_URL = env("CACHE_URL", default="")
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Recommendations
+# Load restaurants into an in-process spatial index on each worker
+RESTAURANT_SPATIAL_INDEX_ENABLED = env.bool("RESTAURANT_SPATIAL_INDEX_ENABLED", default=False)
+RESTAURANT_SPATIAL_INDEX_REFRESH_SECONDS = 60
+# In-process indexes re-read rows updated this long before their high-water
+# mark, catching rows from transactions that committed late
+RESTAURANT_INDEX_REFRESH_OVERLAP_SECONDS = 300
+# Restaurant name prefix index for typeahead, also one per worker
+RESTAURANT_TYPEAHEAD_INDEX_ENABLED = env.bool("RESTAURANT_TYPEAHEAD_INDEX_ENABLED", default=False)
+RESTAURANT_TYPEAHEAD_REFRESH_SECONDS = 60
+# Map vector tiles: cache lifetime, and the deepest zoom with its own
+# invalidation version (deeper tiles share their ancestor's)
+RESTAURANT_TILE_CACHE_TTL = 24 * 3600
+RESTAURANT_TILE_INVALIDATION_ZOOM = 16
+# Per-zoom grid clusters for map views, loaded at startup or on first use
+RESTAURANT_CLUSTER_INDEX_ENABLED = env.bool("RESTAURANT_CLUSTER_INDEX_ENABLED", default=False)
+RESTAURANT_CLUSTER_REFRESH_SECONDS = 60
+
+# Receipt processing events (Server-Sent Events over Redis pub/sub),
+# disabled when no Redis URL is set
+RECEIPT_EVENTS_REDIS_URL = env("RECEIPT_EVENTS_REDIS_URL", default=CACHE_URL)
+RECEIPT_EVENTS_KEEPALIVE_SECONDS = 15
+RECEIPT_EVENTS_MAX_SECONDS = 300
+
 CELERY_BROKER_URL = env("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = env("CELERY_RESULT_BACKEND")
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'build-covisitation-model': {
+        'task': 'apps.restaurants.tasks.build_covisitation_model',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'refresh-restaurant-stats': {
+        'task': 'apps.restaurants.tasks.refresh_restaurant_stats',
+        'schedule': crontab(minute='*/30'),
+    },
+    # Recommendation traffic peaks between 11:30 and 13:30 (TIME_ZONE)
+    'prewarm-recommendations': {
+        'task': 'apps.restaurants.tasks.prewarm_recommendations',
+        'schedule': crontab(hour=11, minute=0, day_of_week='mon-fri'),
+    },
+    'purge-receipt-tombstones': {
+        'task': 'apps.receipts.tasks.purge_receipt_tombstones',
+        'schedule': crontab(hour=4, minute=0),
+    },
+}
+
+# Lunch pre-warming: at most MAX_USERS users active in the last ACTIVE_DAYS,
+# BATCH_SIZE users per task, one batch every BATCH_INTERVAL seconds
+RECOMMENDATION_PREWARM_ACTIVE_DAYS = 30
+RECOMMENDATION_PREWARM_MAX_USERS = env.int('RECOMMENDATION_PREWARM_MAX_USERS', default=5000)
+RECOMMENDATION_PREWARM_BATCH_SIZE = 200
+RECOMMENDATION_PREWARM_BATCH_INTERVAL = 10
+
+# Ranked recommendations kept per paging snapshot, and for how long
+RECOMMENDATION_SNAPSHOT_SIZE = 200
+RECOMMENDATION_SNAPSHOT_TTL = 900
+
+# Receipt address geocoding, any geopy service; results are kept in GeocodedAddress
+RECEIPT_GEOCODER = {
+    'BACKEND': 'apps.receipts.services.geocoding_service.GeopyGeocoder',
+    'OPTIONS': {
+        'service': env('RECEIPT_GEOCODER_SERVICE', default='nominatim'),
+        'user_agent': 'lunchlog',
+    },
+}
+
+# Spending heatmaps are cached per users and range, receipt changes invalidate them
+SPENDING_HEATMAP_CACHE_TTL = 3600
+
+# Receipt delta sync: deletions are kept this long (older sync tokens get 410
+# and clients resync), changes are served once they are SETTLE_SECONDS old
+RECEIPT_TOMBSTONE_RETENTION_DAYS = 30
+RECEIPT_SYNC_SETTLE_SECONDS = 5
 
 # Google Places API
 GOOGLE_PLACES_API_KEY = env('GOOGLE_PLACES_API_KEY')